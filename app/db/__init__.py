@@ -1,4 +1,12 @@
-from .message_store import MessageStore, append_message, save_messages, get_messages, session_exists, delete_session_messages
-
-__all__ = ['MessageStore', 'append_message', 'save_messages', 'get_messages', 'session_exists', 'delete_session_messages']
+from .message_store import MessageStore, append_message, append_messages, save_messages, get_messages, session_exists, delete_session_messages
+from .message_store import HistoryBase, load_history, async_load_history
+from .message_store import write_stats, history_cache_stats, compression_stats
+from .session_lock import session_write_lock, session_lock_stats
+from .backends import MessageBackend, SupabaseBackend, SQLiteBackend, SchemaError, get_backend, set_backend
+from .message_store import async_append_message, async_append_messages, async_save_messages, async_get_messages
 
+__all__ = ['MessageStore', 'append_message', 'append_messages', 'save_messages', 'get_messages', 'session_exists',
+           'delete_session_messages', 'async_append_message', 'async_append_messages', 'async_save_messages',
+           'async_get_messages', 'HistoryBase', 'load_history', 'async_load_history', 'session_write_lock',
+           'session_lock_stats', 'write_stats', 'history_cache_stats', 'compression_stats',
+           'MessageBackend', 'SupabaseBackend', 'SQLiteBackend', 'SchemaError', 'get_backend', 'set_backend']
@@ -0,0 +1,374 @@
+"""
+Storage engines behind MessageStore
+MessageStore keeps the history logic (diffing, caching, compression, blob
+references); a backend only moves llm_messages rows. SupabaseBackend talks to
+PostgREST as before, SQLiteBackend is an embedded engine for single-node
+deployments and reproducible local benchmarks. MESSAGE_STORE_BACKEND selects
+one ("supabase" by default, or "sqlite")
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MESSAGE_STORE_BACKEND = os.getenv("MESSAGE_STORE_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("MESSAGE_STORE_SQLITE_PATH", "Data/llm_messages.db")
+
+# Columns a caller may read back
+COLUMNS = ("id", "user_id", "session_id", "role", "content", "content_encoding", "content_hash", "sequence", "created_at")
+
+
+# PostgREST / PostgreSQL codes for a database function that does not exist
+_MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+
+
+class SchemaError(RuntimeError):
+    """The database is missing objects from create_messages_table.sql (re-run the script)"""
+
+
+def _not_null(rows: List[Dict]) -> List[Dict]:
+    """Rows with None content stored as "" (llm_messages.content is NOT NULL in both schemas)"""
+    return [dict(row, content="") if row.get("content") is None else row for row in rows]
+
+
+class MessageBackend:
+    """Row operations MessageStore needs from an llm_messages engine"""
+
+    name = "base"
+
+    def fetch_index(self, session_id: str) -> List[Dict]:
+        """(id, sequence, content_hash) of every row of a session, by sequence"""
+        raise NotImplementedError
+
+    def fetch_rows(self, session_id: str, columns: Sequence[str], since_sequence: int = None,
+                   last_n: int = None, limit: int = None) -> List[Dict]:
+        """Selected columns of a session's rows in sequence order (see MessageStore.get_messages)"""
+        raise NotImplementedError
+
+    def version(self, session_id: str) -> Tuple[int, Optional[int]]:
+        """(row count, max row id) of a session"""
+        raise NotImplementedError
+
+    def insert_rows(self, rows: List[Dict]) -> Optional[int]:
+        """Insert rows as given in one statement/request; returns the largest new id"""
+        raise NotImplementedError
+
+    def append_rows(self, user_id: str, session_id: str, rows: List[Dict]) -> Tuple[int, Optional[int]]:
+        """Atomically number rows after the session's last sequence and insert them; returns (first sequence, last id)"""
+        raise NotImplementedError
+
+    def delete_from(self, session_id: str, sequence: int = 0):
+        """Delete a session's rows with sequence >= sequence"""
+        raise NotImplementedError
+
+    def exists(self, session_id: str) -> bool:
+        """Whether a session has any rows"""
+        raise NotImplementedError
+
+    def list_sessions(self) -> List[Tuple[str, str]]:
+        """(user_id, session_id) of every session with rows (maintenance scans, not request paths)"""
+        raise NotImplementedError
+
+    def acquire_lease(self, session_id: str, owner: str, ttl_seconds: int) -> bool:
+        """Take a session's write lease if it is free, expired or already owner's"""
+        raise NotImplementedError
+
+    def release_lease(self, session_id: str, owner: str):
+        """Give up a write lease (no-op if owner no longer holds it)"""
+        raise NotImplementedError
+
+
+class SupabaseBackend(MessageBackend):
+    """llm_messages in Supabase PostgreSQL via PostgREST (schema: create_messages_table.sql)"""
+
+    name = "supabase"
+
+    def __init__(self, client=None):
+        if client is None:
+            from supabase import create_client
+            client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+        self.client = client
+
+    def _rpc(self, name: str, params: Dict):
+        try:
+            return self.client.rpc(name, params).execute()
+        except Exception as e:
+            if getattr(e, "code", None) in _MISSING_FUNCTION_CODES:
+                raise SchemaError(f"Database function {name} does not exist, run create_messages_table.sql") from e
+            raise
+
+    def fetch_index(self, session_id):
+        return self.client.table("llm_messages")\
+            .select("id, sequence, content_hash")\
+            .eq("session_id", session_id)\
+            .order("sequence")\
+            .execute().data
+
+    def fetch_rows(self, session_id, columns, since_sequence=None, last_n=None, limit=None):
+        query = self.client.table("llm_messages")\
+            .select(", ".join(columns))\
+            .eq("session_id", session_id)
+        if since_sequence is not None:
+            query = query.gte("sequence", since_sequence)
+        if last_n is not None:
+            query = query.order("sequence", desc=True).limit(last_n)
+        else:
+            query = query.order("sequence")
+            if limit is not None:
+                query = query.limit(limit)
+        rows = query.execute().data
+        if last_n is not None:
+            rows.reverse()
+        return rows
+
+    def version(self, session_id):
+        response = self.client.table("llm_messages")\
+            .select("id", count="exact")\
+            .eq("session_id", session_id)\
+            .order("id", desc=True)\
+            .limit(1)\
+            .execute()
+        return response.count or 0, response.data[0]["id"] if response.data else None
+
+    def insert_rows(self, rows):
+        response = self.client.table("llm_messages").insert(_not_null(rows)).execute()
+        return max((row["id"] for row in response.data or [] if row.get("id") is not None), default=None)
+
+    def append_rows(self, user_id, session_id, rows):
+        # append_llm_messages allocates sequences under a per-session advisory lock
+        response = self._rpc("append_llm_messages", {
+            "p_user_id": user_id,
+            "p_session_id": session_id,
+            "p_messages": [
+                {"role": row["role"], "content": row["content"], "content_encoding": row["content_encoding"],
+                 "content_hash": row["content_hash"]}
+                for row in _not_null(rows)
+            ]
+        })
+        result = response.data[0] if isinstance(response.data, list) else response.data
+        return result["first_sequence"], result["last_id"]
+
+    def delete_from(self, session_id, sequence=0):
+        query = self.client.table("llm_messages").delete().eq("session_id", session_id)
+        if sequence:
+            query = query.gte("sequence", sequence)
+        query.execute()
+
+    def exists(self, session_id):
+        response = self.client.table("llm_messages")\
+            .select("id", count="exact")\
+            .eq("session_id", session_id)\
+            .limit(1)\
+            .execute()
+        return (response.count or 0) > 0
+
+    def list_sessions(self, page_size: int = 1000):
+        # PostgREST has no DISTINCT; every non-empty session has exactly one row at sequence 0
+        sessions, offset = [], 0
+        while True:
+            response = self.client.table("llm_messages")\
+                .select("user_id, session_id")\
+                .eq("sequence", 0)\
+                .order("id")\
+                .range(offset, offset + page_size - 1)\
+                .execute()
+            sessions.extend((row["user_id"], row["session_id"]) for row in response.data or [])
+            if len(response.data or []) < page_size:
+                return sessions
+            offset += page_size
+
+    def acquire_lease(self, session_id, owner, ttl_seconds):
+        # A PostgREST call is its own transaction, so a session-level advisory
+        # lock could not outlive it; leases are rows in llm_session_locks instead
+        response = self._rpc("acquire_llm_session_lock", {
+            "p_session_id": session_id, "p_owner": owner, "p_ttl_seconds": ttl_seconds
+        })
+        return bool(response.data)
+
+    def release_lease(self, session_id, owner):
+        self._rpc("release_llm_session_lock", {"p_session_id": session_id, "p_owner": owner})
+
+
+class SQLiteBackend(MessageBackend):
+    """
+    llm_messages in an embedded SQLite database.
+
+    WAL mode lets readers run alongside the single writer; every thread gets
+    its own connection, and all statements are constant parameterised SQL so
+    sqlite3 reuses the prepared statements from its per-connection cache.
+    Appends take the write lock up front (BEGIN IMMEDIATE), which gives the
+    same atomic sequence allocation as the append_llm_messages function.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS llm_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            sequence INTEGER NOT NULL,
+            content_hash TEXT,
+            content_encoding TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_llm_messages_sequence ON llm_messages(session_id, sequence);
+        CREATE INDEX IF NOT EXISTS idx_llm_messages_user ON llm_messages(user_id);
+        CREATE TABLE IF NOT EXISTS llm_session_locks (
+            session_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    """
+    INSERT = (
+        "INSERT INTO llm_messages (user_id, session_id, role, content, content_encoding, content_hash, sequence) "
+        "VALUES (:user_id, :session_id, :role, :content, :content_encoding, :content_hash, :sequence)"
+    )
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._uri = False
+        if path == ":memory:":
+            # A plain :memory: database is private to one connection, i.e. to one thread here;
+            # a named shared-cache database is seen by every thread's connection
+            self.path, self._uri = f"file:llm_messages_{id(self)}?mode=memory&cache=shared", True
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        # Also keeps an in-memory database alive while other threads connect and disconnect
+        self._keepalive = self._connect()
+        self._keepalive.executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly where needed
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256, uri=self._uri)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def fetch_index(self, session_id):
+        rows = self._connect().execute(
+            "SELECT id, sequence, content_hash FROM llm_messages WHERE session_id = ? ORDER BY sequence",
+            (session_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def fetch_rows(self, session_id, columns, since_sequence=None, last_n=None, limit=None):
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown llm_messages columns: {sorted(unknown)}")
+        # Column lists come from the fixed set above; everything else is a bound parameter
+        sql = f"SELECT {', '.join(columns)} FROM llm_messages WHERE session_id = ? AND sequence >= ?"
+        params = [session_id, since_sequence or 0]
+        if last_n is not None:
+            sql += " ORDER BY sequence DESC LIMIT ?"
+            params.append(last_n)
+        else:
+            sql += " ORDER BY sequence LIMIT ?"
+            params.append(-1 if limit is None else limit)
+        rows = [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+        if last_n is not None:
+            rows.reverse()
+        return rows
+
+    def version(self, session_id):
+        row = self._connect().execute(
+            "SELECT COUNT(*), MAX(id) FROM llm_messages WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0], row[1]
+
+    def insert_rows(self, rows):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(self.INSERT, [dict(row) for row in _not_null(rows)])
+            max_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return max_id if rows else None
+
+    def append_rows(self, user_id, session_id, rows):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            next_sequence = conn.execute(
+                "SELECT COALESCE(MAX(sequence) + 1, 0) FROM llm_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            conn.executemany(self.INSERT, [
+                dict(row, user_id=user_id, session_id=session_id, sequence=next_sequence + i)
+                for i, row in enumerate(_not_null(rows))
+            ])
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return next_sequence, last_id
+
+    def delete_from(self, session_id, sequence=0):
+        self._connect().execute("DELETE FROM llm_messages WHERE session_id = ? AND sequence >= ?", (session_id, sequence))
+
+    def exists(self, session_id):
+        return self._connect().execute(
+            "SELECT 1 FROM llm_messages WHERE session_id = ? LIMIT 1", (session_id,)
+        ).fetchone() is not None
+
+    def list_sessions(self):
+        rows = self._connect().execute(
+            "SELECT user_id, session_id FROM llm_messages WHERE sequence = 0 ORDER BY id"
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def acquire_lease(self, session_id, owner, ttl_seconds):
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO llm_session_locks (session_id, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE llm_session_locks.expires_at < ? OR llm_session_locks.owner = excluded.owner",
+            (session_id, owner, now + ttl_seconds, now)
+        )
+        return cursor.rowcount > 0
+
+    def release_lease(self, session_id, owner):
+        self._connect().execute("DELETE FROM llm_session_locks WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+
+_backend: Optional[MessageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> MessageBackend:
+    """The configured backend (built on first use)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if MESSAGE_STORE_BACKEND == "sqlite":
+                    _backend = SQLiteBackend()
+                elif MESSAGE_STORE_BACKEND == "supabase":
+                    _backend = SupabaseBackend()
+                else:
+                    raise ValueError(f"Unknown MESSAGE_STORE_BACKEND '{MESSAGE_STORE_BACKEND}' (use 'supabase' or 'sqlite')")
+    return _backend
+
+
+def set_backend(backend: MessageBackend):
+    """Swap the backend (scripts, benchmarks)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
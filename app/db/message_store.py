@@ -1,24 +1,306 @@
 """
-Simple message storage using Supabase PostgreSQL
+Simple message storage using Supabase PostgreSQL (or embedded SQLite)
 No foreign keys to avoid conflicts with Prisma's users table
+The storage engine is pluggable, see app/db/backends.py
 """
-from supabase import create_client
 import os
 import json
+import base64
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from app.utils.async_runtime import run_blocking
+from app.utils.metrics import stage, observe, current_command
+from app.utils.blob_store import dehydrate_messages
+from app.db.backends import SchemaError, get_backend
+from app.db.session_lock import session_write_lock
+
+try:
+    import zstandard
+except ImportError:  # optional - zlib is used when it is not installed
+    zstandard = None
 
 load_dotenv()
 
-# Initialize Supabase client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# Multi-row insert limits: rows per request, and request body size (image
+# messages carry base64 data, so a few of them can fill a request on their own)
+INSERT_BATCH_SIZE = int(os.getenv("MESSAGE_INSERT_BATCH_SIZE", 500))
+INSERT_BATCH_MAX_BYTES = int(os.getenv("MESSAGE_INSERT_BATCH_MAX_BYTES", 4 * 1024 * 1024))
+
+# Decoded session histories kept per worker (0 disables the cache)
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+# Content larger than this is stored compressed ("zstd", "zlib" or "off");
+# the codec is recorded per row in content_encoding (NULL = plain text)
+COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "zstd" if zstandard else "zlib").lower()
+COMPRESS_MIN_BYTES = int(os.getenv("MESSAGE_COMPRESS_MIN_BYTES", 2048))
+
+_compression_stats = {
+    "rows_compressed": 0, "written_raw_bytes": 0, "written_stored_bytes": 0,
+    "read_raw_bytes": 0, "read_stored_bytes": 0,
+}
+_compression_lock = threading.Lock()
+
+# Rows written by save_messages per command (served on /metrics)
+_write_stats: Dict[str, Dict[str, int]] = {}
+_write_stats_lock = threading.Lock()
+
+
+def _serialize_content(content) -> str:
+    """Content as stored in llm_messages.content (complex content becomes a JSON string, None an empty one)"""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return json.dumps(content)
+
+
+def _decode_content(content):
+    """Inverse of _serialize_content as applied on read: only JSON objects / arrays come back decoded"""
+    if not isinstance(content, str) or content[:1] not in ("{", "["):
+        return content
+    try:
+        decoded = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        return content  # Keep as string
+    return decoded if isinstance(decoded, (dict, list)) else content
+
+
+def _text_size(text) -> int:
+    return len(text) if isinstance(text, str) else 0
+
+
+def _compress(text: str) -> Tuple[str, Optional[str]]:
+    """(stored content, content_encoding) - compressed and base64'd when that makes it smaller"""
+    stored, encoding = text, None
+    if COMPRESSION != "off" and _text_size(text) >= COMPRESS_MIN_BYTES:
+        raw = text.encode("utf-8")
+        if COMPRESSION == "zstd" and zstandard is not None:
+            packed, codec = zstandard.ZstdCompressor(level=6).compress(raw), "zstd"
+        else:
+            packed, codec = zlib.compress(raw, 6), "zlib"
+        candidate = base64.b64encode(packed).decode("ascii")
+        if len(candidate) < len(text):
+            stored, encoding = candidate, f"{codec}+b64"
+
+    with _compression_lock:
+        _compression_stats["rows_compressed"] += int(encoding is not None)
+        _compression_stats["written_raw_bytes"] += _text_size(text)
+        _compression_stats["written_stored_bytes"] += _text_size(stored)
+    return stored, encoding
+
+
+def _decompress(stored: str, encoding: Optional[str]) -> str:
+    """Inverse of _compress (rows written before compression have no encoding)"""
+    if not encoding:
+        text = stored
+    elif encoding == "zlib+b64":
+        text = zlib.decompress(base64.b64decode(stored)).decode("utf-8")
+    elif encoding == "zstd+b64":
+        if zstandard is None:
+            raise RuntimeError("llm_messages row is zstd-compressed but the 'zstandard' package is not installed")
+        text = zstandard.ZstdDecompressor().decompress(base64.b64decode(stored)).decode("utf-8")
+    else:
+        raise ValueError(f"Unknown content_encoding '{encoding}'")
+
+    with _compression_lock:
+        _compression_stats["read_raw_bytes"] += _text_size(text)
+        _compression_stats["read_stored_bytes"] += _text_size(stored)
+    return text
+
+
+def _as_read(rows: List[Dict]) -> Tuple[List[Dict], int]:
+    """Messages in the shape get_messages returns them, and their size, for caching after a write"""
+    messages, size = [], 0
+    for row in rows:
+        text = _decompress(row["content"], row.get("content_encoding"))
+        size += _text_size(text)
+        messages.append({"role": row["role"], "content": _decode_content(text)})
+    return messages, size
+
+
+def content_hash(role: str, content) -> str:
+    """Stable hash of a message as stored, used to detect the unchanged prefix of a history"""
+    return hashlib.sha256(f"{role}\x00{_serialize_content(content)}".encode("utf-8")).hexdigest()
+
+
+def build_message_rows(user_id: str, session_id: str, messages: List[Dict], start_sequence: int = 0) -> List[Dict]:
+    """llm_messages rows for a run of messages, numbered from start_sequence (inline images go to the blob store)"""
+    rows = []
+    for i, msg in enumerate(dehydrate_messages(messages), start=start_sequence):
+        role = msg.get("role", "user")
+        content = msg.get("content", "")
+        stored, encoding = _compress(_serialize_content(content))
+        rows.append({
+            "user_id": user_id,
+            "session_id": session_id,
+            "role": role,
+            "content": stored,
+            "content_encoding": encoding,
+            "content_hash": content_hash(role, content),
+            "sequence": i
+        })
+    return rows
+
+
+def _record_write(rows_inserted: int, rows_deleted: int, rewrite: bool, rebased: bool = False):
+    with _write_stats_lock:
+        stats = _write_stats.setdefault(current_command.get(), {
+            "saves": 0, "unchanged": 0, "appends": 0, "rewrites": 0, "rebased": 0, "rows_inserted": 0, "rows_deleted": 0
+        })
+        stats["saves"] += 1
+        stats["rows_inserted"] += rows_inserted
+        stats["rows_deleted"] += rows_deleted
+        if rebased:
+            stats["rebased"] += 1
+        elif rewrite:
+            stats["rewrites"] += 1
+        elif rows_inserted:
+            stats["appends"] += 1
+        else:
+            stats["unchanged"] += 1
+
+
+def write_stats() -> Dict[str, Dict[str, int]]:
+    """save_messages outcomes and rows written per command"""
+    with _write_stats_lock:
+        return {command: dict(stats) for command, stats in _write_stats.items()}
+
+
+def compression_stats() -> Dict:
+    """Content bytes before/after compression, for writes and for reads from the database"""
+    with _compression_lock:
+        stats = dict(_compression_stats)
+    stats["codec"] = COMPRESSION if COMPRESSION != "zstd" or zstandard else "zlib"
+    stats["written_bytes_saved"] = stats["written_raw_bytes"] - stats["written_stored_bytes"]
+    stats["read_bytes_saved"] = stats["read_raw_bytes"] - stats["read_stored_bytes"]
+    return stats
+
+
+class HistoryCache:
+    """
+    Bounded LRU of decoded session histories.
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    Entries are stamped with the session's version, (row count, max row id):
+    every insert allocates a new id and every delete changes the count, so a
+    matching stamp means the stored rows are the cached ones. Callers get a
+    fresh list of message dicts (content values are shared, not copied), so
+    appending to a returned history does not touch the cache.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple, List[Dict], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, session_id: str, version: Tuple) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry[0] != version:
+                self.stats["stale"] += 1
+                self._drop(session_id)
+                return None
+            self._entries.move_to_end(session_id)
+            self.stats["hits"] += 1
+            return [dict(m) for m in entry[1]]
+
+    def peek(self, session_id: str) -> Optional[Tuple[Tuple, List[Dict], int]]:
+        """Current entry without touching LRU order or stats"""
+        with self._lock:
+            return self._entries.get(session_id)
+
+    def put(self, session_id: str, version: Tuple, messages: List[Dict], size: int):
+        if size > self.max_bytes:
+            self.invalidate(session_id)
+            return
+        with self._lock:
+            self._drop(session_id)
+            self._entries[session_id] = (version, [dict(m) for m in messages], size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"] + self.stats["stale"]
+            return dict(
+                self.stats,
+                sessions=len(self._entries),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+                hit_rate=round(self.stats["hits"] / lookups, 3) if lookups else None,
+            )
+
+
+history_cache = HistoryCache()
+
+
+# Messages a read is matched back against when another command wrote in between
+BASE_TAIL_MESSAGES = 2
+
+
+class HistoryBase:
+    """
+    What a command read (see load_history): the session's version stamp and
+    the hashes of its last messages. save_messages compares it with the stored
+    version and advances it after each write, so a handler can save several
+    times against one read.
+    """
+
+    __slots__ = ("version", "tail_hashes")
+
+    def __init__(self, version: Tuple[int, Optional[int]], tail_hashes: Tuple[str, ...]):
+        self.version = version
+        self.tail_hashes = tail_hashes
+
+    @classmethod
+    def of(cls, version: Tuple[int, Optional[int]], messages: List[Dict]) -> "HistoryBase":
+        tail = messages[-BASE_TAIL_MESSAGES:] if messages else []
+        return cls(version, tuple(content_hash(m.get("role", "user"), m.get("content", "")) for m in tail))
+
+    def __repr__(self):
+        return f"HistoryBase(version={self.version})"
+
+
+def _rebase_point(rows: List[Dict], base: HistoryBase) -> Optional[int]:
+    """Index in rows right after the messages base was read with (None if they are not there)"""
+    n = len(base.tail_hashes)
+    if n == 0:
+        return 0
+    hashes = [row["content_hash"] for row in rows]
+    for i in range(len(hashes) - n, -1, -1):
+        if tuple(hashes[i:i + n]) == base.tail_hashes:
+            return i + n
+    return None
+
+
+def history_cache_stats() -> Dict:
+    """Session history cache hit rate and memory use"""
+    return history_cache.snapshot()
 
 
 class MessageStore:
-    """Handle message storage in Supabase"""
+    """Handle message storage (through the configured backend)"""
     
     @staticmethod
     def append_message(user_id: str, session_id: str, role: str, content) -> bool:
@@ -34,127 +316,272 @@ class MessageStore:
         Returns:
             bool: True if successful
         """
+        return MessageStore.append_messages(user_id, session_id, [{"role": role, "content": content}])
+    
+    @staticmethod
+    def append_messages(user_id: str, session_id: str, messages: List[Dict]) -> bool:
+        """
+        Append messages in one round trip
+        The backend allocates the next sequence numbers and inserts the rows in
+        a single transaction under a per-session lock (on Supabase, the
+        append_llm_messages database function in create_messages_table.sql),
+        so concurrent appends to the same session never share a sequence number.
+        
+        Args:
+            user_id: User ID
+            session_id: Session/Workspace ID
+            messages: List of message objects, e.g. a user + assistant turn
+        
+        Returns:
+            bool: True if successful
+        
+        Raises:
+            SchemaError: the database function is missing (the schema script was not run)
+        """
+        if not messages:
+            return True
         try:
-            # Get current max sequence number
-            response = supabase.table("llm_messages")\
-                .select("sequence")\
-                .eq("session_id", session_id)\
-                .order("sequence", desc=True)\
-                .limit(1)\
-                .execute()
-            
-            # Calculate next sequence
-            next_sequence = 0
-            if response.data:
-                next_sequence = response.data[0]["sequence"] + 1
-            
-            # Convert complex content to JSON string if needed
-            if isinstance(content, (dict, list)):
-                content = json.dumps(content)
-            
-            # Insert new message
-            supabase.table("llm_messages").insert({
-                "user_id": user_id,
-                "session_id": session_id,
-                "role": role,
-                "content": content,
-                "sequence": next_sequence
-            }).execute()
+            rows = build_message_rows(user_id, session_id, messages)
+            with session_write_lock(session_id):
+                first_sequence, last_id = get_backend().append_rows(user_id, session_id, rows)
+                
+                # Extend the cached history if it was current right before this append
+                cached = history_cache.peek(session_id)
+                if cached is not None and cached[0][0] == first_sequence:
+                    appended, size = _as_read(rows)
+                    history_cache.put(session_id, (first_sequence + len(rows), last_id),
+                                      cached[1] + appended, cached[2] + size)
+                else:
+                    history_cache.invalidate(session_id)
             
             return True
             
+        except SchemaError:
+            # Not transient: every append would be dropped until the schema is fixed
+            raise
         except Exception as e:
-            print(f"Error appending message: {e}")
+            print(f"Error appending messages: {e}")
             return False
     
     @staticmethod
-    def save_messages(user_id: str, session_id: str, messages: List[Dict]) -> bool:
+    def save_messages(user_id: str, session_id: str, messages: List[Dict], base: HistoryBase = None) -> bool:
         """
-        Save messages for a session (ONLY use for initialization)
-        Replaces all existing messages for this session
+        Save messages for a session (incremental)
+        Compares the stored (sequence, content_hash) rows with the new history and
+        only writes from the first differing message: a reply appended to an
+        unchanged history is a single batched insert of the new tail. Rows past
+        the divergence point are deleted first (e.g. after history compaction);
+        rows stored without a hash count as diverged and are rewritten once.
+        
+        Writes to one session are serialised (app/db/session_lock.py). With a
+        base from load_history the save is also checked optimistically: if
+        another command wrote to the session since the read, the stored rows are
+        kept and only the messages this command added after its read are
+        appended behind them, so overlapping commands both keep their turns.
         
         Args:
             user_id: User ID (reference to Prisma user, not a FK)
             session_id: Session/Workspace ID
             messages: List of message objects [{"role": "user", "content": "..."}]
+            base: What the history was read as (load_history); None overwrites
         
         Returns:
             bool: True if successful
         """
         try:
-            # First, delete existing messages for this session
-            supabase.table("llm_messages").delete().eq("session_id", session_id).execute()
-            
-            # Insert new messages with sequence numbers
-            for i, msg in enumerate(messages):
-                # Convert complex content (with images) to JSON string if needed
-                content = msg.get("content", "")
-                if isinstance(content, (dict, list)):
-                    content = json.dumps(content)
+            rows = build_message_rows(user_id, session_id, messages)
+            with session_write_lock(session_id):
+                backend = get_backend()
+                stored = backend.fetch_index(session_id)
+                version = (len(stored), max((row["id"] for row in stored), default=None))
+                
+                if base is not None and version != base.version:
+                    start = _rebase_point(rows, base)
+                    if start is not None:
+                        tail = rows[start:]
+                        if tail:
+                            backend.append_rows(user_id, session_id, tail)
+                        history_cache.invalidate(session_id)
+                        # This history no longer mirrors the stored one, so later saves against
+                        # the same base keep appending after its last messages
+                        base.version, base.tail_hashes = None, tuple(row["content_hash"] for row in rows[-BASE_TAIL_MESSAGES:])
+                        _record_write(len(tail), 0, rewrite=False, rebased=True)
+                        return True
+                    print(f"Warning: Session {session_id} changed since it was read and the new messages "
+                          f"could not be matched against it; overwriting")
+                
+                # Length of the unchanged prefix (sequence numbers are 0..n-1)
+                prefix = 0
+                for row in stored:
+                    if prefix >= len(rows) or row["sequence"] != prefix or row.get("content_hash") != rows[prefix]["content_hash"]:
+                        break
+                    prefix += 1
+                
+                # Drop everything stored from the divergence point on
+                rows_deleted = len(stored) - prefix
+                if rows_deleted:
+                    backend.delete_from(session_id, prefix)
                 
-                supabase.table("llm_messages").insert({
-                    "user_id": user_id,
-                    "session_id": session_id,
-                    "role": msg.get("role", "user"),
-                    "content": content,
-                    "sequence": i
-                }).execute()
+                # Insert the new tail with multi-row inserts
+                tail = rows[prefix:]
+                timings = MessageStore.bulk_insert(tail)
+                
+                ids = [row["id"] for row in stored[:prefix]] + [t["max_id"] for t in timings if t["max_id"] is not None]
+                version = (len(messages), max(ids, default=None))
+                history_cache.put(session_id, version, *_as_read(rows))
+                if base is not None:
+                    base.version, base.tail_hashes = version, tuple(row["content_hash"] for row in rows[-BASE_TAIL_MESSAGES:])
             
+            _record_write(len(tail), rows_deleted, rewrite=rows_deleted > 0)
             return True
             
         except Exception as e:
+            history_cache.invalidate(session_id)
             print(f"Error saving messages: {e}")
             return False
     
     @staticmethod
-    def get_messages(session_id: str) -> List[Dict]:
+    def bulk_insert(rows: List[Dict], batch_size: int = None, max_batch_bytes: int = None) -> List[Dict]:
         """
-        Get all messages for a session in order
+        Insert rows into llm_messages with multi-row inserts
+        Rows are sent in order, batch_size rows per request at most, and a batch
+        is closed early when its body would exceed max_batch_bytes (a single
+        larger row is sent on its own). Raises on the first failed batch.
+        
+        Args:
+            rows: llm_messages rows (see build_message_rows)
+            batch_size: Rows per request (default MESSAGE_INSERT_BATCH_SIZE)
+            max_batch_bytes: Approximate request body limit (default MESSAGE_INSERT_BATCH_MAX_BYTES)
+        
+        Returns:
+            List of per-batch timings [{"rows": n, "bytes": n, "seconds": s, "max_id": id}]
+        """
+        batch_size = batch_size or INSERT_BATCH_SIZE
+        max_batch_bytes = max_batch_bytes or INSERT_BATCH_MAX_BYTES
+        
+        batches = []
+        batch, batch_bytes = [], 0
+        for row in rows:
+            row_bytes = len(json.dumps(row, default=str))  # the row as serialised into the request body
+            if batch and (len(batch) >= batch_size or batch_bytes + row_bytes > max_batch_bytes):
+                batches.append((batch, batch_bytes))
+                batch, batch_bytes = [], 0
+            batch.append(row)
+            batch_bytes += row_bytes
+        if batch:
+            batches.append((batch, batch_bytes))
+        
+        backend = get_backend()
+        timings = []
+        for batch, batch_bytes in batches:
+            start = time.perf_counter()
+            max_id = backend.insert_rows(batch)
+            elapsed = time.perf_counter() - start
+            observe("db.insert_batch", elapsed)
+            timings.append({"rows": len(batch), "bytes": batch_bytes, "seconds": round(elapsed, 4), "max_id": max_id})
+        return timings
+    
+    @staticmethod
+    def get_messages(session_id: str, since_sequence: int = None, last_n: int = None, limit: int = None,
+                     columns: Tuple[str, ...] = None) -> List[Dict]:
+        """
+        Get messages for a session in order
+        With no window arguments the full history is returned, served from the
+        per-worker history cache when the session's version stamp (one indexed
+        count query) shows nothing changed since it was cached. Window reads
+        only fetch the requested rows (idx_llm_messages_sequence) unless the
+        session is already cached, and never populate the cache themselves.
         
         Args:
             session_id: Session/Workspace ID
+            since_sequence: Only messages with sequence >= since_sequence
+            last_n: Only the last n messages (after since_sequence)
+            limit: Page size counted forward from since_sequence (ignored with last_n)
+            columns: Fields to return, e.g. ("role", "sequence") for a role scan
+                     (default ("role", "content"))
         
         Returns:
             List of message objects [{"role": "user", "content": "..."}]
         """
         try:
-            response = supabase.table("llm_messages")\
-                .select("role, content, sequence")\
-                .eq("session_id", session_id)\
-                .order("sequence")\
-                .execute()
-            
-            messages = []
-            for row in response.data:
-                content = row["content"]
-                # Try to parse JSON content (for image messages)
-                try:
-                    content = json.loads(content)
-                except (json.JSONDecodeError, TypeError):
-                    pass  # Keep as string
-                
-                messages.append({
-                    "role": row["role"],
-                    "content": content
-                })
-            
-            return messages
+            if since_sequence is not None or last_n is not None or limit is not None or columns is not None:
+                return MessageStore._get_window(session_id, since_sequence, last_n, limit, columns or ("role", "content"))
+            return MessageStore._get_full(session_id)[0]
             
         except Exception as e:
             print(f"Error getting messages: {e}")
             return []
     
+    @staticmethod
+    def load_history(session_id: str) -> Tuple[List[Dict], Optional[HistoryBase]]:
+        """
+        Full history plus the base to hand to save_messages
+        For read-modify-write commands: the base lets save_messages detect and
+        merge writes made by other commands in the meantime.
+        
+        Returns:
+            (messages, base); base is None if the read failed
+        """
+        try:
+            messages, version = MessageStore._get_full(session_id)
+            return messages, HistoryBase.of(version, messages)
+            
+        except Exception as e:
+            print(f"Error getting messages: {e}")
+            return [], None
+    
+    @staticmethod
+    def _get_full(session_id: str) -> Tuple[List[Dict], Tuple[int, Optional[int]]]:
+        """Full history (history cache first) and the version it was read at"""
+        version = MessageStore.history_version(session_id)
+        cached = history_cache.get(session_id, version)
+        if cached is not None:
+            return cached, version
+        
+        rows = get_backend().fetch_rows(session_id, ("role", "content", "content_encoding", "sequence"))
+        
+        # Decompress, then try to parse JSON content (for image messages)
+        messages, size = _as_read(rows)
+        
+        # Version and rows are two reads; only cache them if nothing was written in between
+        if len(rows) == version[0]:
+            history_cache.put(session_id, version, messages, size)
+        return messages, version
+    
+    @staticmethod
+    def _get_window(session_id: str, since_sequence: Optional[int], last_n: Optional[int], limit: Optional[int],
+                    columns: Tuple[str, ...]) -> List[Dict]:
+        """Windowed / projected read behind get_messages"""
+        if history_cache.peek(session_id) is not None:
+            cached = history_cache.get(session_id, MessageStore.history_version(session_id))
+            if cached is not None:
+                # Cached histories are stored contiguously, so list position == sequence
+                rows = [{"role": m["role"], "content": m["content"], "sequence": i} for i, m in enumerate(cached)]
+                rows = rows[since_sequence or 0:]
+                if last_n is not None:
+                    rows = rows[-last_n:] if last_n else []
+                elif limit is not None:
+                    rows = rows[:limit]
+                return [{c: row.get(c) for c in columns} for row in rows]
+        
+        selected = list(columns) + (["content_encoding"] if "content" in columns and "content_encoding" not in columns else [])
+        rows = get_backend().fetch_rows(session_id, selected, since_sequence, last_n, limit)
+        
+        if "content" in columns:
+            for row in rows:
+                row["content"] = _decode_content(_decompress(row["content"], row.get("content_encoding")))
+        return [{c: row.get(c) for c in columns} for row in rows]
+    
+    @staticmethod
+    def history_version(session_id: str) -> Tuple[int, Optional[int]]:
+        """Version stamp of a session's stored rows: (row count, max row id)"""
+        return get_backend().version(session_id)
+    
     @staticmethod
     def session_exists(session_id: str) -> bool:
         """Check if a session has any messages"""
         try:
-            response = supabase.table("llm_messages")\
-                .select("id", count="exact")\
-                .eq("session_id", session_id)\
-                .limit(1)\
-                .execute()
-            
-            return response.count > 0
+            return get_backend().exists(session_id)
             
         except Exception as e:
             print(f"Error checking session: {e}")
@@ -164,9 +591,12 @@ class MessageStore:
     def delete_session_messages(session_id: str) -> bool:
         """Delete all messages for a session"""
         try:
-            supabase.table("llm_messages").delete().eq("session_id", session_id).execute()
+            with session_write_lock(session_id):
+                get_backend().delete_from(session_id)
+                history_cache.invalidate(session_id)
             return True
         except Exception as e:
+            history_cache.invalidate(session_id)
             print(f"Error deleting messages: {e}")
             return False
 
@@ -174,17 +604,33 @@ class MessageStore:
 # Convenience functions
 def append_message(user_id: str, session_id: str, role: str, content) -> bool:
     """Append a single message (efficient)"""
-    return MessageStore.append_message(user_id, session_id, role, content)
+    with stage("db.append_message"):
+        return MessageStore.append_message(user_id, session_id, role, content)
+
+
+def append_messages(user_id: str, session_id: str, messages: List[Dict]) -> bool:
+    """Append several messages (e.g. a user + assistant turn) in one round trip"""
+    with stage("db.append_messages"):
+        return MessageStore.append_messages(user_id, session_id, messages)
 
 
-def save_messages(user_id: str, session_id: str, messages: List[Dict]) -> bool:
-    """Save messages to Supabase (only use for initialization)"""
-    return MessageStore.save_messages(user_id, session_id, messages)
+def save_messages(user_id: str, session_id: str, messages: List[Dict], base: HistoryBase = None) -> bool:
+    """Save messages to Supabase (writes only what changed; pass the base from load_history)"""
+    with stage("db.save_messages"):
+        return MessageStore.save_messages(user_id, session_id, messages, base)
 
 
-def get_messages(session_id: str) -> List[Dict]:
-    """Get messages from Supabase"""
-    return MessageStore.get_messages(session_id)
+def get_messages(session_id: str, since_sequence: int = None, last_n: int = None, limit: int = None,
+                 columns: Tuple[str, ...] = None) -> List[Dict]:
+    """Get messages from Supabase (optionally a window / projection, see MessageStore.get_messages)"""
+    with stage("db.get_messages"):
+        return MessageStore.get_messages(session_id, since_sequence, last_n, limit, columns)
+
+
+def load_history(session_id: str) -> Tuple[List[Dict], Optional[HistoryBase]]:
+    """Get the full history for a read-modify-write command, with the base to save against"""
+    with stage("db.get_messages"):
+        return MessageStore.load_history(session_id)
 
 
 def session_exists(session_id: str) -> bool:
@@ -196,3 +642,31 @@ def delete_session_messages(session_id: str) -> bool:
     """Delete all messages for a session"""
     return MessageStore.delete_session_messages(session_id)
 
+
+# Async convenience functions (async command path)
+# Each call is a single short PostgREST round trip, so they run on the shared
+# blocking-IO pool instead of duplicating the store on a second client
+async def async_append_message(user_id: str, session_id: str, role: str, content) -> bool:
+    """Async variant of append_message"""
+    return await run_blocking(append_message, user_id, session_id, role, content)
+
+
+async def async_append_messages(user_id: str, session_id: str, messages: List[Dict]) -> bool:
+    """Async variant of append_messages"""
+    return await run_blocking(append_messages, user_id, session_id, messages)
+
+
+async def async_save_messages(user_id: str, session_id: str, messages: List[Dict], base: HistoryBase = None) -> bool:
+    """Async variant of save_messages"""
+    return await run_blocking(save_messages, user_id, session_id, messages, base)
+
+
+async def async_get_messages(session_id: str, since_sequence: int = None, last_n: int = None, limit: int = None,
+                             columns: Tuple[str, ...] = None) -> List[Dict]:
+    """Async variant of get_messages"""
+    return await run_blocking(get_messages, session_id, since_sequence, last_n, limit, columns)
+
+
+async def async_load_history(session_id: str) -> Tuple[List[Dict], Optional[HistoryBase]]:
+    """Async variant of load_history"""
+    return await run_blocking(load_history, session_id)
@@ -0,0 +1,143 @@
+"""
+Per-session write serialisation for llm_messages
+Writes to one session (save_messages, appends, deletes) run one at a time,
+while writes to different sessions stay fully parallel. Inside a worker this
+is a lock per session; with MESSAGE_STORE_DB_LOCK=on each write also holds a
+short lease in the database (llm_session_locks, see create_messages_table.sql)
+so writes from other workers and hosts are serialised as well
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import observe
+
+load_dotenv()
+
+# Cross-worker lease ("on" needs the llm_session_locks table and functions)
+DB_LOCK = os.getenv("MESSAGE_STORE_DB_LOCK", "off").lower() in ("1", "true", "on", "yes")
+# Lease lifetime; a worker that dies mid-write blocks the session for at most this long
+LOCK_TTL_SECONDS = int(os.getenv("MESSAGE_STORE_LOCK_TTL", 30))
+# How long a write waits for a session before giving up
+LOCK_TIMEOUT_SECONDS = float(os.getenv("MESSAGE_STORE_LOCK_TIMEOUT", 30))
+
+_OWNER_PREFIX = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class _SessionLock:
+    __slots__ = ("lock", "users", "depth", "lease")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = 0     # threads holding or waiting (entry is dropped at 0)
+        self.depth = 0     # re-entrant holds by the owning thread
+        self.lease = None  # lease owner id while the database lease is held
+
+
+_locks: Dict[str, _SessionLock] = {}
+_registry_lock = threading.Lock()
+_stats = {"acquired": 0, "contended": 0, "wait_seconds": 0.0, "lease_retries": 0, "timeouts": 0}
+
+
+def _acquire_lease(session_id: str) -> str:
+    """Take the session's database lease, retrying with backoff until LOCK_TIMEOUT_SECONDS"""
+    from app.db.backends import get_backend
+
+    backend = get_backend()
+    owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex}"
+    deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+    delay = 0.02
+    while not backend.acquire_lease(session_id, owner, LOCK_TTL_SECONDS):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Session {session_id} is locked by another worker")
+        with _registry_lock:
+            _stats["lease_retries"] += 1
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    return owner
+
+
+def _release_lease(session_id: str, owner: str):
+    from app.db.backends import get_backend
+
+    try:
+        get_backend().release_lease(session_id, owner)
+    except Exception as e:
+        # The lease expires on its own after LOCK_TTL_SECONDS
+        print(f"Warning: Failed to release lock for session {session_id}: {e}")
+
+
+@contextmanager
+def session_write_lock(session_id: str, lease: bool = None):
+    """
+    Hold the write lock of a session for the duration of the block.
+
+    Re-entrant within a thread (append_message -> append_messages takes it
+    once). Raises TimeoutError when the session stays locked for longer than
+    MESSAGE_STORE_LOCK_TIMEOUT seconds. lease=True takes the database lease
+    even with MESSAGE_STORE_DB_LOCK off (maintenance scripts running beside
+    the API); None follows the setting.
+    """
+    if lease is None:
+        lease = DB_LOCK
+    with _registry_lock:
+        entry = _locks.get(session_id)
+        if entry is None:
+            entry = _locks[session_id] = _SessionLock()
+        entry.users += 1
+
+    start = time.perf_counter()
+    try:
+        acquired = entry.lock.acquire(blocking=False)
+        if not acquired:
+            with _registry_lock:
+                _stats["contended"] += 1
+            acquired = entry.lock.acquire(timeout=LOCK_TIMEOUT_SECONDS)
+        if not acquired:
+            with _registry_lock:
+                _stats["timeouts"] += 1
+            raise TimeoutError(f"Session {session_id} is busy")
+
+        try:
+            if entry.depth == 0 and lease:
+                try:
+                    entry.lease = _acquire_lease(session_id)
+                except TimeoutError:
+                    with _registry_lock:
+                        _stats["timeouts"] += 1
+                    raise
+            waited = time.perf_counter() - start
+            observe("db.session_lock_wait", waited)
+            with _registry_lock:
+                _stats["acquired"] += 1
+                _stats["wait_seconds"] += waited
+
+            entry.depth += 1
+            try:
+                yield
+            finally:
+                entry.depth -= 1
+                if entry.depth == 0 and entry.lease is not None:
+                    _release_lease(session_id, entry.lease)
+                    entry.lease = None
+        finally:
+            entry.lock.release()
+    finally:
+        with _registry_lock:
+            entry.users -= 1
+            if entry.users == 0:
+                _locks.pop(session_id, None)
+
+
+def session_lock_stats() -> Dict:
+    """Write lock acquisitions, contention and time spent waiting"""
+    with _registry_lock:
+        stats = dict(_stats, held=len(_locks), db_lock=DB_LOCK)
+    stats["wait_seconds"] = round(stats["wait_seconds"], 4)
+    return stats
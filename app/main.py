@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 import os
 import json
@@ -8,9 +8,16 @@ from datetime import datetime
 # from fileConverter import *
 from app.services.FileServices.file_service import read_pdf_images, read_pdf, read_images
 from app.services.FileServices.file_processor import process_file
-from app.services.StudyServices.study_guide_service import generate_summary, generate_mindmap_mermaid
-from app.services.StudyServices.flashcard_service import generate_flashcards_q, generate_flashcards_a, generate_flashcards_json
-from app.services.StudyServices.worksheet_service import generate_worksheet_q, generate_worksheet_a, generate_worksheet_json, mark_question
+from app.services.StudyServices.study_guide_service import (
+    generate_summary,
+    generate_mindmap_mermaid,
+    generate_summary_stream,
+    generate_mindmap_mermaid_stream,
+    async_generate_summary,
+    async_generate_mindmap_mermaid
+)
+from app.services.StudyServices.flashcard_service import generate_flashcards_q, generate_flashcards_a, generate_flashcards_json, generate_flashcards
+from app.services.StudyServices.worksheet_service import generate_worksheet_q, generate_worksheet_a, generate_worksheet_json, generate_worksheet, mark_question
 from app.services.StudyServices.podcast_service import (
     generate_podcast_script,
     generate_podcast_structure,
@@ -19,19 +26,36 @@ from app.services.StudyServices.podcast_service import (
     estimate_segment_duration,
     create_full_transcript
 )
-from app.services.StudyServices.comprehension_check_service import generate_segmentation, validate_summary_correctness
-from app.services.ChatService.chat_service import prompt_input
+from app.services.StudyServices.comprehension_check_service import (
+    generate_segmentation,
+    validate_summary_correctness,
+    async_generate_segmentation,
+    async_validate_summary_correctness
+)
+from app.services.ChatService.chat_service import prompt_input, prompt_input_stream, async_prompt_input
 from app.utils.utils import update_memory, safe_json_parse
-from app.db import append_message, save_messages, get_messages
+from app.db import append_message, append_messages, save_messages, load_history, write_stats, history_cache_stats
+from app.db import async_load_history, async_save_messages, async_append_messages, compression_stats, session_lock_stats
+from app.utils.async_runtime import run_coroutine, run_blocking
+from app.utils.context_window import window_history, recent_history, context_window_stats
+from app.utils import metrics
+from app.utils.metrics import stage
+from app.utils.single_flight import SingleFlight, request_key
 import requests
 from markdownConvertor import *
 converter = MarkdownToEditorJS()
 import shutil
 from app.models.LLM_inference import LLM_inference
+from app.models.client_registry import get_client, pool_stats
+from app.models.response_cache import cache_stats
+from app.models.transport import transport_stats
+from app.utils.blob_store import blob_stats
+from app.utils.workspace_context import workspace_context_cache_stats
+from app.utils.context_packer import context_packing_stats
+from app.utils.retrieval_index import index_file, retrieval_stats
 from dotenv import load_dotenv
 from app.models.eleven_labs import *
 from supabase import create_client
-from openai import OpenAI
 from pydub import AudioSegment
 
 app = Flask(__name__)
@@ -89,7 +113,17 @@ def log_response(response):
     timestamp = datetime.now().strftime("%H:%M:%S")
     
     status_emoji = "✓" if response.status_code < 400 else "✗"
-    print(f"[{timestamp}] ← {status_emoji} {response.status_code} | {elapsed_time:.2f}s\n")
+    print(f"[{timestamp}] ← {status_emoji} {response.status_code} | {elapsed_time:.2f}s")
+
+    # Per-stage breakdown (LLM / DB / TTS / storage) for this request
+    stages = {}
+    for stage_name, seconds in getattr(g, "stages", []):
+        total, count = stages.get(stage_name, (0.0, 0))
+        stages[stage_name] = (total + seconds, count + 1)
+    if stages:
+        breakdown = " | ".join(f"{name} {total:.2f}s x{count}" for name, (total, count) in stages.items())
+        print(f"  stages: {breakdown}")
+    print()
     
     return response
 # ==================== END LOGGING MIDDLEWARE ====================
@@ -127,6 +161,17 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
+IMAGE_MODEL = "dall-e-2"
+
+# The init_session bootstrap prompt is constant, so is its answer
+INIT_SESSION_CACHE_TTL = 7 * 24 * 3600
+
+
+def upload_to_storage(path, file, file_options=None):
+    """Upload an object to the 'media' bucket (timed as the storage.upload stage)"""
+    with stage("storage.upload"):
+        return supabase.storage.from_("media").upload(path, file, file_options=file_options)
+
 
 
 
@@ -179,7 +224,7 @@ def init_session(request):
     ]  # Default instruction messages
 
     # Send initial message to Ollama to get assistant's first response
-    resp = LLM_inference(messages=messages)
+    resp = LLM_inference(messages=messages, cache_ttl=INIT_SESSION_CACHE_TTL)
     # Append only the assistant's message content
     messages.append({"role": "assistant", "content": resp.choices[0].message.content})
 
@@ -390,7 +435,7 @@ def analyse_pdf(request):
         return {"error": "Session not initialized."}, 400
    
 
-    messages = get_messages(session)
+    messages, base = load_history(session)
     pdf_dir_path = f"{ROOT_DIR}/{user}/{session}/pdfs"
     
     # Check if directory exists
@@ -413,7 +458,7 @@ def analyse_pdf(request):
     pdf_paths = [os.path.abspath(os.path.join(pdf_dir_path, entry)) for entry in entries]
     print(pdf_paths)
     messages = read_pdf(messages, pdf_paths)
-    save_messages(user, session, messages)
+    save_messages(user, session, messages, base=base)
 
     print(f"Analysing PDF texts Successful")
 
@@ -421,7 +466,7 @@ def analyse_pdf(request):
     os.makedirs(f"{img_saving_path}", exist_ok=True)
     messages = read_pdf_images(messages, pdf_paths, img_saving_path)
 
-    save_messages(user, session, messages)
+    save_messages(user, session, messages, base=base)
 
     print(f"Analysing PDF Image Content Successful")
 
@@ -453,7 +498,7 @@ def analyse_img(request):
     if not user or not session:
         return {"error": "Session not initialized."}, 400
 
-    messages = get_messages(session)
+    messages, base = load_history(session)
     img_dir_path = f"{ROOT_DIR}/{user}/{session}/imgs"
     
     # Check if directory exists
@@ -475,7 +520,7 @@ def analyse_img(request):
         
     img_paths = [os.path.abspath(os.path.join(img_dir_path, entry)) for entry in entries]
     messages = read_images(messages, img_paths)
-    save_messages(user, session, messages)
+    save_messages(user, session, messages, base=base)
 
     print(f"Analysing Images Successful")
     return {
@@ -491,7 +536,8 @@ def generate_study_guide(request):
     if not user or not session:
         return {"error": "Session not initialized."}, 400
 
-    messages = get_messages(session)
+    history, base = load_history(session)
+    messages = window_history(history, "generate_study_guide")
 
     messages = generate_summary(messages, workspace_id=session, user_id=user)
     markdown_text = messages[-1].get("content", "")
@@ -500,7 +546,7 @@ def generate_study_guide(request):
     mindmap_mermaid = messages[-1].get("content", "")
     print("Generating Study Guide Mindmap Successfully")
 
-    save_messages(user, session, messages)
+    save_messages(user, session, messages, base=base)
     
     # editorjs_json = converter.convert(markdown_text)
     # json_str = json.dumps(editorjs_json, indent=2, ensure_ascii=False)
@@ -524,17 +570,24 @@ def generate_flashcard_questions(request):
         print("Difficulty not Specified.")
         return {"error": "Difficulty not Specified."}, 400
 
+    # "fast" (default): one schema-constrained call; "legacy": question -> answer -> JSON chain
+    mode = request.form.get("mode", "fast")
+
     # --- Load message history ---
-    messages = get_messages(session)
+    history, base = load_history(session)
+    messages = window_history(history, "generate_flashcard_questions")
 
-    
-    messages = generate_flashcards_q(messages, num_questions, difficulty, workspace_id=session, user_id=user)
-    print("Generating Flashcard Questions Successful.")
-    messages = generate_flashcards_a(messages)
-    print("Generating Flashcard Answers Successful.")
-    messages = generate_flashcards_json(messages)
+    if mode == "legacy":
+        messages = generate_flashcards_q(messages, num_questions, difficulty, workspace_id=session, user_id=user)
+        print("Generating Flashcard Questions Successful.")
+        messages = generate_flashcards_a(messages, workspace_id=session, user_id=user)
+        print("Generating Flashcard Answers Successful.")
+        messages = generate_flashcards_json(messages)
+    else:
+        messages = generate_flashcards(messages, num_questions, difficulty, workspace_id=session, user_id=user)
+        print("Generating Flashcards Successful.")
 
-    save_messages(user, session, messages)
+    save_messages(user, session, messages, base=base)
 
     safe_json_parse(messages, f"{ROOT_DIR}/{user}/{session}/flashcards.json")
     last_content = messages[-1].get("content", "")
@@ -558,16 +611,23 @@ def generate_worksheet_questions(request):
         return {"error": "Difficulty not Specified."}, 400
 
     num_questions = int(num_questions)
+    # "fast" (default): one schema-constrained call; "legacy": question -> answer -> JSON chain
+    mode = request.form.get("mode", "fast")
 
-    messages = get_messages(session)
+    history, base = load_history(session)
+    messages = window_history(history, "generate_worksheet_questions")
 
-    messages = generate_worksheet_q(messages, num_questions, difficulty, workspace_id=session, user_id=user)
-    print("Generating Worksheet Questions Successful.")
-    messages = generate_worksheet_a(messages)
-    print("Generating Worksheet Answers Successful.")
-    messages = generate_worksheet_json(messages, worksheet_id=session, num_questions=num_questions)
+    if mode == "legacy":
+        messages = generate_worksheet_q(messages, num_questions, difficulty, workspace_id=session, user_id=user)
+        print("Generating Worksheet Questions Successful.")
+        messages = generate_worksheet_a(messages, workspace_id=session, user_id=user)
+        print("Generating Worksheet Answers Successful.")
+        messages = generate_worksheet_json(messages, worksheet_id=session, num_questions=num_questions)
+    else:
+        messages = generate_worksheet(messages, num_questions, difficulty, workspace_id=session, user_id=user)
+        print("Generating Worksheet Successful.")
 
-    save_messages(user, session, messages)
+    save_messages(user, session, messages, base=base)
     
     safe_json_parse(messages, f"{ROOT_DIR}/{user}/{session}/worksheet.json")
     worksheet_str = messages[-1].get("content", "")    
@@ -615,11 +675,12 @@ def inference_from_prompt(request):
         print("No prompt input.")
         return {"error": "No prompt input."}, 400
 
-    messages = get_messages(session)
+    # Bounded window of the session; only the new turn is written back
+    messages = recent_history(session, "inference_from_prompt")
         
-    messages = prompt_input(messages, prompt)
+    messages = prompt_input(messages, prompt, workspace_id=session, user_id=user)
     
-    save_messages(user, session, messages)
+    append_messages(user, session, messages[-2:])
         
     last_content = messages[-1].get("content", "")
     print("Last message:", messages[-1])
@@ -627,6 +688,199 @@ def inference_from_prompt(request):
     return {"last_response": last_content}, 200
 
 
+# ==================== STREAMING HANDLERS ====================
+# Streaming handlers validate the request up front and return either an
+# (error, status) tuple or a generator of event dicts. The history is only
+# persisted once the stream has been fully assembled.
+
+def generate_study_guide_stream(request):
+    user = request.form.get("user")
+    session = request.form.get("session")
+    if not user or not session:
+        return {"error": "Session not initialized."}, 400
+
+    def events():
+        history, base = load_history(session)
+        messages = window_history(history, "generate_study_guide")
+
+        for delta in generate_summary_stream(messages, workspace_id=session, user_id=user):
+            yield {"event": "token", "field": "markdown", "data": delta}
+        markdown_text = messages[-1].get("content", "")
+        print("Generating Study Guide Markdown Successfully")
+
+        for delta in generate_mindmap_mermaid_stream(messages):
+            yield {"event": "token", "field": "mermaid", "data": delta}
+        mindmap_mermaid = messages[-1].get("content", "")
+        print("Generating Study Guide Mindmap Successfully")
+
+        save_messages(user, session, messages, base=base)
+        yield {"event": "done", "markdown": markdown_text, "mermaid": mindmap_mermaid}
+
+    return events()
+
+
+def inference_from_prompt_stream(request):
+    user = request.form.get("user")
+    session = request.form.get("session")
+    if not user or not session:
+        return {"error": "Session not initialized."}, 400
+
+    prompt = request.form.get("prompt")
+    if not prompt:
+        print("No prompt input.")
+        return {"error": "No prompt input."}, 400
+
+    def events():
+        messages = recent_history(session, "inference_from_prompt")
+
+        for delta in prompt_input_stream(messages, prompt, workspace_id=session, user_id=user):
+            yield {"event": "token", "field": "last_response", "data": delta}
+
+        append_messages(user, session, messages[-2:])
+        print("Prompting Successful")
+        yield {"event": "done", "last_response": messages[-1].get("content", "")}
+
+    return events()
+
+
+streaming_function_map = {
+    "generate_study_guide": generate_study_guide_stream,
+    "inference_from_prompt": inference_from_prompt_stream,
+}
+
+STREAM_MIMETYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def stream_response(events, stream_format, command):
+    """Wrap an event generator into an SSE or NDJSON streaming response"""
+    def encode(event):
+        if stream_format == "sse":
+            return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    def body():
+        # The body runs after the view returned, so re-bind the metrics labels
+        metrics_tokens = metrics.begin_request(command)
+        start = time.perf_counter()
+        try:
+            for event in events:
+                yield encode(event)
+        except Exception as e:
+            traceback.print_exc()
+            yield encode({"event": "error", "error": f"Function execution failed: {str(e)}"})
+        finally:
+            metrics.observe("stream.total", time.perf_counter() - start)
+            metrics.end_request(metrics_tokens)
+
+    return Response(
+        stream_with_context(body()),
+        mimetype=STREAM_MIMETYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+# ==================== END STREAMING HANDLERS ====================
+
+
+# ==================== ASYNC HANDLERS ====================
+# Async handlers run on the shared inference loop (app/utils/async_runtime.py),
+# outside the Flask request context, so they receive a plain dict of the form.
+# Enabled with ASYNC_DISPATCH=true; commands without an async handler keep
+# using the synchronous function_list.
+
+ASYNC_DISPATCH = os.getenv("ASYNC_DISPATCH", "false").lower() == "true"
+
+
+async def async_generate_study_guide(form):
+    user = form.get("user")
+    session = form.get("session")
+    if not user or not session:
+        return {"error": "Session not initialized."}, 400
+
+    history, base = await async_load_history(session)
+    messages = await run_blocking(window_history, history, "generate_study_guide")
+
+    messages = await async_generate_summary(messages, workspace_id=session, user_id=user)
+    markdown_text = messages[-1].get("content", "")
+    print("Generating Study Guide Markdown Successfully")
+    messages = await async_generate_mindmap_mermaid(messages)
+    mindmap_mermaid = messages[-1].get("content", "")
+    print("Generating Study Guide Mindmap Successfully")
+
+    await async_save_messages(user, session, messages, base=base)
+
+    return {"markdown": markdown_text, "mermaid": mindmap_mermaid}, 200
+
+
+async def async_inference_from_prompt(form):
+    user = form.get("user")
+    session = form.get("session")
+    if not user or not session:
+        return {"error": "Session not initialized."}, 400
+
+    prompt = form.get("prompt")
+    if not prompt:
+        print("No prompt input.")
+        return {"error": "No prompt input."}, 400
+
+    messages = await run_blocking(recent_history, session, "inference_from_prompt")
+
+    messages = await async_prompt_input(messages, prompt, workspace_id=session, user_id=user)
+
+    await async_append_messages(user, session, messages[-2:])
+
+    print("Prompting Successful")
+    return {"last_response": messages[-1].get("content", "")}, 200
+
+
+async def async_generate_study_guide_segmentation(form):
+    user = form.get("user")
+    session = form.get("session")
+    study_guide = form.get("study_guide")
+
+    if not user or not session:
+        return {"error": "Session not initialized."}, 400
+    if not study_guide:
+        print("Study guide not provided.")
+        return {"error": "Study guide not provided."}, 400
+
+    segmentation = await async_generate_segmentation(study_guide)
+    return {"segmentation": segmentation}, 200
+
+
+async def async_validate_study_guide_comperhension(form):
+    user = form.get("user")
+    session = form.get("session")
+    if not user or not session:
+        return {"error": "Session not initialized."}, 400
+    study_guide = form.get("study_guide")
+    segment_content = form.get("segment_content")
+    student_response = form.get("student_response")
+
+    if not study_guide:
+        print("Study guide not provided.")
+        return {"error": "Study guide not provided."}, 400
+    if not segment_content:
+        print("Segment content not provided.")
+        return {"error": "Segment content not provided."}, 400
+    if not student_response:
+        print("Student response not provided.")
+        return {"error": "Student response not provided."}, 400
+
+    feedback = await async_validate_summary_correctness(study_guide, segment_content, student_response)
+    return {"feedback": feedback}, 200
+
+
+async_function_map = {
+    "generate_study_guide": async_generate_study_guide,
+    "inference_from_prompt": async_inference_from_prompt,
+    "generate_study_guide_segmentation": async_generate_study_guide_segmentation,
+    "validate_study_guide_comperhension": async_validate_study_guide_comperhension,
+}
+# ==================== END ASYNC HANDLERS ====================
+
+
 def generate_podcast_structure_endpoint(request):
     """
     Generate podcast structure using LLM.
@@ -658,7 +912,8 @@ def generate_podcast_structure_endpoint(request):
     print(f"🎙️ Generating podcast structure: '{title}'")
     
     # Load conversation history
-    messages = get_messages(session)
+    history, base = load_history(session)
+    messages = window_history(history, "generate_podcast_structure")
 
     try:
         # Generate podcast structure
@@ -673,7 +928,7 @@ def generate_podcast_structure_endpoint(request):
         )
         
         # Save updated messages
-        save_messages(user, session, messages)
+        save_messages(user, session, messages, base=base)
         
         print(f"✅ Generated structure with {len(structured_content.get('segments', []))} segments")
         
@@ -754,20 +1009,16 @@ def generate_podcast_audio_from_text(request):
             # Split dialogue into parts
             dialogue_parts = split_dialogue_segment(text, speakers)
             
-            # Generate individual audio files
-            part_files = []
+            # Generate individual audio files (all parts at once on the shared async loop)
+            part_files = [f"{audio_dir}/segment_{segment_index}_part_{part_idx}.mp3"
+                          for part_idx in range(len(dialogue_parts))]
+            text_to_speech_parts([(part['text'], audio_path, part['voiceId'])
+                                  for part, audio_path in zip(dialogue_parts, part_files)])
             total_duration = 0
             
             for part_idx, part in enumerate(dialogue_parts):
-                audio_filename = f"segment_{segment_index}_part_{part_idx}.mp3"
-                audio_path = f"{audio_dir}/{audio_filename}"
-                
-                # Generate TTS
-                text_to_speech(part['text'], audio_path, voice_id=part['voiceId'])
                 duration = estimate_segment_duration(part['text'])
                 total_duration += duration
-                
-                part_files.append(audio_path)
                 print(f"      ✅ Part {part_idx}: {part['speaker']} ({duration}s)")
             
             # Concatenate all parts into one audio file
@@ -785,7 +1036,7 @@ def generate_podcast_audio_from_text(request):
             # Upload combined file to Supabase
             object_key = f"{user}/{session}/podcasts/{podcast_id}/{combined_filename}"
             with open(combined_path, "rb") as f:
-                supabase.storage.from_("media").upload(
+                upload_to_storage(
                     object_key,
                     f,
                     file_options={"content-type": "audio/mpeg"}
@@ -827,7 +1078,7 @@ def generate_podcast_audio_from_text(request):
             # Upload to Supabase
             object_key = f"{user}/{session}/podcasts/{podcast_id}/{audio_filename}"
         with open(audio_path, "rb") as f:
-            supabase.storage.from_("media").upload(
+            upload_to_storage(
                     object_key,
                 f,
                 file_options={"content-type": "audio/mpeg"}
@@ -879,20 +1130,20 @@ def generate_image(request):
         return {"error": f"Invalid size. Must be one of: {', '.join(valid_sizes)}"}, 400
     
     try:
-        # Initialize OpenAI client
-        api_key = os.getenv("OPENAI_API_KEY")
-        client = OpenAI(api_key=api_key)
+        # Shared pooled client
+        client = get_client(IMAGE_MODEL)
         
         print(f"Generating image with prompt: {prompt[:100]}...")
         
         # Generate image using DALL-E 2 (faster than DALL-E 3)
-        response = client.images.generate(
-            model="dall-e-2",  # Fastest model
-            prompt=prompt,
-            size=size,
-            quality="standard",
-            n=1,
-        )
+        with stage("image.generate"):
+            response = client.images.generate(
+                model=IMAGE_MODEL,  # Fastest model
+                prompt=prompt,
+                size=size,
+                quality="standard",
+                n=1,
+            )
         
         image_url = response.data[0].url
         print(f"✓ Image generated: {image_url}")
@@ -937,7 +1188,7 @@ def generate_image(request):
             try:
                 with open(local_path, "rb") as f:
                     supabase_path = f"{user}/{session}/generated_images/{filename}"
-                    supabase.storage.from_("media").upload(
+                    upload_to_storage(
                         supabase_path,
                         f,
                         file_options={"content-type": "image/png"}
@@ -1002,20 +1253,20 @@ def generate_podcast_image(request):
         image_prompt = prompt_response.choices[0].message.content.strip()
         print(f"Generated prompt: {image_prompt}")
         
-        # Initialize OpenAI client
-        api_key = os.getenv("OPENAI_API_KEY")
-        client = OpenAI(api_key=api_key)
+        # Shared pooled client
+        client = get_client(IMAGE_MODEL)
         
         print(f"Generating podcast cover image...")
         
         # Generate image using DALL-E 2 at 512x512 (good for podcast covers)
-        response = client.images.generate(
-            model="dall-e-2",
-            prompt=image_prompt,
-            size="512x512",  # Perfect size for podcast covers
-            # quality="standard",
-            n=1,
-        )
+        with stage("image.generate"):
+            response = client.images.generate(
+                model=IMAGE_MODEL,
+                prompt=image_prompt,
+                size="512x512",  # Perfect size for podcast covers
+                # quality="standard",
+                n=1,
+            )
         
         image_url = response.data[0].url
         print(f"✓ Image generated: {image_url}")
@@ -1055,7 +1306,7 @@ def generate_podcast_image(request):
         # Upload to Supabase
         try:
             with open(local_path, "rb") as f:
-                supabase.storage.from_("media").upload(
+                upload_to_storage(
                     image_key,
                     f,
                     file_options={"content-type": "image/png"}
@@ -1125,6 +1376,8 @@ def process_file_endpoint(request):
     - fileUrl: Signed URL or public URL to the file
     - fileType: 'pdf' or 'image'
     - maxPages: (optional) Maximum pages to process for large PDFs
+    - workspaceId, fileAssetId: (optional) add the result to the workspace's
+      retrieval index right away (fileName optional)
     
     Returns:
     {
@@ -1161,6 +1414,18 @@ def process_file_endpoint(request):
             return result, 500
         
         print(f"✅ Processing successful: {result.get('pageCount', 0)} pages")
+        
+        workspace_id = request.form.get("workspaceId")
+        file_asset_id = request.form.get("fileAssetId")
+        if workspace_id and file_asset_id:
+            try:
+                with stage("retrieval.index_file"):
+                    chunks = index_file(workspace_id, file_asset_id, result, request.form.get("fileName"),
+                                        request.form.get("updatedAt"))
+                print(f"🔎 Indexed {chunks} chunks for retrieval")
+            except Exception as e:
+                # The index catches up from FileAsset.updatedAt on the next top-k query
+                print(f"⚠️  Failed to index file for retrieval: {e}")
         return result, 200
         
     except Exception as e:
@@ -1215,9 +1480,65 @@ def upload_content():
     except ValueError:
         return jsonify({"error": f"Unknown command '{command}'"}), 400
 
+    # Label every stage timed while serving this command (see app/utils/metrics.py)
+    metrics_tokens = metrics.begin_request(command)
+    start = time.perf_counter()
+    try:
+        return dispatch_command(command, cmd_index)
+    finally:
+        metrics.observe("request.total", time.perf_counter() - start)
+        g.stages = metrics.end_request(metrics_tokens)
+
+
+# Commands whose concurrent duplicates (same session + params) are coalesced
+SINGLE_FLIGHT_COMMANDS = {
+    "init_session",
+    "generate_study_guide",
+    "generate_flashcard_questions",
+    "generate_worksheet_questions",
+    "inference_from_prompt",
+    "generate_podcast_structure",
+    "generate_podcast_image",
+    "generate_study_guide_segmentation",
+}
+single_flight = SingleFlight()
+
+
+def run_handler(command, cmd_index):
+    """Run a command's handler (async handler on the shared loop when enabled)"""
+    if ASYNC_DISPATCH and command in async_function_map:
+        # Run on the shared event loop - LLM I/O of all requests is multiplexed there
+        return run_coroutine(async_function_map[command](request.form.to_dict()))
+    # Execute the function (safe to run concurrently)
+    return function_list[cmd_index](request)
+
+
+def dispatch_command(command, cmd_index):
+    """Run the handler for a command and build the Flask response"""
+    # Optional token streaming (stream=sse | stream=ndjson) for supported commands
+    stream_format = request.form.get("stream", "").lower()
+    if stream_format in STREAM_MIMETYPES and command in streaming_function_map:
+        try:
+            stream_result = streaming_function_map[command](request)
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"error": f"Function execution failed: {str(e)}"}), 500
+        if isinstance(stream_result, tuple):
+            data, status_code = stream_result
+            return jsonify(data), status_code
+        return stream_response(stream_result, stream_format, command)
+
     try:
-        # Execute the function (safe to run concurrently)
-        func_response = function_list[cmd_index](request)
+        if command in SINGLE_FLIGHT_COMMANDS and not request.files:
+            # Duplicate submits (retries, page refreshes) share the first request's result
+            func_response, shared = single_flight.do(
+                request_key(command, request.form.to_dict()),
+                lambda: run_handler(command, cmd_index)
+            )
+            if shared:
+                print(f"  ↺ coalesced duplicate '{command}' request")
+        else:
+            func_response = run_handler(command, cmd_index)
 
         if isinstance(func_response, tuple) and len(func_response) == 2:
             data, status_code = func_response
@@ -1304,6 +1625,54 @@ def health():
     return jsonify({"status": "healthy", "server_status": "busy" if server_status["busy"] else "idle"}), 200  
 
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Per-command stage histograms (latency), token usage and estimated cost,
+    together with the LLM pool, response cache, history window, message store
+    write / compression, session history cache, session write lock, workspace
+    context cache / packing, retrieval index and image blob store
+    counters.
+    """
+    return jsonify({
+        "commands": metrics.snapshot(),
+        "pools": pool_stats(),
+        "circuit_breakers": transport_stats(),
+        "single_flight": dict(single_flight.stats, in_flight=single_flight.in_flight()),
+        "llm_cache": cache_stats(),
+        "history_window": context_window_stats(),
+        "message_store": write_stats(),
+        "history_cache": history_cache_stats(),
+        "message_compression": compression_stats(),
+        "blob_store": blob_stats(),
+        "session_locks": session_lock_stats(),
+        "workspace_context_cache": workspace_context_cache_stats(),
+        "workspace_context_packing": context_packing_stats(),
+        "retrieval_index": retrieval_stats()
+    }), 200
+
+
+@app.route("/pool_stats", methods=["GET"])
+def get_pool_stats():
+    """
+    Connection pool statistics for the shared LLM clients.
+    A healthy pool shows connections_reused growing much faster than connections_opened.
+    """
+    return jsonify({"pools": pool_stats()}), 200
+
+
+@app.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    """Hit/miss counters for the LLM response cache"""
+    return jsonify({"llm_cache": cache_stats()}), 200
+
+
+@app.route("/context_stats", methods=["GET"])
+def get_context_stats():
+    """Prompt tokens saved per command by history windowing"""
+    return jsonify({"history_window": context_window_stats()}), 200
+
+
 @app.route("/status", methods=["GET"])
 def status():
     return jsonify({"status": "busy" if server_status["busy"] else "idle"}), 200
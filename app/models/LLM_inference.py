@@ -1,17 +1,114 @@
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+import time
+
+from app.models.client_registry import get_client, get_async_client
+from app.models import response_cache
+from app.models.transport import call_with_retries, async_call_with_retries, DEFAULT_DEADLINE, DeadlineExceeded
+from app.utils.metrics import stage, observe, record_usage
+from app.utils.blob_store import has_blob_refs, rehydrate_messages
+from app.utils.async_runtime import run_blocking
 
 
 MODEL = "gpt-5-nano"
 
-def LLM_inference(messages, json_output=False, response_format=None):
-    load_dotenv()
-    api_key = os.getenv("OPENAI_API_KEY")
-    client = OpenAI(api_key=api_key, timeout=120000)
-    if json_output:
-        output = client.chat.completions.create(model=MODEL, messages=messages, response_format=response_format)
-    else:
-        output = client.chat.completions.create(model=MODEL, messages=messages)
+def with_context(messages, context=None):
+    """Request copy of messages with the context messages placed after the system prompt (messages is not modified)"""
+    if not context:
+        return messages
+    insert_index = 1 if messages and messages[0].get("role") == "system" else 0
+    return messages[:insert_index] + list(context) + messages[insert_index:]
+
+
+def LLM_inference(messages, json_output=False, response_format=None, cache_ttl=None, deadline=None, hedge=False, context=None):
+    """
+    Run a chat completion.
+
+    cache_ttl (seconds) opts the call site into the response cache; identical
+    (model, messages, response_format) requests are then served from cache.
+    deadline bounds the whole call including retries (seconds); hedge sends a
+    duplicate request when the first one is slow (latency-critical commands).
+    context is an overlay of messages (e.g. workspace context) sent with this
+    request only; it never ends up in messages, so it is never persisted.
+    """
+    messages = with_context(messages, context)
+    cache_key = None
+    if cache_ttl:
+        cache_key = response_cache.make_key(MODEL, messages, response_format if json_output else None)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            observe("llm.cache_hit", 0.0)
+            return cached
+
+    # Stored histories reference images in the blob store; inline them for the request only
+    request_messages = rehydrate_messages(messages)
+    client = get_client(MODEL)
+    extra = {"response_format": response_format} if json_output else {}
+    with stage("llm"):
+        output = call_with_retries(
+            MODEL,
+            lambda timeout: client.chat.completions.create(model=MODEL, messages=request_messages, timeout=timeout, **extra),
+            deadline=deadline,
+            hedge=hedge
+        )
+    record_usage(MODEL, output.usage)
+
+    if cache_key:
+        response_cache.put(cache_key, output, cache_ttl)
+    return output
+
+
+def LLM_inference_stream(messages, deadline=None, context=None):
+    """Stream a completion, yielding content deltas as they arrive"""
+    request_messages = rehydrate_messages(with_context(messages, context))
+    client = get_client(MODEL)
+    start = time.perf_counter()
+    deadline_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+    first_token = True
+    with stage("llm.stream"):
+        # Retries only cover opening the stream; once tokens flow they are forwarded as-is
+        stream = call_with_retries(
+            MODEL,
+            lambda timeout: client.chat.completions.create(
+                model=MODEL, messages=request_messages, stream=True, stream_options={"include_usage": True}, timeout=timeout
+            ),
+            deadline=deadline
+        )
+        for chunk in stream:
+            if time.monotonic() > deadline_at:
+                stream.close()
+                raise DeadlineExceeded(f"Stream from '{MODEL}' ran past its deadline")
+            if chunk.usage is not None:
+                record_usage(MODEL, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    observe("llm.stream_first_token", time.perf_counter() - start)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+
+
+async def async_LLM_inference(messages, json_output=False, response_format=None, cache_ttl=None, deadline=None, hedge=False,
+                              context=None):
+    """Async variant of LLM_inference - must run on the shared inference loop"""
+    messages = with_context(messages, context)
+    cache_key = None
+    if cache_ttl:
+        cache_key = response_cache.make_key(MODEL, messages, response_format if json_output else None)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            observe("llm.cache_hit", 0.0)
+            return cached
+
+    request_messages = await run_blocking(rehydrate_messages, messages) if has_blob_refs(messages) else messages
+    client = get_async_client(MODEL)
+    extra = {"response_format": response_format} if json_output else {}
+    with stage("llm"):
+        output = await async_call_with_retries(
+            MODEL,
+            lambda timeout: client.chat.completions.create(model=MODEL, messages=request_messages, timeout=timeout, **extra),
+            deadline=deadline,
+            hedge=hedge
+        )
+    record_usage(MODEL, output.usage)
+
+    if cache_key:
+        response_cache.put(cache_key, output, cache_ttl)
     return output
-    
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Process-wide registry of long-lived OpenAI clients
+One client (with its own keep-alive connection pool) is built per
+(model, base_url, timeout) profile and shared by every Flask/gunicorn thread.
+Async clients are kept separately and are only used from the shared
+inference event loop (see app/utils/async_runtime.py)
+"""
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+
+# Per-request timeout in seconds; retries and overall deadlines live in app/models/transport.py
+DEFAULT_TIMEOUT = 120
+MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", 20))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", 60))
+
+ProfileKey = Tuple[Optional[str], Optional[str], float]
+
+_clients: Dict[ProfileKey, OpenAI] = {}
+_async_clients: Dict[ProfileKey, AsyncOpenAI] = {}
+_stats: Dict[Tuple[str, ProfileKey], Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def _profile_key(model: str, base_url: str, timeout: float) -> ProfileKey:
+    return (model, base_url or OPENAI_BASE_URL, float(timeout if timeout is not None else DEFAULT_TIMEOUT))
+
+
+def _profile_name(kind: str, key: ProfileKey) -> str:
+    model, base_url, timeout = key
+    return f"{kind}:{model or 'default'}@{base_url or 'openai'}/{timeout:g}s"
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _make_trace_hook(stats: Dict[str, int]):
+    """
+    Build an httpx request hook that counts requests and new TCP connections.
+    httpcore reports 'connection.connect_tcp.started' only when the pool has
+    to open a connection, so requests - connections is the reuse count.
+    """
+    def trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            with _lock:
+                stats["connections_opened"] += 1
+
+    def on_request(request: httpx.Request):
+        with _lock:
+            stats["requests"] += 1
+        request.extensions["trace"] = trace
+
+    return on_request
+
+
+def _make_async_trace_hook(stats: Dict[str, int]):
+    """Async counterpart of _make_trace_hook (httpcore awaits async traces)"""
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            with _lock:
+                stats["connections_opened"] += 1
+
+    async def on_request(request: httpx.Request):
+        with _lock:
+            stats["requests"] += 1
+        request.extensions["trace"] = trace
+
+    return on_request
+
+
+def get_client(model: str = None, base_url: str = None, timeout: float = None) -> OpenAI:
+    """
+    Get (or lazily build) the shared OpenAI client for a profile.
+
+    OpenAI clients are thread-safe, so the same instance is handed to every
+    thread and its connection pool is reused across requests.
+
+    Args:
+        model: Model the client is used for (keeps per-model pool stats apart)
+        base_url: Optional API base URL (defaults to OPENAI_BASE_URL / OpenAI)
+        timeout: Request timeout in seconds
+
+    Returns:
+        OpenAI client
+    """
+    key = _profile_key(model, base_url, timeout)
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            stats = {"requests": 0, "connections_opened": 0}
+            http_client = httpx.Client(
+                timeout=key[2],
+                limits=_pool_limits(),
+                event_hooks={"request": [_make_trace_hook(stats)]},
+            )
+            client = OpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=key[1],
+                timeout=key[2],
+                max_retries=0,
+                http_client=http_client,
+            )
+            _clients[key] = client
+            _stats[("sync", key)] = stats
+    return client
+
+
+def get_async_client(model: str = None, base_url: str = None, timeout: float = None) -> AsyncOpenAI:
+    """
+    Get (or lazily build) the shared AsyncOpenAI client for a profile.
+
+    The underlying httpx.AsyncClient is bound to the event loop it is first
+    used on, so only call this from the shared inference loop.
+
+    Args:
+        model: Model the client is used for
+        base_url: Optional API base URL
+        timeout: Request timeout in seconds
+
+    Returns:
+        AsyncOpenAI client
+    """
+    key = _profile_key(model, base_url, timeout)
+
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            stats = {"requests": 0, "connections_opened": 0}
+            http_client = httpx.AsyncClient(
+                timeout=key[2],
+                limits=_pool_limits(),
+                event_hooks={"request": [_make_async_trace_hook(stats)]},
+            )
+            client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=key[1],
+                timeout=key[2],
+                max_retries=0,
+                http_client=http_client,
+            )
+            _async_clients[key] = client
+            _stats[("async", key)] = stats
+    return client
+
+
+def pool_stats() -> Dict[str, Dict]:
+    """
+    Report connection reuse for every client profile built so far.
+
+    Returns:
+        Dictionary keyed by profile name with request/connection counters
+    """
+    report = {}
+    with _lock:
+        for (kind, key), stats in _stats.items():
+            requests_sent = stats["requests"]
+            opened = stats["connections_opened"]
+            report[_profile_name(kind, key)] = {
+                "kind": kind,
+                "model": key[0],
+                "base_url": key[1],
+                "timeout": key[2],
+                "requests": requests_sent,
+                "connections_opened": opened,
+                "connections_reused": max(requests_sent - opened, 0),
+                "reuse_ratio": round(1 - opened / requests_sent, 3) if requests_sent else None,
+            }
+    return report
+
+
+def close_all():
+    """Close every pooled sync client (used on shutdown and in scripts)"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        for kind, key in [k for k in _stats if k[0] == "sync"]:
+            del _stats[(kind, key)]
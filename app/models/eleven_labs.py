@@ -1,13 +1,19 @@
+import asyncio
 import os
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import AsyncElevenLabs, ElevenLabs
 from io import BytesIO
+from app.utils.metrics import stage, current_command
+from app.utils.async_runtime import run_coroutine
 
 
 load_dotenv()
+# Dialogue parts synthesised at the same time (ElevenLabs plans cap concurrent requests)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 4))
 elevenlabs = ElevenLabs(
   api_key=os.getenv("ELEVENLABS_API_KEY"),
 )
+async_elevenlabs = None
 
 
 def create_voice(voice_sample_path):
@@ -20,13 +26,53 @@ def create_voice(voice_sample_path):
     return voice.voice_id
 
 def text_to_speech(text, save_path, voice_id="Xb7hH8MSUJpSbSDYk0k2"):
-    audio = elevenlabs.text_to_speech.convert(
-    text=text,
-    voice_id=voice_id,
-    model_id="eleven_flash_v2_5",
-    output_format="mp3_44100_128",
-    )
-    
-    with open(save_path, "wb") as f:
-        for chunk in audio:
-            f.write(chunk)
+    with stage("tts"):
+        audio = elevenlabs.text_to_speech.convert(
+        text=text,
+        voice_id=voice_id,
+        model_id="eleven_flash_v2_5",
+        output_format="mp3_44100_128",
+        )
+
+        with open(save_path, "wb") as f:
+            for chunk in audio:
+                f.write(chunk)
+
+
+def get_async_elevenlabs():
+    """Lazily build the async ElevenLabs client (bound to the shared inference loop)"""
+    global async_elevenlabs
+    if async_elevenlabs is None:
+        async_elevenlabs = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+    return async_elevenlabs
+
+
+async def async_text_to_speech(text, save_path, voice_id="Xb7hH8MSUJpSbSDYk0k2"):
+    with stage("tts"):
+        audio = get_async_elevenlabs().text_to_speech.convert(
+        text=text,
+        voice_id=voice_id,
+        model_id="eleven_flash_v2_5",
+        output_format="mp3_44100_128",
+        )
+
+        with open(save_path, "wb") as f:
+            async for chunk in audio:
+                f.write(chunk)
+
+
+def text_to_speech_parts(parts):
+    """Synthesise [(text, save_path, voice_id)] concurrently on the shared loop; returns once every file is written"""
+    command = current_command.get()
+
+    async def run():
+        current_command.set(command)  # the loop's tasks do not inherit the request's metrics label
+        semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+
+        async def one(text, save_path, voice_id):
+            async with semaphore:
+                await async_text_to_speech(text, save_path, voice_id=voice_id)
+
+        await asyncio.gather(*(one(*part) for part in parts))
+
+    run_coroutine(run())
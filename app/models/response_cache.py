@@ -0,0 +1,136 @@
+"""
+Content-addressed cache for LLM responses
+Keyed on a canonical hash of (model, messages, response_format), with a
+bounded in-process LRU tier and an optional on-disk tier that survives restarts.
+Caching is opt-in per call site through LLM_inference(..., cache_ttl=<seconds>)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from openai.types.chat import ChatCompletion
+
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 512))
+CACHE_DIR = os.getenv("LLM_CACHE_DIR")  # unset = memory tier only
+
+_entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, ChatCompletion)
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+
+def make_key(model: str, messages, response_format=None) -> str:
+    """Canonical SHA-256 of the request (dict key order does not matter)"""
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "response_format": response_format},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.json")
+
+
+def _remember(key: str, expires_at: float, response: ChatCompletion):
+    """Insert into the LRU tier (caller holds _lock)"""
+    _entries[key] = (expires_at, response)
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def get(key: str) -> Optional[ChatCompletion]:
+    """
+    Look a response up in the memory tier, then the disk tier.
+
+    Args:
+        key: Key from make_key
+
+    Returns:
+        Cached ChatCompletion, or None on a miss / expired entry
+    """
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _entries.move_to_end(key)
+                _stats["memory_hits"] += 1
+                return entry[1]
+            del _entries[key]
+            _stats["expired"] += 1
+
+    if CACHE_DIR:
+        path = _disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if record["expires_at"] > now:
+                response = ChatCompletion.model_validate(record["response"])
+                with _lock:
+                    _remember(key, record["expires_at"], response)
+                    _stats["disk_hits"] += 1
+                return response
+            os.remove(path)
+            with _lock:
+                _stats["expired"] += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Failed to read LLM cache entry {key}: {e}")
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def put(key: str, response: ChatCompletion, ttl: float):
+    """
+    Store a response in both tiers.
+
+    Args:
+        key: Key from make_key
+        response: ChatCompletion to cache
+        ttl: Time to live in seconds
+    """
+    expires_at = time.time() + ttl
+    with _lock:
+        _remember(key, expires_at, response)
+        _stats["stores"] += 1
+
+    if CACHE_DIR:
+        path = _disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "response": response.model_dump(mode="json")}, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Warning: Failed to write LLM cache entry {key}: {e}")
+
+
+def cache_stats() -> Dict:
+    """Hit/miss counters and tier sizes"""
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_entries"] = len(_entries)
+    hits = stats["memory_hits"] + stats["disk_hits"]
+    lookups = hits + stats["misses"]
+    stats["hit_rate"] = round(hits / lookups, 3) if lookups else None
+    stats["max_entries"] = MAX_ENTRIES
+    stats["disk_dir"] = CACHE_DIR
+    return stats
+
+
+def clear():
+    """Drop the memory tier (disk entries expire on their own)"""
+    with _lock:
+        _entries.clear()
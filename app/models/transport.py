@@ -0,0 +1,365 @@
+"""
+Resilient transport for model calls
+Bounded retries with jittered exponential backoff (honouring Retry-After),
+optional hedged duplicate requests, a per-model circuit breaker and real
+per-call deadlines (enforced on the total time of an attempt, not just on
+each socket read). Used under LLM_inference and the vision calls
+"""
+import asyncio
+import contextvars
+import email.utils
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Callable, Dict, Optional
+
+import openai
+
+from app.utils.metrics import observe
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20))
+DEFAULT_DEADLINE = float(os.getenv("LLM_DEADLINE", 120))
+# Generators with long outputs (study guides, podcast scripts, worksheets) pass this explicitly
+LONG_DEADLINE = float(os.getenv("LLM_LONG_DEADLINE", 600))
+HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 8))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET", 30))
+
+# Backup requests in flight at once, across the process; a call that finds
+# them all taken just keeps waiting on its primary request
+MAX_HEDGES_IN_FLIGHT = int(os.getenv("LLM_MAX_HEDGES", 8))
+
+# Sync attempts run on _call_pool so the caller can stop waiting at the deadline.
+# This is a process-wide cap on concurrent sync model calls: an attempt keeps
+# its thread until the provider answers or its own timeout ends it, even after
+# the caller gave up on it. Size it above the gunicorn threads per worker
+# (backup requests run on their own pool); when every slot is taken a call
+# fails fast with CallPoolSaturated instead of queueing behind hung requests.
+CALL_WORKERS = int(os.getenv("LLM_CALL_WORKERS", 64))
+_call_pool = ThreadPoolExecutor(max_workers=CALL_WORKERS, thread_name_prefix="llm-call")
+_call_slots = threading.BoundedSemaphore(CALL_WORKERS)
+_hedge_pool = ThreadPoolExecutor(max_workers=MAX_HEDGES_IN_FLIGHT, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(MAX_HEDGES_IN_FLIGHT)
+_async_hedges = 0  # backups in flight on the shared loop (only touched from the loop thread)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while a model's circuit is open"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call (including its retries) ran past its deadline"""
+
+
+class CallPoolSaturated(Exception):
+    """Raised without calling the provider while every LLM_CALL_WORKERS slot is busy"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after BREAKER_FAILURE_THRESHOLD retryable failures or
+    deadline overruns in a row (a hung provider must trip it too);
+    open -> half_open after BREAKER_RESET_TIMEOUT, letting one probe through;
+    the probe closes the circuit on success or re-opens it on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit open for '{self.name}' - provider failing, not calling")
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit half-open for '{self.name}' - probe in flight")
+                self.probe_in_flight = True
+
+    def on_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Release a half-open probe slot after a non-retryable error"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(model)
+        return breaker
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transient provider errors: connection problems, timeouts, 408/409/429 and 5xx"""
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Parse retry-after-ms / Retry-After (seconds or HTTP date) from an error response"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _submit(request_fn: Callable[[float], object], remaining: float):
+    """Start an attempt on _call_pool; its slot is freed when the attempt ends, not when the caller stops waiting"""
+    if not _call_slots.acquire(blocking=False):
+        observe("llm.call_rejected", 0.0)
+        raise CallPoolSaturated(f"All {CALL_WORKERS} LLM call slots are busy")
+    try:
+        future = _call_pool.submit(contextvars.copy_context().run, request_fn, remaining)
+    except BaseException:
+        _call_slots.release()
+        raise
+    future.add_done_callback(lambda _: _call_slots.release())
+    return future
+
+
+def _timed_call(request_fn: Callable[[float], object], remaining: float):
+    """One attempt, abandoned with DeadlineExceeded once remaining seconds have passed in total"""
+    future = _submit(request_fn, remaining)
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeout:
+        # The request's own timeout ends the abandoned attempt at the latest
+        future.cancel()
+        raise DeadlineExceeded(f"Request still running after the {remaining:.1f}s left before its deadline")
+
+
+def _hedged_call(request_fn: Callable[[float], object], remaining: float):
+    """Send the request, and a duplicate if the first has not answered within HEDGE_DELAY"""
+    deadline_at = time.monotonic() + remaining
+    primary = _submit(request_fn, remaining)
+    done, _ = wait([primary], timeout=min(HEDGE_DELAY, remaining))
+    if done:
+        return primary.result()
+
+    if not _hedge_slots.acquire(blocking=False):
+        observe("llm.hedge_skipped", 0.0)
+        try:
+            return primary.result(timeout=max(deadline_at - time.monotonic(), 0))
+        except FutureTimeout:
+            primary.cancel()
+            raise DeadlineExceeded(f"Request still running after the {remaining:.1f}s left before its deadline")
+
+    observe("llm.hedge", 0.0)
+    backup = _hedge_pool.submit(contextvars.copy_context().run, request_fn, max(remaining - HEDGE_DELAY, 0.001))
+    backup.add_done_callback(lambda _: _hedge_slots.release())
+    pending = {primary, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline_at - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"No hedged request answered within {remaining:.1f}s")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+    finally:
+        # Drop the loser: a queued one never starts; a running sync request cannot be
+        # interrupted, it ends at its own timeout and its result is ignored
+        for future in pending:
+            future.cancel()
+
+
+def call_with_retries(model: str, request_fn: Callable[[float], object], deadline: float = None, hedge: bool = False):
+    """
+    Run a provider call with retries, optional hedging, circuit breaking and a deadline.
+
+    Args:
+        model: Model name (one circuit breaker per model)
+        request_fn: Performs one attempt; receives the seconds left before the deadline
+                    and must use it as the request timeout
+        deadline: Total seconds for the call including retries (default LLM_DEADLINE)
+        hedge: Send a duplicate request if the first one is slow
+
+    Returns:
+        Whatever request_fn returns
+    """
+    breaker = get_breaker(model)
+    deadline_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            breaker.release()
+            raise DeadlineExceeded(f"Deadline exceeded calling '{model}' after {attempt} retries")
+        try:
+            response = _hedged_call(request_fn, remaining) if hedge else _timed_call(request_fn, remaining)
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded):
+                # Timeouts count against the circuit (openai.APITimeoutError is retryable below)
+                breaker.on_failure()
+                raise
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.on_failure()
+            delay = backoff_delay(attempt, e)
+            attempt += 1
+            if attempt > MAX_RETRIES or time.monotonic() + delay >= deadline_at:
+                raise
+            print(f"Warning: {model} call failed ({e.__class__.__name__}), retry {attempt}/{MAX_RETRIES} in {delay:.2f}s")
+            observe("llm.retry_wait", delay)
+            time.sleep(delay)
+            continue
+        breaker.on_success()
+        return response
+
+
+async def _async_hedged_call(request_fn, remaining: float):
+    global _async_hedges
+    primary = asyncio.ensure_future(request_fn(remaining))
+    done, _ = await asyncio.wait({primary}, timeout=min(HEDGE_DELAY, remaining))
+    if done:
+        return primary.result()
+
+    if _async_hedges >= MAX_HEDGES_IN_FLIGHT:
+        observe("llm.hedge_skipped", 0.0)
+        return await primary
+
+    observe("llm.hedge", 0.0)
+    _async_hedges += 1
+    backup = asyncio.ensure_future(request_fn(max(remaining - HEDGE_DELAY, 0.001)))
+    pending = {primary, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        _async_hedges -= 1
+        # Also runs when the caller's deadline cancels this coroutine
+        for task in (primary, backup):
+            if not task.done():
+                task.cancel()
+
+
+async def async_call_with_retries(model: str, request_fn, deadline: float = None, hedge: bool = False):
+    """Async variant of call_with_retries; request_fn is a coroutine function"""
+    breaker = get_breaker(model)
+    deadline_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            breaker.release()
+            raise DeadlineExceeded(f"Deadline exceeded calling '{model}' after {attempt} retries")
+        try:
+            try:
+                if hedge:
+                    response = await asyncio.wait_for(_async_hedged_call(request_fn, remaining), remaining)
+                else:
+                    response = await asyncio.wait_for(request_fn(remaining), remaining)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"Request still running after the {remaining:.1f}s left before its deadline")
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded):
+                # Timeouts count against the circuit (openai.APITimeoutError is retryable below)
+                breaker.on_failure()
+                raise
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.on_failure()
+            delay = backoff_delay(attempt, e)
+            attempt += 1
+            if attempt > MAX_RETRIES or time.monotonic() + delay >= deadline_at:
+                raise
+            print(f"Warning: {model} call failed ({e.__class__.__name__}), retry {attempt}/{MAX_RETRIES} in {delay:.2f}s")
+            observe("llm.retry_wait", delay)
+            await asyncio.sleep(delay)
+            continue
+        breaker.on_success()
+        return response
+
+
+def transport_stats() -> Dict[str, Dict]:
+    """Circuit breaker state per model"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
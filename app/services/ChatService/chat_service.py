@@ -2,12 +2,47 @@ import ast
 import json
 import os
 import fitz  # PyMuPDF
-from app.models.LLM_inference import LLM_inference
-from app.utils.utils import update_memory
+from app.models.LLM_inference import LLM_inference, LLM_inference_stream, async_LLM_inference
+from app.utils.utils import update_memory, stream_to_memory
+from app.utils.async_runtime import run_blocking
+from app.utils.workspace_context import get_workspace_context_overlay
 
-def prompt_input(messages, prompt):
+# Prompts get the workspace file excerpts most relevant to them ("off" disables)
+PROMPT_WORKSPACE_CONTEXT = os.getenv("PROMPT_WORKSPACE_CONTEXT", "on").lower() not in ("0", "false", "off", "no")
+
+
+def _prompt_context(prompt, workspace_id=None, user_id=None):
+    """Top-k workspace excerpts for a prompt as an overlay - sent with the request, never saved with the history"""
+    if not PROMPT_WORKSPACE_CONTEXT:
+        return []
+    return get_workspace_context_overlay(
+        workspace_id=workspace_id,
+        user_id=user_id,
+        include_file_assets=True,
+        include_flashcards=False,
+        query=prompt
+    )
+
+def prompt_input(messages, prompt, workspace_id=None, user_id=None):
     """Generate any inference from any prompt"""
+    context = _prompt_context(prompt, workspace_id=workspace_id, user_id=user_id)
+    messages.append({"role": "user", "content": prompt})
+    resp = LLM_inference(messages=messages, hedge=True, context=context)
+    update_memory(messages, resp)
+    return messages
+
+def prompt_input_stream(messages, prompt, workspace_id=None, user_id=None):
+    """Streaming variant of prompt_input - yields deltas, appends the full reply when done"""
+    context = _prompt_context(prompt, workspace_id=workspace_id, user_id=user_id)
+    messages.append({"role": "user", "content": prompt})
+    yield from stream_to_memory(messages, LLM_inference_stream(messages=messages, context=context))
+
+
+async def async_prompt_input(messages, prompt, workspace_id=None, user_id=None):
+    """Async variant of prompt_input"""
+    # Retrieval reads the workspace with blocking Supabase calls
+    context = await run_blocking(_prompt_context, prompt, workspace_id=workspace_id, user_id=user_id)
     messages.append({"role": "user", "content": prompt})
-    resp = LLM_inference(messages=messages)
+    resp = await async_LLM_inference(messages=messages, hedge=True, context=context)
     update_memory(messages, resp)
-    return messages
\ No newline at end of file
+    return messages
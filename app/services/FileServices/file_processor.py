@@ -7,14 +7,14 @@ import fitz  # PyMuPDF
 from io import BytesIO
 import base64
 from typing import Dict, Optional
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+from app.models.client_registry import get_client
+from app.models.transport import call_with_retries
+from app.utils.metrics import stage, record_usage
 
-load_dotenv()
-
-# Initialize OpenAI client for image descriptions
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Cheaper model for image descriptions
+VISION_MODEL = "gpt-4o-mini"
+# Seconds per page description, including retries
+VISION_DEADLINE = 60
 
 
 def download_file_to_memory(url: str, timeout: int = 60) -> BytesIO:
@@ -89,27 +89,30 @@ def describe_image_with_vision_api(image_base64: bytes, page_num: int) -> str:
         # Convert bytes to base64 string
         base64_string = base64.b64encode(image_base64).decode('utf-8')
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",  # Cheaper model for descriptions
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Describe this page/image in detail. Include any text, diagrams, charts, tables, or visual elements. Be comprehensive but concise."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_string}"
+        with stage("vision"):
+            response = call_with_retries(VISION_MODEL, lambda timeout: get_client(VISION_MODEL).chat.completions.create(
+                model=VISION_MODEL,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "Describe this page/image in detail. Include any text, diagrams, charts, tables, or visual elements. Be comprehensive but concise."
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/png;base64,{base64_string}"
+                                }
                             }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=500  # Limit tokens for cost control
-        )
+                        ]
+                    }
+                ],
+                max_tokens=500,  # Limit tokens for cost control
+                timeout=timeout
+            ), deadline=VISION_DEADLINE)
+        record_usage(VISION_MODEL, response.usage)
         
         return response.choices[0].message.content
     except Exception as e:
@@ -230,27 +233,30 @@ def process_image_comprehensive(file_url: str) -> Dict:
         # Describe image using Vision API
         base64_string = base64.b64encode(image_data).decode('utf-8')
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Describe this image in comprehensive detail. Include all text, visual elements, diagrams, charts, and any important information visible."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_string}"
+        with stage("vision"):
+            response = call_with_retries(VISION_MODEL, lambda timeout: get_client(VISION_MODEL).chat.completions.create(
+                model=VISION_MODEL,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "Describe this image in comprehensive detail. Include all text, visual elements, diagrams, charts, and any important information visible."
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/png;base64,{base64_string}"
+                                }
                             }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1000
-        )
+                        ]
+                    }
+                ],
+                max_tokens=1000,
+                timeout=timeout
+            ), deadline=VISION_DEADLINE)
+        record_usage(VISION_MODEL, response.usage)
         
         description = response.choices[0].message.content
         
@@ -2,13 +2,15 @@ import ast
 import json
 import os
 import fitz  # PyMuPDF
-from app.models.LLM_inference import LLM_inference
+from app.models.LLM_inference import LLM_inference, async_LLM_inference
 from app.utils.utils import update_memory
 
+# Same guide + segment + student answer always gets the same verdict
+VALIDATION_CACHE_TTL = 3600
 
 
-def generate_segmentation(study_guide):
-    """Generate study guide segmentation for comperhension check"""
+def _segmentation_request(study_guide):
+    """Build the messages and response format for study guide segmentation"""
     messages = [{
         "role": "user",
         "content": (
@@ -25,8 +27,7 @@ def generate_segmentation(study_guide):
         )
     }]
 
-    resp = LLM_inference(messages=messages, json_output=True, 
-                        response_format = {
+    response_format = {
                                 "type": "json_schema",
                                 "json_schema": {
                                     "name": "study_guide_segmentation",
@@ -58,13 +59,23 @@ def generate_segmentation(study_guide):
                                     }
                                 }
                             }
-                        )
+    return messages, response_format
 
+def generate_segmentation(study_guide):
+    """Generate study guide segmentation for comperhension check"""
+    messages, response_format = _segmentation_request(study_guide)
+    resp = LLM_inference(messages=messages, json_output=True, response_format=response_format)
     segmentations = resp.choices[0].message.content
     return segmentations
 
-def validate_summary_correctness(study_guide, segment_content, student_response):
-    """Evaluate the student's understanding of the segment for the study guide"""
+async def async_generate_segmentation(study_guide):
+    """Async variant of generate_segmentation"""
+    messages, response_format = _segmentation_request(study_guide)
+    resp = await async_LLM_inference(messages=messages, json_output=True, response_format=response_format)
+    return resp.choices[0].message.content
+
+def _validation_request(study_guide, segment_content, student_response):
+    """Build the messages and response format for comprehension validation"""
     messages = [{
         "role": "user",
         "content": (
@@ -83,8 +94,7 @@ def validate_summary_correctness(study_guide, segment_content, student_response)
         )
     }]
 
-    resp = LLM_inference(messages=messages, json_output=True, 
-                        response_format = {
+    response_format = {
                                 "type": "json_schema",
                                 "json_schema": {
                                     "name": "student_response_evaluation",
@@ -112,7 +122,19 @@ def validate_summary_correctness(study_guide, segment_content, student_response)
                                     }
                                 }
                             }
-                        )
+    return messages, response_format
 
+def validate_summary_correctness(study_guide, segment_content, student_response):
+    """Evaluate the student's understanding of the segment for the study guide"""
+    messages, response_format = _validation_request(study_guide, segment_content, student_response)
+    resp = LLM_inference(messages=messages, json_output=True, response_format=response_format,
+                         cache_ttl=VALIDATION_CACHE_TTL, hedge=True)
     segmentations = resp.choices[0].message.content
-    return segmentations
\ No newline at end of file
+    return segmentations
+
+async def async_validate_summary_correctness(study_guide, segment_content, student_response):
+    """Async variant of validate_summary_correctness"""
+    messages, response_format = _validation_request(study_guide, segment_content, student_response)
+    resp = await async_LLM_inference(messages=messages, json_output=True, response_format=response_format,
+                                     cache_ttl=VALIDATION_CACHE_TTL, hedge=True)
+    return resp.choices[0].message.content
@@ -4,43 +4,76 @@ import os
 import fitz  # PyMuPDF
 from app.models.LLM_inference import LLM_inference
 from app.utils.utils import update_memory
-from app.utils.workspace_context import get_workspace_context_as_message
+from app.utils.workspace_context import get_workspace_context_overlay
+
+
+def flashcard_response_format(num_flashcards=None):
+    """Strict JSON schema for {"flashcards": [{"term", "definition"}]}, optionally pinned to a card count"""
+    cards = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "term": {"type": "string"},
+                "definition": {"type": "string"}
+            },
+            "required": ["term", "definition"],
+            "additionalProperties": False
+        }
+    }
+    if num_flashcards:
+        cards["minItems"] = num_flashcards
+        cards["maxItems"] = num_flashcards
+
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "flashcard_container",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "flashcards": cards
+                },
+                "required": ["flashcards"],
+                "additionalProperties": False
+            },
+            "strict": True
+        }
+    }
+
+
+def _workspace_context(workspace_id=None, user_id=None):
+    """Workspace context overlay (existing flashcards excluded) - sent with the request, never saved with the history"""
+    return get_workspace_context_overlay(
+        workspace_id=workspace_id,
+        user_id=user_id,
+        include_file_assets=True,
+        include_flashcards=False  # Don't include existing flashcards
+    )
 
 
 def generate_flashcards_q(messages, num_flashcards=5, difficulty="hard", workspace_id=None, user_id=None):
     """Generate flashcard questions"""
-    # Prepend workspace context if available (exclude flashcards to avoid duplication)
-    if workspace_id and user_id:
-        context_message = get_workspace_context_as_message(
-            workspace_id=workspace_id,
-            user_id=user_id,
-            include_file_assets=True,
-            include_flashcards=False  # Don't include existing flashcards
-        )
-        if context_message:
-            # Insert after system message (if exists) or at beginning
-            insert_index = 0
-            if messages and messages[0].get("role") == "system":
-                insert_index = 1
-            messages.insert(insert_index, context_message)
+    context = _workspace_context(workspace_id=workspace_id, user_id=user_id)
     messages.append({"role": "user", "content": f"Now, upon all the information either provided to you, or spotted in images, \
     please generate {num_flashcards} flashcard questions. The questions shall have difficulty level '{difficulty}'. \
     FOLLOW STRICTLY THIS FORMAT: \n\
     1. <Question1> \n 2. <Question2> \n 3. <Question3> \n ... \
     The answers shall be concise, short, as conforming the the form of flashcards. \
     Do not include the answers - they will be asked in the next message. Again, do not respond excess words."})
-    resp = LLM_inference(messages=messages)
+    resp = LLM_inference(messages=messages, context=context)
     messages = update_memory(messages, resp)
     return messages
 
-def generate_flashcards_a(messages):
+def generate_flashcards_a(messages, workspace_id=None, user_id=None):
     """Generate flashcard answers"""
+    context = _workspace_context(workspace_id=workspace_id, user_id=user_id)
     messages.append({"role": "user", "content": f"Now, generate the corresponding answers. \
     FOLLOW STRICTLY THIS FORMAT: \n\
     1. <Answer1> \n 2. <Answer2> \n 3. <Answer3> \n ... \
     The answers shall be concise, short, as conforming the the form of flashcards. \
     Again, do not respond excess words."})
-    resp = LLM_inference(messages=messages)
+    resp = LLM_inference(messages=messages, context=context)
     messages = update_memory(messages, resp)
     return messages
 
@@ -63,33 +96,28 @@ def generate_flashcards_json(messages):
     Be aware of any punctuations that might conflict with JSON syntax. This is extremely important!!! Now, you may begin."""
         })
 
-    resp = LLM_inference(messages=messages, json_output=True, 
-                        response_format={
-                            "type": "json_schema",
-                            "json_schema": {
-                                "name": "flashcard_container",
-                                "schema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "flashcards": {
-                                            "type": "array",
-                                            "items": {
-                                                "type": "object",
-                                                "properties": {
-                                                    "term": {"type": "string"},
-                                                    "definition": {"type": "string"}
-                                                },
-                                                "required": ["term", "definition"],
-                                                "additionalProperties": False
-                                            }
-                                        }
-                                    },
-                                    "required": ["flashcards"],
-                                    "additionalProperties": False
-                                },
-                                "strict": True}
-                            }
-                        )
+    resp = LLM_inference(messages=messages, json_output=True, response_format=flashcard_response_format())
 
     messages = update_memory(messages, resp)
-    return messages
\ No newline at end of file
+    return messages
+
+
+def generate_flashcards(messages, num_flashcards=5, difficulty="hard", workspace_id=None, user_id=None):
+    """
+    Generate flashcards in a single schema-constrained call.
+
+    Replaces the generate_flashcards_q -> generate_flashcards_a -> generate_flashcards_json
+    chain: one round trip, and the history is only sent once. The last message
+    holds the same {"flashcards": [...]} JSON the legacy chain produces.
+    """
+    context = _workspace_context(workspace_id=workspace_id, user_id=user_id)
+    num_flashcards = int(num_flashcards)
+    messages.append({"role": "user", "content": f"Now, upon all the information either provided to you, or spotted in images, \
+    please generate exactly {num_flashcards} flashcards. The questions shall have difficulty level '{difficulty}'. \
+    Each flashcard has a \"term\" (the question) and a \"definition\" (the answer). \
+    The answers shall be concise, short, as conforming the the form of flashcards. \
+    Return only the JSON object, and be careful about punctuation and escaping."})
+    resp = LLM_inference(messages=messages, json_output=True, response_format=flashcard_response_format(num_flashcards),
+                         context=context)
+    messages = update_memory(messages, resp)
+    return messages
@@ -4,8 +4,9 @@ Generates podcast scripts with multiple voices (host/guest dialogue)
 """
 import json
 from app.models.LLM_inference import LLM_inference
+from app.models.transport import LONG_DEADLINE
 from app.utils.utils import update_memory
-from app.utils.workspace_context import get_workspace_context_as_message
+from app.utils.workspace_context import get_workspace_context_overlay
 
 
 def generate_podcast_structure(messages, title, description, user_prompt="", speakers=None, workspace_id=None, user_id=None):
@@ -25,20 +26,13 @@ def generate_podcast_structure(messages, title, description, user_prompt="", spe
         (messages, structured_content) - Updated messages and parsed structure
     """
     
-    # Prepend workspace context if available
-    if workspace_id and user_id:
-        context_message = get_workspace_context_as_message(
-            workspace_id=workspace_id,
-            user_id=user_id,
-            include_file_assets=True,
-            include_flashcards=True
-        )
-        if context_message:
-            # Insert after system message (if exists) or at beginning
-            insert_index = 0
-            if messages and messages[0].get("role") == "system":
-                insert_index = 1
-            messages.insert(insert_index, context_message)
+    # Workspace context is sent with the request only, never saved with the history
+    context = get_workspace_context_overlay(
+        workspace_id=workspace_id,
+        user_id=user_id,
+        include_file_assets=True,
+        include_flashcards=True
+    )
     
     # Default to single speaker if none provided
     if not speakers or len(speakers) == 0:
@@ -125,6 +119,8 @@ Analyze the study materials and create an engaging, informative podcast structur
     resp = LLM_inference(
         messages=messages,
         json_output=True,
+        context=context,
+        deadline=LONG_DEADLINE,
                          response_format={
                              "type": "json_schema",
                              "json_schema": {
@@ -437,6 +433,7 @@ Make it engaging, educational, and conversational."""
     resp = LLM_inference(
         messages=messages,
         json_output=True,
+        deadline=LONG_DEADLINE,
                          response_format={
                                 "type": "json_schema",
                                 "json_schema": {
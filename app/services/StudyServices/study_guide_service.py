@@ -2,26 +2,21 @@ import ast
 import json
 import os
 import fitz  # PyMuPDF
-from app.models.LLM_inference import LLM_inference
-from app.utils.utils import update_memory
-from app.utils.workspace_context import get_workspace_context_as_message
+from app.models.LLM_inference import LLM_inference, LLM_inference_stream, async_LLM_inference
+from app.utils.utils import update_memory, stream_to_memory
+from app.utils.async_runtime import run_blocking
+from app.models.transport import LONG_DEADLINE
+from app.utils.workspace_context import get_workspace_context_overlay
 
-def generate_summary(messages, workspace_id=None, user_id=None):
-    """Generate descriptive summary in study-guide style"""
-    # Prepend workspace context if available
-    if workspace_id and user_id:
-        context_message = get_workspace_context_as_message(
-            workspace_id=workspace_id,
-            user_id=user_id,
-            include_file_assets=True,
-            include_flashcards=True
-        )
-        if context_message:
-            # Insert after system message (if exists) or at beginning
-            insert_index = 0
-            if messages and messages[0].get("role") == "system":
-                insert_index = 1
-            messages.insert(insert_index, context_message)
+def _prepare_summary(messages, workspace_id=None, user_id=None):
+    """Append the study-guide instruction to messages; returns (messages, workspace context overlay)"""
+    # Workspace context is sent with the request only, never saved with the history
+    context = get_workspace_context_overlay(
+        workspace_id=workspace_id,
+        user_id=user_id,
+        include_file_assets=True,
+        include_flashcards=True
+    )
     messages.append({"role": "user", "content": "Now, upon all the information either provided to you, or spotted in images, please \
     generate a descriptive summary in the form of a study guide. Format this study guide as if it were written for a student - make it clear, \
     well-organized, easy to understand, and educational. Use a student-friendly tone that explains concepts clearly, breaks down complex ideas into \
@@ -41,15 +36,35 @@ def generate_summary(messages, workspace_id=None, user_id=None):
     - For diagrams with multiple elements, scale appropriately so nothing appears too small\n\
     - Example structure: <svg viewBox=\"0 0 800 600\" width=\"800\" height=\"600\" xmlns=\"http://www.w3.org/2000/svg\"><style>text { font-size: 18px; font-family: Arial, sans-serif; }</style>...</svg>\n\
     - Make graphics comprehensive and detailed - prioritize clarity and completeness over compactness"})
-    
-    resp = LLM_inference(messages=messages)
+    return messages, context
+
+
+def generate_summary(messages, workspace_id=None, user_id=None):
+    """Generate descriptive summary in study-guide style"""
+    messages, context = _prepare_summary(messages, workspace_id=workspace_id, user_id=user_id)
+    resp = LLM_inference(messages=messages, context=context, deadline=LONG_DEADLINE)
     update_memory(messages, resp)
     return messages
 
 
+def generate_summary_stream(messages, workspace_id=None, user_id=None):
+    """Streaming variant of generate_summary - yields deltas, appends the full guide when done"""
+    messages, context = _prepare_summary(messages, workspace_id=workspace_id, user_id=user_id)
+    yield from stream_to_memory(messages, LLM_inference_stream(messages=messages, context=context, deadline=LONG_DEADLINE))
 
-def generate_mindmap_mermaid(messages):
-    """Generate mermaid plot for mind map"""
+
+async def async_generate_summary(messages, workspace_id=None, user_id=None):
+    """Async variant of generate_summary"""
+    # Workspace context is fetched with blocking Supabase calls
+    messages, context = await run_blocking(_prepare_summary, messages, workspace_id=workspace_id, user_id=user_id)
+    resp = await async_LLM_inference(messages=messages, context=context, deadline=LONG_DEADLINE)
+    update_memory(messages, resp)
+    return messages
+
+
+
+def _prepare_mindmap(messages):
+    """Append the mermaid mind map instruction to messages"""
     messages.append({"role": "user", "content": """Now, please generate a mindmap of the given information using the provided syntax. 
     Actually, this is mermaid.js phrasing in case you know. 
     Given is an example: 
@@ -70,8 +85,26 @@ def generate_mindmap_mermaid(messages):
     Do not include any additional text. Important: **generate ONLY the plain text** This means you shouldn't put something like "```mermaid" in front.
     You MUST continue (**WITHOUT INSERTING ANYTHING IN FRONT**) after this header:
     graph LR;\n"""})
+    return messages
+
+
+def generate_mindmap_mermaid(messages):
+    """Generate mermaid plot for mind map"""
+    messages = _prepare_mindmap(messages)
     resp = LLM_inference(messages=messages)
     update_memory(messages, resp)
     return messages
 
 
+def generate_mindmap_mermaid_stream(messages):
+    """Streaming variant of generate_mindmap_mermaid"""
+    messages = _prepare_mindmap(messages)
+    yield from stream_to_memory(messages, LLM_inference_stream(messages=messages))
+
+
+async def async_generate_mindmap_mermaid(messages):
+    """Async variant of generate_mindmap_mermaid"""
+    messages = _prepare_mindmap(messages)
+    resp = await async_LLM_inference(messages=messages)
+    update_memory(messages, resp)
+    return messages
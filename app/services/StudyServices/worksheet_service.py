@@ -3,41 +3,160 @@ import json
 import os
 import fitz  # PyMuPDF
 from app.models.LLM_inference import LLM_inference
+from app.models.transport import LONG_DEADLINE
+from app.utils.metrics import observe
 from app.utils.utils import update_memory
-from app.utils.workspace_context import get_workspace_context_as_message
+from app.utils.workspace_context import get_workspace_context_overlay
+
+PROBLEM_TYPES = ["TEXT", "MULTIPLE_CHOICE", "NUMERIC", "TRUE_FALSE", "MATCHING"]
+DIFFICULTIES = ["EASY", "MEDIUM", "HARD"]
+
+
+def worksheet_response_format(num_questions):
+    """Strict JSON schema for a worksheet with exactly num_questions problems and their mark schemes"""
+    mark_scheme = {
+        "type": "object",
+        "properties": {
+            "points": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "point": {"type": "integer"},
+                        "requirements": {"type": "string"}
+                    },
+                    "required": ["point", "requirements"],
+                    "additionalProperties": False
+                }
+            },
+            "totalPoints": {"type": "integer"}
+        },
+        "required": ["points", "totalPoints"],
+        "additionalProperties": False
+    }
+    problem = {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "answer": {"type": "string"},
+            "type": {"type": "string", "enum": PROBLEM_TYPES},
+            "options": {
+                "type": "array",
+                "items": {"type": "string"}
+            },
+            "mark_scheme": mark_scheme
+        },
+        "required": ["question", "answer", "type", "options", "mark_scheme"],
+        "additionalProperties": False
+    }
+
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "worksheet_container",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "title": {"type": "string"},
+                    "description": {"type": "string"},
+                    "difficulty": {"type": "string", "enum": DIFFICULTIES},
+                    "estimatedTime": {"type": "string"},
+                    "problems": {
+                        "type": "array",
+                        "minItems": num_questions,
+                        "maxItems": num_questions,
+                        "items": problem
+                    }
+                },
+                "required": ["id", "title", "description", "difficulty", "estimatedTime", "problems"],
+                "additionalProperties": False
+            },
+            "strict": True
+        }
+    }
+
+
+def validate_worksheet(worksheet, num_questions):
+    """
+    Check a generated worksheet against the rules the schema cannot express.
+
+    totalPoints is recomputed from the mark scheme points in place; everything
+    else that is wrong is returned as a list of human-readable problems
+    (empty when the worksheet is valid).
+    """
+    errors = []
+    problems = worksheet.get("problems")
+    if not isinstance(problems, list):
+        return ["'problems' is missing or not a list"]
+    if len(problems) != num_questions:
+        errors.append(f"expected {num_questions} problems, got {len(problems)}")
+    if worksheet.get("difficulty") not in DIFFICULTIES:
+        errors.append(f"difficulty must be one of {DIFFICULTIES}")
+
+    for i, problem in enumerate(problems, start=1):
+        kind = problem.get("type")
+        options = problem.get("options") or []
+        answer = str(problem.get("answer", "")).strip()
+        if kind not in PROBLEM_TYPES:
+            errors.append(f"problem {i}: unknown type '{kind}'")
+        if not str(problem.get("question", "")).strip():
+            errors.append(f"problem {i}: empty question")
+        if not answer:
+            errors.append(f"problem {i}: empty answer")
+
+        if kind in ("MULTIPLE_CHOICE", "MATCHING"):
+            if len(options) < 2:
+                errors.append(f"problem {i}: {kind} needs at least 2 options")
+        elif options:
+            errors.append(f"problem {i}: {kind} must have empty options")
+        if kind == "MULTIPLE_CHOICE" and options:
+            if not answer.isdigit() or int(answer) >= len(options):
+                errors.append(f"problem {i}: answer must be the 0-based index of the correct option (0-{len(options) - 1})")
+        if kind == "TRUE_FALSE" and answer.upper() not in ("TRUE", "FALSE"):
+            errors.append(f"problem {i}: answer must be TRUE or FALSE")
+
+        mark_scheme = problem.get("mark_scheme") or {}
+        points = mark_scheme.get("points") or []
+        if not points:
+            errors.append(f"problem {i}: mark scheme has no points")
+        elif any(p.get("point", 0) <= 0 for p in points):
+            errors.append(f"problem {i}: every mark scheme point must be worth at least 1")
+        else:
+            mark_scheme["totalPoints"] = sum(p["point"] for p in points)
+    return errors
+
+
+def _workspace_context(workspace_id=None, user_id=None):
+    """Workspace context overlay - sent with the request, never saved with the history"""
+    return get_workspace_context_overlay(
+        workspace_id=workspace_id,
+        user_id=user_id,
+        include_file_assets=True,
+        include_flashcards=True
+    )
+
 
 def generate_worksheet_q(messages, num_quests=5, difficulty="hard", workspace_id=None, user_id=None):
     """Generate worksheet questions"""
-    # Prepend workspace context if available
-    if workspace_id and user_id:
-        context_message = get_workspace_context_as_message(
-            workspace_id=workspace_id,
-            user_id=user_id,
-            include_file_assets=True,
-            include_flashcards=True
-        )
-        if context_message:
-            # Insert after system message (if exists) or at beginning
-            insert_index = 0
-            if messages and messages[0].get("role") == "system":
-                insert_index = 1
-            messages.insert(insert_index, context_message)
+    context = _workspace_context(workspace_id=workspace_id, user_id=user_id)
     messages.append({"role": "user", "content": f"Now, upon all the information either provided to you, or spotted in images, \
     please generate {num_quests} long questions for a worksheet. They can be of any type: MCQs, FRQs, or even essays, but be organized in terms of the order so that it fits well with a worksheet. The questions shall have difficulty level '{difficulty}'. Please include at least 2 MCQs. \
     FOLLOW STRICTLY THIS FORMAT: \n\
     1. <Question1> \n 2. <Question2> \n 3. <Question3> \n ... \
     Do not include the answers - they will be asked in the next message. Again, do not respond excess words."})
-    resp = LLM_inference(messages=messages)
+    resp = LLM_inference(messages=messages, context=context)
     messages = update_memory(messages, resp)
     return messages
 
-def generate_worksheet_a(messages):
+def generate_worksheet_a(messages, workspace_id=None, user_id=None):
     """Generate worksheet answers"""
+    context = _workspace_context(workspace_id=workspace_id, user_id=user_id)
     messages.append({"role": "user", "content": f"Now, generate the corresponding answers. \
     FOLLOW STRICTLY THIS FORMAT: \n\
     1. <Answer1> \n 2. <Answer2> \n 3. <Answer3> \n ... \
     Again, do not respond excess words."})
-    resp = LLM_inference(messages=messages)
+    resp = LLM_inference(messages=messages, context=context)
     messages = update_memory(messages, resp)
     return messages
 
@@ -151,77 +270,60 @@ You would have to identify whether your original questions includes these choice
 Now, you may begin. You must produce exactly {num_questions} problems in total."""
     })
 
-    resp = LLM_inference(messages=messages, json_output=True, 
-                            response_format={
-                                    "type": "json_schema",
-                                    "json_schema": {
-                                        "name": "worksheet_container",
-                                        "schema": {
-                                            "type": "object",
-                                            "properties": {
-                                                "id": {"type": "integer"},
-                                                "title": {"type": "string"},
-                                                "description": {"type": "string"},
-                                                "difficulty": {"type": "string"},
-                                                "estimatedTime": {"type": "string"},
-                                                "problems": {
-                                                    "type": "array",
-                                                    "minItems": num_questions,
-                                                    "maxItems": num_questions,
-                                                    "items": {
-                                                        "type": "object",
-                                                        "properties": {
-                                                            "question": {"type": "string"},
-                                                            "answer": {"type": "string"},
-                                                            "type": {"type": "string"},
-                                                            "options": {
-                                                                "type": "array",
-                                                                "items": {"type": "string"}
-                                                            },
-                                                            "mark_scheme": {
-                                                                "type": "object",
-                                                                "properties": {
-                                                                    "points": {
-                                                                        "type": "array",
-                                                                        "items": {
-                                                                            "type": "object",
-                                                                            "properties": {
-                                                                                "point": {"type": "integer"},
-                                                                                "requirements": {"type": "string"}
-                                                                            },
-                                                                            "required": ["point", "requirements"],
-                                                                            "additionalProperties": False
-                                                                        }
-                                                                    },
-                                                                    "totalPoints": {"type": "integer"}
-                                                                },
-                                                                "required": ["points", "totalPoints"],
-                                                                "additionalProperties": False
-                                                            }
-                                                        },
-                                                        "required": [
-                                                            "question",
-                                                            "answer",
-                                                            "type",
-                                                            "options",
-                                                            "mark_scheme"
-                                                        ],
-                                                        "additionalProperties": False
-                                                    }
-                                                }
-                                            },
-                                            "required": ["id", "title", "description", "difficulty", "estimatedTime", "problems"],
-                                            "additionalProperties": False
-                                        },
-                                        "strict": True
-                                    }
-                                }
-                            )
+    resp = LLM_inference(messages=messages, json_output=True, response_format=worksheet_response_format(num_questions),
+                         deadline=LONG_DEADLINE)
 
     messages = update_memory(messages, resp)
     return messages
 
 
+def generate_worksheet(messages, num_questions=5, difficulty="hard", workspace_id=None, user_id=None):
+    """
+    Generate a complete worksheet (problems, answers and mark schemes) in one call.
+
+    Replaces the generate_worksheet_q -> generate_worksheet_a -> generate_worksheet_json
+    chain. The structure comes from the strict schema rather than a template in
+    the prompt; the result is then checked with validate_worksheet and, if the
+    model broke a rule, it is asked once to correct the listed problems.
+    The last message holds the worksheet JSON, as with the legacy chain; after
+    a correction the rejected worksheet is not kept in the history.
+    """
+    context = _workspace_context(workspace_id=workspace_id, user_id=user_id)
+
+    num_questions = int(num_questions)
+    response_format = worksheet_response_format(num_questions)
+    messages.append({"role": "user", "content": f"Now, upon all the information either provided to you, or spotted in images, \
+    please generate a worksheet of exactly {num_questions} long questions with their answers and mark schemes. \
+    The questions shall have difficulty level '{difficulty}' and be ordered so that they fit well with a worksheet; include at least 2 MULTIPLE_CHOICE questions. \
+    Rules per type: MULTIPLE_CHOICE and MATCHING list their choices in \"options\" (never in the question text), \
+    and a MULTIPLE_CHOICE answer is the 0-based index of the correct option; TRUE_FALSE answers are TRUE or FALSE; \
+    all other types keep \"options\" empty. Each mark scheme point describes what earns it, and totalPoints is their sum. \
+    Give the worksheet a title, a description and an estimatedTime. Return only the JSON object."})
+    resp = LLM_inference(messages=messages, json_output=True, response_format=response_format, context=context,
+                         deadline=LONG_DEADLINE)
+    messages = update_memory(messages, resp)
+
+    worksheet = json.loads(messages[-1]["content"])
+    errors = validate_worksheet(worksheet, num_questions)
+    if errors:
+        observe("worksheet.validation_retry", 0.0)
+        messages.append({"role": "user", "content": "The worksheet breaks these rules:\n- " + "\n- ".join(errors) +
+                         "\nReturn the corrected worksheet as the same JSON object."})
+        resp = LLM_inference(messages=messages, json_output=True, response_format=response_format, context=context,
+                         deadline=LONG_DEADLINE)
+        messages = update_memory(messages, resp)
+        worksheet = json.loads(messages[-1]["content"])
+        errors = validate_worksheet(worksheet, num_questions)
+        if errors:
+            raise ValueError(f"Generated worksheet is invalid: {errors}")
+        # Keep only the corrected worksheet: drop the rejected one and the correction request
+        del messages[-3:-1]
+
+    # Persist the worksheet with the locally recomputed point totals
+    messages[-1]["content"] = json.dumps(worksheet, ensure_ascii=False)
+    return messages
+
+
 def mark_question(question, answer, mark_scheme, points):
     """Generate worksheet answers"""
     messages = [{
@@ -251,7 +353,8 @@ def mark_question(question, answer, mark_scheme, points):
         )
     }]
 
-    resp = LLM_inference(messages=messages, json_output=True, 
+    # Interactive marking - hedge slow requests
+    resp = LLM_inference(messages=messages, json_output=True, hedge=True,
                             response_format={
                                     "type": "json_schema",
                                     "json_schema": {
@@ -0,0 +1,60 @@
+"""
+Shared asyncio runtime for the async command path
+A single event loop runs in a daemon thread and multiplexes every in-flight
+async LLM / TTS call of the process; request threads submit coroutines to it
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Small pool for the short blocking calls (Supabase, file IO) made from coroutines
+BLOCKING_IO_WORKERS = int(os.getenv("ASYNC_BLOCKING_IO_WORKERS", 16))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared inference event loop, starting it on first use"""
+    global _loop, _executor
+    if _loop is not None:
+        return _loop
+
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            _executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="async-io")
+            loop.set_default_executor(_executor)
+            thread = threading.Thread(target=loop.run_forever, name="inference-loop", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def run_coroutine(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Run a coroutine on the shared loop and wait for its result from a sync thread.
+
+    Args:
+        coro: Coroutine to run
+        timeout: Optional seconds to wait before giving up
+
+    Returns:
+        The coroutine's result (exceptions are re-raised in the caller)
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result(timeout=timeout)
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a short blocking call (e.g. a Supabase request) off the event loop"""
+    loop = asyncio.get_running_loop()
+    # Executors do not propagate contextvars (metrics labels) on their own
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, lambda: context.run(func, *args, **kwargs))
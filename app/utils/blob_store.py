@@ -0,0 +1,230 @@
+"""
+Content-addressed blob store for images inside message history
+Inline base64 image parts are swapped for "blob:<sha256>" references before a
+history is written to llm_messages, and swapped back into data URLs only when a
+model call is made. Blobs live in a private Supabase bucket (BLOB_BUCKET) or
+on local disk, and identical images are stored once across all sessions
+
+Off by default (images stay inline). Enable with BLOB_STORE=local (files
+under BLOB_STORE_DIR, single-node deployments) or BLOB_STORE=supabase after
+creating the private 'history-blobs' bucket (see create_messages_table.sql).
+Never point BLOB_BUCKET at the public 'media' bucket: blobs are user
+history. An image whose upload fails is kept inline, so it can always be
+read back
+"""
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import stage
+
+load_dotenv()
+
+# "supabase" (BLOB_BUCKET), "local" (BLOB_STORE_DIR) or "off" (keep images inline)
+BLOB_STORE = os.getenv("BLOB_STORE", "off").lower()
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "Data/blobs")
+BLOB_BUCKET = os.getenv("BLOB_BUCKET", "history-blobs")
+BLOB_PREFIX = "blobs"
+BLOB_URL_SCHEME = "blob:"
+# Images below this size stay inline (a reference would not save anything)
+MIN_BLOB_BYTES = int(os.getenv("BLOB_MIN_BYTES", 4096))
+# Rehydrated images kept in memory per worker, in base64 characters
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_known: set = set()  # digests known to exist in the store
+_cache: "OrderedDict[str, str]" = OrderedDict()  # digest -> base64 data
+_cache_bytes = 0
+_lock = threading.Lock()
+_stats = {"stored": 0, "deduplicated": 0, "rehydrated": 0, "cache_hits": 0, "store_errors": 0}
+_supabase = None
+
+
+def _storage():
+    """Supabase storage bucket (client built on first use)"""
+    global _supabase
+    if _supabase is None:
+        from supabase import create_client
+        _supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+    return _supabase.storage.from_(BLOB_BUCKET)
+
+
+def _split_data_url(url: str) -> Optional[Tuple[str, str]]:
+    """(mime type, base64 data) of a base64 data URL, else None"""
+    if not url.startswith("data:") or ";base64," not in url:
+        return None
+    header, data = url.split(",", 1)
+    return header[5:].split(";", 1)[0] or "application/octet-stream", data
+
+
+def _object_path(digest: str) -> str:
+    return f"{BLOB_PREFIX}/{digest[:2]}/{digest}"
+
+
+def _remember(digest: str, data: str):
+    """Keep rehydrated base64 in the in-process LRU (caller holds _lock)"""
+    global _cache_bytes
+    if digest in _cache:
+        _cache.move_to_end(digest)
+        return
+    _cache[digest] = data
+    _cache_bytes += len(data)
+    while _cache_bytes > BLOB_CACHE_MAX_BYTES and _cache:
+        _, evicted = _cache.popitem(last=False)
+        _cache_bytes -= len(evicted)
+
+
+def put_blob(data: str, mime_type: str) -> Optional[str]:
+    """
+    Store base64 image data under its SHA-256.
+
+    Args:
+        data: Base64 payload (without the data URL header)
+        mime_type: e.g. image/png
+
+    Returns:
+        The digest, or None if the store is off or the write failed
+    """
+    if BLOB_STORE == "off":
+        return None
+    raw = base64.b64decode(data)
+    digest = hashlib.sha256(raw).hexdigest()
+
+    with _lock:
+        known = digest in _known
+    if known:
+        with _lock:
+            _stats["deduplicated"] += 1
+        return digest
+
+    try:
+        with stage("blob.put"):
+            if BLOB_STORE == "local":
+                path = os.path.join(BLOB_STORE_DIR, _object_path(digest))
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(raw)
+                    os.replace(tmp_path, path)
+            else:
+                try:
+                    _storage().upload(_object_path(digest), raw, file_options={"content-type": mime_type})
+                except Exception as e:
+                    # Same content uploaded before (by this or another worker)
+                    if "exists" not in str(e).lower() and "duplicate" not in str(e).lower():
+                        raise
+    except Exception as e:
+        print(f"Warning: Failed to store image blob, keeping it inline: {e}")
+        with _lock:
+            _stats["store_errors"] += 1
+        return None
+
+    with _lock:
+        _known.add(digest)
+        _stats["stored"] += 1
+        _remember(digest, data)
+    return digest
+
+
+def get_blob(digest: str) -> str:
+    """Base64 data for a digest (memory LRU, then the store)"""
+    with _lock:
+        data = _cache.get(digest)
+        if data is not None:
+            _cache.move_to_end(digest)
+            _stats["cache_hits"] += 1
+            return data
+
+    local_path = os.path.join(BLOB_STORE_DIR, _object_path(digest))
+    with stage("blob.get"):
+        # References written before the store was switched off are still read back
+        if BLOB_STORE == "local" or (BLOB_STORE == "off" and os.path.exists(local_path)):
+            with open(local_path, "rb") as f:
+                raw = f.read()
+        else:
+            raw = _storage().download(_object_path(digest))
+    data = base64.b64encode(raw).decode("utf-8")
+
+    with _lock:
+        _known.add(digest)
+        _stats["rehydrated"] += 1
+        _remember(digest, data)
+    return data
+
+
+def _map_image_parts(messages: List[Dict], convert) -> List[Dict]:
+    """Copy of messages with convert(image_url dict) applied to every image part; unchanged input is returned as is"""
+    result = None
+    for i, msg in enumerate(messages):
+        content = msg.get("content")
+        if not isinstance(content, list):
+            continue
+        new_content = None
+        for j, part in enumerate(content):
+            if not (isinstance(part, dict) and part.get("type") == "image_url"):
+                continue
+            image_url = convert(part.get("image_url") or {})
+            if image_url is None:
+                continue
+            if new_content is None:
+                new_content = list(content)
+            new_content[j] = dict(part, image_url=image_url)
+        if new_content is not None:
+            if result is None:
+                result = list(messages)
+            result[i] = dict(msg, content=new_content)
+    return messages if result is None else result
+
+
+def dehydrate_messages(messages: List[Dict]) -> List[Dict]:
+    """Replace inline base64 images with blob references (used before persisting)"""
+    if BLOB_STORE == "off":
+        return messages
+
+    def convert(image_url):
+        parsed = _split_data_url(image_url.get("url", ""))
+        if parsed is None or len(parsed[1]) < MIN_BLOB_BYTES:
+            return None
+        mime_type, data = parsed
+        digest = put_blob(data, mime_type)
+        if digest is None:
+            return None
+        return dict(image_url, url=f"{BLOB_URL_SCHEME}{digest}", mime_type=mime_type)
+
+    return _map_image_parts(messages, convert)
+
+
+def rehydrate_messages(messages: List[Dict]) -> List[Dict]:
+    """Turn blob references back into data URLs (used right before a model call)"""
+    def convert(image_url):
+        url = image_url.get("url", "")
+        if not url.startswith(BLOB_URL_SCHEME):
+            return None
+        data = get_blob(url[len(BLOB_URL_SCHEME):])
+        restored = {k: v for k, v in image_url.items() if k != "mime_type"}
+        restored["url"] = f"data:{image_url.get('mime_type', 'image/png')};base64,{data}"
+        return restored
+
+    return _map_image_parts(messages, convert)
+
+
+def has_blob_refs(messages: List[Dict]) -> bool:
+    """Whether any image part is a blob reference"""
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and str((part.get("image_url") or {}).get("url", "")).startswith(BLOB_URL_SCHEME):
+                    return True
+    return False
+
+
+def blob_stats() -> Dict:
+    """Blob store counters and memory use"""
+    with _lock:
+        return dict(_stats, backend=BLOB_STORE, cached_blobs=len(_cache), cache_bytes=_cache_bytes)
@@ -0,0 +1,164 @@
+"""
+Token-budgeted packing of workspace file content
+Fits the files of a workspace context into a per-command token budget: the
+overlap between a file's comprehensiveDescription and its textContent is
+removed, the budget is shared across files in proportion to their remaining
+size (files that need less than their share give the rest back), and
+anything cut is cut on a sentence boundary
+"""
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.context_window import CHARS_PER_TOKEN
+
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("WORKSPACE_CONTEXT_TOKEN_BUDGET", 8000))
+
+# Per-command workspace context budgets (tokens), on top of the history budget
+WORKSPACE_CONTEXT_BUDGETS = {
+    "generate_study_guide": 16000,
+    "generate_flashcard_questions": 8000,
+    "generate_worksheet_questions": 8000,
+    "generate_podcast_structure": 12000,
+    "inference_from_prompt": 4000,  # top-k excerpts only
+}
+
+# Existing flashcards may take at most this share of the budget
+FLASHCARD_BUDGET_SHARE = 0.25
+
+TRUNCATION_MARKER = " [...]"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+|\n+")
+_WHITESPACE = re.compile(r"\s+")
+
+_stats: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def context_budget(command: str) -> int:
+    """Workspace context token budget of a command"""
+    return WORKSPACE_CONTEXT_BUDGETS.get(command, DEFAULT_CONTEXT_BUDGET)
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences / lines of a text, without surrounding whitespace"""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def dedupe_text(text: str, reference: str) -> str:
+    """Sentences of text that do not already appear in reference (order kept)"""
+    if not text or not reference:
+        return text or ""
+    seen = _normalize(reference)
+    if _normalize(text) in seen:
+        return ""
+    kept = [s for s in split_sentences(text) if len(s) < 20 or _normalize(s) not in seen]
+    return " ".join(kept)
+
+
+def truncate_sentences(text: str, max_chars: int) -> str:
+    """Cut text to at most max_chars, at the last sentence end that fits (else the last word)"""
+    if len(text) <= max_chars:
+        return text
+    limit = max_chars - len(TRUNCATION_MARKER)
+    if limit <= 0:
+        return ""
+    cut = -1
+    for match in _SENTENCE_END.finditer(text, 0, limit + 1):
+        cut = match.start()
+    if cut < limit // 2:
+        # No sentence end in the second half of the window: fall back to a word boundary
+        cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+    return text[:cut].rstrip() + TRUNCATION_MARKER
+
+
+def file_sections(transcription: Dict) -> List[Tuple[str, str]]:
+    """(label, text) sections of a parsed aiTranscription, with textContent deduplicated against the description"""
+    description = transcription.get("comprehensiveDescription") or ""
+    text_content = dedupe_text(transcription.get("textContent") or "", description)
+
+    visuals, seen = [], set()
+    for img_desc in transcription.get("imageDescriptions") or []:
+        description_text = (img_desc.get("description") or "").strip()
+        key = _normalize(description_text)
+        if not key or key in seen or key in _normalize(description):
+            continue
+        seen.add(key)
+        visuals.append(f"Page {img_desc.get('page', '?')}: {description_text}")
+
+    sections = []
+    if description:
+        sections.append(("Content", description))
+    if text_content:
+        sections.append(("Text Content", text_content))
+    if visuals:
+        sections.append(("Visual Content", "\n".join(visuals)))
+    return sections
+
+
+def allocate(sizes: List[int], total: int, cap: Optional[int] = None) -> List[int]:
+    """
+    Split total characters across items in proportion to their sizes.
+
+    No item gets more than it needs (or more than cap); what is left over is
+    shared again among the items that still want more.
+    """
+    wants = [min(size, cap) if cap is not None else size for size in sizes]
+    shares = [0] * len(sizes)
+    remaining = total
+    open_items = [i for i, want in enumerate(wants) if want > 0]
+    while open_items and remaining > 0:
+        weight = sum(wants[i] - shares[i] for i in open_items)
+        granted = 0
+        for i in open_items:
+            need = wants[i] - shares[i]
+            grant = min(need, remaining - granted, max(1, remaining * need // weight))
+            shares[i] += grant
+            granted += grant
+        remaining -= granted
+        open_items = [i for i in open_items if shares[i] < wants[i]]
+        if granted == 0:
+            break
+    return shares
+
+
+def pack_sections(sections: List[Tuple[str, str]], max_chars: int) -> List[Tuple[str, str]]:
+    """Fit one file's sections into max_chars, earlier sections first"""
+    packed, remaining = [], max_chars
+    for label, text in sections:
+        if remaining <= len(label) + len(TRUNCATION_MARKER) + 8:
+            break
+        body = truncate_sentences(text, remaining - len(label) - 3)
+        if body:
+            packed.append((label, body))
+            remaining -= len(label) + 3 + len(body)
+    return packed
+
+
+def record_packing(command: str, chars_before: int, chars_after: int, chars_deduplicated: int, files_truncated: int):
+    with _lock:
+        stats = _stats.setdefault(command, {
+            "calls": 0, "tokens_before": 0, "tokens_after": 0, "tokens_deduplicated": 0, "files_truncated": 0
+        })
+        stats["calls"] += 1
+        stats["tokens_before"] += chars_before // CHARS_PER_TOKEN
+        stats["tokens_after"] += chars_after // CHARS_PER_TOKEN
+        stats["tokens_deduplicated"] += chars_deduplicated // CHARS_PER_TOKEN
+        stats["files_truncated"] += files_truncated
+
+
+def context_packing_stats() -> Dict[str, Dict]:
+    """Workspace context tokens before / after packing, per command"""
+    with _lock:
+        report = {}
+        for command, stats in _stats.items():
+            report[command] = dict(stats, budget=context_budget(command))
+            report[command]["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    return report
@@ -0,0 +1,233 @@
+"""
+Token-budgeted history windowing for session messages
+Sits between get_messages and the generators: keeps the system prompt and the
+most recent turns within a per-command token budget and folds everything older
+into a rolling summary message that is saved back with the session history
+"""
+import os
+import threading
+from typing import Dict, List
+
+from app.db import get_messages
+from app.models.LLM_inference import LLM_inference
+
+# Rough OpenAI-style estimate: ~4 characters per token, fixed cost per image part
+CHARS_PER_TOKEN = 4
+IMAGE_TOKEN_COST = 765
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Always keep at least this many trailing messages verbatim
+MIN_RECENT_MESSAGES = 4
+
+SUMMARY_HEADER = "# CONVERSATION SUMMARY"
+WORKSPACE_CONTEXT_HEADER = "# WORKSPACE CONTEXT"
+SUMMARY_CACHE_TTL = 7 * 24 * 3600
+
+DEFAULT_HISTORY_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 16000))
+
+# Per-command history budgets (tokens). Generators add their own instructions
+# and workspace context on top of this.
+HISTORY_BUDGETS = {
+    "generate_study_guide": 24000,
+    "generate_flashcard_questions": 12000,
+    "generate_worksheet_questions": 12000,
+    "inference_from_prompt": 16000,
+    "generate_podcast_structure": 16000,
+}
+
+# Commands that only need the tail of a session read a bounded window of
+# messages (plus the system prompt / rolling summary) instead of the full
+# history, and append their new turn rather than re-saving the session
+HISTORY_WINDOW_MESSAGES = {
+    "inference_from_prompt": int(os.getenv("INFERENCE_HISTORY_MESSAGES", 40)),
+}
+# The system prompt and, after a compaction, the rolling summary lead the history
+HEAD_MESSAGES = 2
+
+_stats: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def _content_tokens(content) -> int:
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN + 1
+    if isinstance(content, list):
+        tokens = 0
+        for part in content:
+            if not isinstance(part, dict):
+                tokens += len(str(part)) // CHARS_PER_TOKEN + 1
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKEN_COST
+            else:
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN + 1
+        return tokens
+    return len(str(content)) // CHARS_PER_TOKEN + 1
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """Estimate prompt tokens for a message list (base64 images count as one image each)"""
+    return sum(_content_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def _text_of(content) -> str:
+    """Plain text of a message, with image parts replaced by a placeholder"""
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                parts.append("[image]")
+            elif isinstance(part, dict):
+                parts.append(part.get("text", ""))
+            else:
+                parts.append(str(part))
+        return "\n".join(parts)
+    return str(content)
+
+
+def _is_summary(message: Dict) -> bool:
+    return (message.get("role") == "system" and isinstance(message.get("content"), str)
+            and message["content"].startswith(SUMMARY_HEADER))
+
+
+def _is_workspace_context(message: Dict) -> bool:
+    return isinstance(message.get("content"), str) and message["content"].startswith(WORKSPACE_CONTEXT_HEADER)
+
+
+def summarize_turns(turns: List[Dict]) -> str:
+    """
+    Fold older turns (including any previous rolling summary) into one summary.
+
+    The summary call goes through the response cache, so re-compacting the
+    same prefix of a session does not cost another model call.
+    """
+    transcript = "\n\n".join(f"[{m.get('role', 'user').upper()}]\n{_text_of(m.get('content', ''))}" for m in turns)
+    messages = [
+        {
+            "role": "system",
+            "content": "You compress the history of a study-assistant conversation. Keep every fact, definition, "
+                       "formula and piece of study material the assistant was given or produced, and note which "
+                       "study guides, flashcards, worksheets or podcasts were already generated. Drop greetings and "
+                       "instructions that are no longer relevant. Write compact Markdown notes, no preamble."
+        },
+        {"role": "user", "content": transcript},
+    ]
+    resp = LLM_inference(messages=messages, cache_ttl=SUMMARY_CACHE_TTL)
+    return resp.choices[0].message.content
+
+
+def window_history(messages: List[Dict], command: str, token_budget: int = None) -> List[Dict]:
+    """
+    Fit a session history into the command's token budget.
+
+    Leading system messages and the most recent turns are kept verbatim;
+    older turns are replaced by a single rolling summary placed right after
+    the system prompt: a system message starting with SUMMARY_HEADER, so it is
+    never mistaken for a user turn and the next compaction folds it into its
+    replacement. Copies of the workspace context stored by older versions are
+    dropped (generators now send it as an overlay). The caller persists the
+    returned list as usual, so the compaction is stored back into the session.
+
+    Args:
+        messages: Full history from get_messages
+        command: Command name (selects the budget and the metrics bucket)
+        token_budget: Optional explicit budget overriding HISTORY_BUDGETS
+
+    Returns:
+        The (possibly compacted) history
+    """
+    budget = token_budget or HISTORY_BUDGETS.get(command, DEFAULT_HISTORY_BUDGET)
+    tokens_before = estimate_tokens(messages)
+
+    compacted = messages
+    if tokens_before > budget:
+        head = 0
+        while head < len(messages) and messages[head].get("role") == "system" and not _is_summary(messages[head]):
+            head += 1
+        system_messages = messages[:head]
+        rest = messages[head:]
+
+        # Walk back from the end while the recent window fits the remaining budget
+        available = budget - estimate_tokens(system_messages)
+        start = len(rest)
+        used = 0
+        while start > 0:
+            cost = estimate_tokens([rest[start - 1]])
+            if used + cost > available and len(rest) - start >= MIN_RECENT_MESSAGES:
+                break
+            used += cost
+            start -= 1
+        # Start the verbatim window on a user turn so no reply loses its question
+        while start < len(rest) and rest[start].get("role") == "assistant":
+            start += 1
+
+        older = [m for m in rest[:start] if not _is_workspace_context(m)]
+        recent = rest[start:]
+
+        if older:
+            try:
+                summary = summarize_turns(older)
+                compacted = system_messages + [{"role": "system", "content": f"{SUMMARY_HEADER}\n\n{summary}"}] + recent
+            except Exception as e:
+                print(f"Warning: Failed to summarise history, sending it unchanged: {e}")
+
+    _record(command, tokens_before, estimate_tokens(compacted), compacted is not messages)
+    return compacted
+
+
+def _record(command: str, tokens_before: int, tokens_after: int, compacted: bool):
+    with _lock:
+        stats = _stats.setdefault(command, {"calls": 0, "compactions": 0, "tokens_before": 0, "tokens_after": 0})
+        stats["calls"] += 1
+        stats["compactions"] += int(compacted)
+        stats["tokens_before"] += tokens_before
+        stats["tokens_after"] += tokens_after
+
+
+def recent_history(session_id: str, command: str) -> List[Dict]:
+    """
+    Read a bounded window of a session for commands in HISTORY_WINDOW_MESSAGES.
+
+    Returns the leading system prompt and rolling summary followed by the last
+    HISTORY_WINDOW_MESSAGES[command] messages, starting on a user turn. Two
+    indexed reads (head page and tail) regardless of the session length.
+    Instead of being summarised (the window moves on with every turn, so the
+    summary would never be reused), a window over the command's token budget
+    drops its oldest turns, keeping at least MIN_RECENT_MESSAGES.
+    """
+    last_n = HISTORY_WINDOW_MESSAGES[command]
+    tail = get_messages(session_id, last_n=last_n, columns=("role", "content", "sequence"))
+    if not tail:
+        return []
+
+    head, truncated = [], tail[0]["sequence"] > 0
+    if truncated:
+        page = get_messages(session_id, since_sequence=0, limit=min(HEAD_MESSAGES, tail[0]["sequence"]),
+                            columns=("role", "content", "sequence"))
+        head = [m for m in page if m["role"] == "system"]
+    head = [{"role": m["role"], "content": m["content"]} for m in head]
+    tail = [{"role": m["role"], "content": m["content"]} for m in tail]
+
+    tokens_before = estimate_tokens(head + tail)
+    available = HISTORY_BUDGETS.get(command, DEFAULT_HISTORY_BUDGET) - estimate_tokens(head)
+    used = estimate_tokens(tail)
+    start = 0
+    while len(tail) - start > MIN_RECENT_MESSAGES and used > available:
+        used -= estimate_tokens([tail[start]])
+        start += 1
+    # Start the verbatim window on a user turn so no reply loses its question
+    while len(tail) - start > 1 and tail[start]["role"] == "assistant" and (start or truncated):
+        start += 1
+    messages = head + tail[start:]
+    _record(command, tokens_before, estimate_tokens(messages), start > 0)
+    return messages
+
+
+def context_window_stats() -> Dict[str, Dict]:
+    """Prompt tokens saved per command by history windowing"""
+    with _lock:
+        report = {}
+        for command, stats in _stats.items():
+            report[command] = dict(stats)
+            report[command]["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+            report[command]["budget"] = HISTORY_BUDGETS.get(command, DEFAULT_HISTORY_BUDGET)
+    return report
@@ -0,0 +1,138 @@
+"""
+In-process latency, token and cost metrics
+Each command is broken down into stages (Supabase reads/writes, LLM calls,
+vision calls, TTS, storage uploads). Stage timings are aggregated into
+histograms per (command, stage) and served on the /metrics endpoint
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+# USD per 1M tokens (input, output) - update when provider pricing changes
+MODEL_PRICES = {
+    "gpt-5-nano": (0.05, 0.40),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Command being served and the per-request stage log (set by the /upload dispatcher)
+current_command: contextvars.ContextVar[str] = contextvars.ContextVar("current_command", default="none")
+request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_stages", default=None)
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, str], Dict] = {}
+_tokens: Dict[Tuple[str, str], Dict] = {}
+
+
+def _new_histogram() -> Dict:
+    return {"count": 0, "sum": 0.0, "max": 0.0, "errors": 0, "buckets": [0] * len(BUCKETS)}
+
+
+def observe(stage: str, seconds: float, command: str = None, error: bool = False):
+    """Record one stage duration for the current (or given) command"""
+    command = command or current_command.get()
+    with _lock:
+        hist = _histograms.setdefault((command, stage), _new_histogram())
+        hist["count"] += 1
+        hist["sum"] += seconds
+        hist["max"] = max(hist["max"], seconds)
+        hist["errors"] += int(error)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+                break
+
+    stages = request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block as one stage of the current command.
+
+    Usage:
+        with stage("db.get_messages"):
+            ...
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, error=error)
+
+
+def record_usage(model: str, usage, command: str = None):
+    """Accumulate prompt/completion tokens and estimated cost from a response's usage"""
+    if usage is None:
+        return
+    command = command or current_command.get()
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    with _lock:
+        totals = _tokens.setdefault((command, model), {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["cost_usd"] += cost
+
+
+def _quantile(hist: Dict, q: float) -> Optional[float]:
+    """Upper bucket bound containing the q-quantile (Prometheus-style estimate)"""
+    if not hist["count"]:
+        return None
+    target = q * hist["count"]
+    seen = 0
+    for bound, count in zip(BUCKETS, hist["buckets"]):
+        seen += count
+        if seen >= target:
+            return hist["max"] if bound == float("inf") else bound
+    return hist["max"]
+
+
+def begin_request(command: str):
+    """Bind the command and a fresh stage log to the current context; returns reset tokens"""
+    return current_command.set(command), request_stages.set([])
+
+
+def end_request(tokens) -> List[Tuple[str, float]]:
+    """Restore the context from begin_request and return the stages recorded for the request"""
+    command_token, stages_token = tokens
+    stages = request_stages.get() or []
+    request_stages.reset(stages_token)
+    current_command.reset(command_token)
+    return stages
+
+
+def snapshot() -> Dict:
+    """All histograms and token totals, grouped by command"""
+    report: Dict[str, Dict] = {}
+    with _lock:
+        for (command, stage_name), hist in sorted(_histograms.items()):
+            entry = report.setdefault(command, {"stages": {}, "models": {}})
+            entry["stages"][stage_name] = {
+                "count": hist["count"],
+                "errors": hist["errors"],
+                "sum_seconds": round(hist["sum"], 4),
+                "avg_seconds": round(hist["sum"] / hist["count"], 4) if hist["count"] else None,
+                "max_seconds": round(hist["max"], 4),
+                "p50_seconds": _quantile(hist, 0.5),
+                "p95_seconds": _quantile(hist, 0.95),
+                "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(BUCKETS, hist["buckets"])},
+            }
+        for (command, model), totals in sorted(_tokens.items()):
+            entry = report.setdefault(command, {"stages": {}, "models": {}})
+            entry["models"][model] = dict(totals, cost_usd=round(totals["cost_usd"], 6))
+    return report
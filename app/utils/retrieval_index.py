@@ -0,0 +1,356 @@
+"""
+Local retrieval index over workspace file transcriptions
+Chunks each FileAsset's aiTranscription (page text and page/image
+descriptions) and keeps a BM25 index per workspace, persisted under
+RETRIEVAL_INDEX_DIR and updated file by file. With NumPy installed, hashed
+character-trigram vectors are kept alongside and blended into the ranking,
+which catches inflections and spelling variants that exact BM25 terms miss
+"""
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+try:
+    import numpy as np
+except ImportError:  # optional - BM25 only when it is not installed
+    np = None
+
+load_dotenv()
+
+RETRIEVAL_INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", "Data/retrieval")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+# "on" blends trigram-vector similarity into BM25 (needs numpy)
+RETRIEVAL_VECTORS = os.getenv("RETRIEVAL_VECTORS", "on").lower() in ("1", "true", "on", "yes")
+VECTOR_WEIGHT = float(os.getenv("RETRIEVAL_VECTOR_WEIGHT", 0.3))
+# Workspaces kept loaded per worker
+MAX_LOADED_INDEXES = int(os.getenv("RETRIEVAL_MAX_LOADED_INDEXES", 64))
+
+CHUNK_WORDS = 180
+CHUNK_OVERLAP_WORDS = 30
+VECTOR_DIMS = 1024
+BM25_K1 = 1.5
+BM25_B = 0.75
+INDEX_FORMAT = 1
+
+_PAGE_MARKER = re.compile(r"^--- Page (\d+) ---$", re.MULTILINE)
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in into is it its of on or that the their this to was were "
+    "which with what how why when where who does do can".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _windows(text: str) -> List[str]:
+    """Overlapping CHUNK_WORDS-word windows of a text"""
+    words = text.split()
+    if len(words) <= CHUNK_WORDS:
+        return [" ".join(words)] if words else []
+    step = CHUNK_WORDS - CHUNK_OVERLAP_WORDS
+    return [" ".join(words[i:i + CHUNK_WORDS]) for i in range(0, len(words) - CHUNK_OVERLAP_WORDS, step)]
+
+
+def chunk_transcription(transcription: Dict) -> List[Dict]:
+    """
+    Retrieval chunks of a parsed aiTranscription.
+
+    Page text is split on the "--- Page N ---" markers file_processor writes
+    and then into overlapping word windows; every page/image description is
+    a chunk of its own. The comprehensiveDescription repeats both, so it is
+    only chunked when neither is present.
+    """
+    chunks = []
+    text_content = transcription.get("textContent") or ""
+    if text_content:
+        markers = list(_PAGE_MARKER.finditer(text_content))
+        if markers:
+            pages = [(int(m.group(1)), text_content[m.end():markers[i + 1].start() if i + 1 < len(markers) else None])
+                     for i, m in enumerate(markers)]
+        else:
+            pages = [(None, text_content)]
+        for page, text in pages:
+            chunks.extend({"page": page, "kind": "text", "text": window} for window in _windows(text))
+
+    for img_desc in transcription.get("imageDescriptions") or []:
+        description = (img_desc.get("description") or "").strip()
+        if description:
+            chunks.append({"page": img_desc.get("page"), "kind": "visual", "text": description})
+
+    if not chunks:
+        chunks.extend({"page": None, "kind": "summary", "text": window}
+                      for window in _windows(transcription.get("comprehensiveDescription") or ""))
+    return chunks
+
+
+def _trigram_vector(text: str):
+    """L2-normalised hashed character-trigram counts of the text's tokens"""
+    vector = np.zeros(VECTOR_DIMS, dtype=np.float32)
+    for token in tokenize(text):
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % VECTOR_DIMS] += 1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class WorkspaceIndex:
+    """BM25 (plus optional trigram vectors) over the chunks of one workspace's files"""
+
+    def __init__(self, workspace_id: str):
+        self.workspace_id = workspace_id
+        self.files: Dict[str, Dict] = {}      # file id -> {"name", "updated_at", "chunks": [chunk ids]}
+        self.chunks: Dict[int, Dict] = {}     # chunk id -> {"file_id", "page", "kind", "text"}
+        self.next_id = 0
+        self._postings: Dict[str, Dict[int, int]] = {}  # term -> {chunk id: term frequency}
+        self._lengths: Dict[int, int] = {}
+        self._total_length = 0
+        self._vectors: Dict[int, object] = {}
+        self._matrix = None  # (chunk ids, stacked vectors), rebuilt after changes
+        self.lock = threading.RLock()
+
+    @property
+    def use_vectors(self) -> bool:
+        return RETRIEVAL_VECTORS and np is not None
+
+    def _add_chunk(self, chunk_id: int, chunk: Dict):
+        self.chunks[chunk_id] = chunk
+        terms = Counter(tokenize(chunk["text"]))
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+        length = sum(terms.values())
+        self._lengths[chunk_id] = length
+        self._total_length += length
+        if self.use_vectors:
+            self._vectors[chunk_id] = _trigram_vector(chunk["text"])
+            self._matrix = None
+
+    def _remove_chunk(self, chunk_id: int):
+        chunk = self.chunks.pop(chunk_id)
+        for term in set(tokenize(chunk["text"])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+        if self._vectors.pop(chunk_id, None) is not None:
+            self._matrix = None
+
+    def add_file(self, file_id: str, transcription: Dict, file_name: str = None, updated_at: str = None):
+        """Index (or re-index) one file's transcription"""
+        with self.lock:
+            self.remove_file(file_id)
+            ids = []
+            for chunk in chunk_transcription(transcription):
+                chunk_id = self.next_id
+                self.next_id += 1
+                self._add_chunk(chunk_id, dict(chunk, file_id=file_id))
+                ids.append(chunk_id)
+            self.files[file_id] = {"name": file_name or file_id, "updated_at": updated_at, "chunks": ids}
+
+    def remove_file(self, file_id: str):
+        with self.lock:
+            entry = self.files.pop(file_id, None)
+            for chunk_id in (entry or {}).get("chunks", []):
+                self._remove_chunk(chunk_id)
+
+    def search(self, query: str, top_k: int = None) -> List[Dict]:
+        """Best chunks for a query: [{"file_id", "file_name", "page", "kind", "text", "score"}]"""
+        top_k = top_k or RETRIEVAL_TOP_K
+        terms = tokenize(query)
+        with self.lock:
+            n = len(self.chunks)
+            if not n or not terms:
+                return []
+            avg_length = self._total_length / n or 1.0
+            scores: Dict[int, float] = {}
+            for term in set(terms):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            if self.use_vectors and self._vectors:
+                # Blend normalised BM25 with cosine similarity of trigram vectors
+                if self._matrix is None:
+                    ids = list(self._vectors)
+                    self._matrix = (ids, np.stack([self._vectors[i] for i in ids]))
+                ids, matrix = self._matrix
+                similarities = matrix @ _trigram_vector(query)
+                best = max(scores.values(), default=0.0) or 1.0
+                blended = {}
+                for chunk_id, similarity in zip(ids, similarities.tolist()):
+                    score = (1 - VECTOR_WEIGHT) * scores.get(chunk_id, 0.0) / best + VECTOR_WEIGHT * similarity
+                    if score > 0:
+                        blended[chunk_id] = score
+                scores = blended
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [
+                dict(self.chunks[chunk_id], file_name=self.files[self.chunks[chunk_id]["file_id"]]["name"],
+                     score=round(score, 4))
+                for chunk_id, score in ranked
+            ]
+
+    def to_json(self) -> Dict:
+        with self.lock:
+            return {
+                "format": INDEX_FORMAT,
+                "workspace_id": self.workspace_id,
+                "next_id": self.next_id,
+                "files": self.files,
+                "chunks": {str(chunk_id): chunk for chunk_id, chunk in self.chunks.items()},
+            }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "WorkspaceIndex":
+        index = cls(data["workspace_id"])
+        index.next_id = data["next_id"]
+        index.files = data["files"]
+        for chunk_id, chunk in data["chunks"].items():
+            index._add_chunk(int(chunk_id), chunk)
+        return index
+
+
+_indexes: "OrderedDict[str, WorkspaceIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+_stats = {"loaded": 0, "built": 0, "files_indexed": 0, "files_removed": 0, "searches": 0}
+
+
+def _index_path(workspace_id: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", workspace_id)
+    return os.path.join(RETRIEVAL_INDEX_DIR, f"{safe}.json")
+
+
+def get_index(workspace_id: str) -> WorkspaceIndex:
+    """A workspace's index (memory, then disk, else a new empty one)"""
+    with _indexes_lock:
+        index = _indexes.get(workspace_id)
+        if index is not None:
+            _indexes.move_to_end(workspace_id)
+            return index
+
+    index = None
+    path = _index_path(workspace_id)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("format") == INDEX_FORMAT:
+                index = WorkspaceIndex.from_json(data)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: Rebuilding unreadable retrieval index {path}: {e}")
+    with _indexes_lock:
+        if index is None:
+            index = WorkspaceIndex(workspace_id)
+            _stats["built"] += 1
+        else:
+            _stats["loaded"] += 1
+        index = _indexes.setdefault(workspace_id, index)
+        _indexes.move_to_end(workspace_id)
+        while len(_indexes) > MAX_LOADED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def save_index(index: WorkspaceIndex):
+    """Persist an index atomically"""
+    path = _index_path(index.workspace_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_json(), f)
+    os.replace(tmp_path, path)
+
+
+def index_file(workspace_id: str, file_id: str, transcription: Dict, file_name: str = None,
+               updated_at: str = None) -> int:
+    """
+    Add or replace one file in a workspace's index and persist it; returns the number of chunks.
+
+    Without updated_at (the FileAsset row is usually written after processing)
+    the next sync_index takes the row's updatedAt instead of re-indexing it.
+    """
+    index = get_index(workspace_id)
+    with index.lock:
+        index.add_file(file_id, transcription, file_name, updated_at)
+        save_index(index)
+        count = len(index.files[file_id]["chunks"])
+    with _indexes_lock:
+        _stats["files_indexed"] += 1
+    return count
+
+
+def sync_index(workspace_id: str, files: List[Dict], load_transcriptions) -> WorkspaceIndex:
+    """
+    Bring a workspace's index in line with its FileAssets.
+
+    Args:
+        files: [{"id", "fileName", "updatedAt"}] of every FileAsset in the workspace
+        load_transcriptions: callable(list of ids) -> {id: parsed aiTranscription},
+                             called only for new or changed files
+
+    Returns:
+        The up-to-date index
+    """
+    index = get_index(workspace_id)
+    with index.lock:
+        current = {f["id"]: f for f in files}
+        changed, adopted = [], 0
+        for file_id, f in current.items():
+            entry = index.files.get(file_id)
+            if entry is not None and entry.get("updated_at") is None and f.get("updatedAt"):
+                # Indexed by index_file while it was processed, before its FileAsset row was written
+                entry["updated_at"] = f["updatedAt"]
+                adopted += 1
+            elif entry is None or entry.get("updated_at") != f.get("updatedAt"):
+                changed.append(file_id)
+        removed = [file_id for file_id in index.files if file_id not in current]
+        if not changed and not removed:
+            if adopted:
+                save_index(index)
+            return index
+
+        for file_id in removed:
+            index.remove_file(file_id)
+        transcriptions = load_transcriptions(changed) if changed else {}
+        for file_id in changed:
+            transcription = transcriptions.get(file_id)
+            if transcription is None:
+                index.remove_file(file_id)
+                continue
+            f = current[file_id]
+            index.add_file(file_id, transcription, f.get("fileName"), f.get("updatedAt"))
+        save_index(index)
+
+    with _indexes_lock:
+        _stats["files_indexed"] += len(changed)
+        _stats["files_removed"] += len(removed)
+    return index
+
+
+def search(workspace_id: str, query: str, top_k: int = None) -> List[Dict]:
+    """Top-k chunks of a workspace for a query (see WorkspaceIndex.search)"""
+    with _indexes_lock:
+        _stats["searches"] += 1
+    return get_index(workspace_id).search(query, top_k)
+
+
+def retrieval_stats() -> Dict:
+    """Index loads, incremental updates and searches"""
+    with _indexes_lock:
+        return dict(_stats, loaded_indexes=len(_indexes), vectors=RETRIEVAL_VECTORS and np is not None)
@@ -0,0 +1,78 @@
+"""
+Single-flight coalescing of duplicate in-flight requests
+The first caller for a key runs the work; callers arriving with the same key
+while it is running wait for it and receive the same result (or exception)
+"""
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Thread-safe single-flight group"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {"executed": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Run fn once per key at a time.
+
+        Args:
+            key: Deduplication key
+            fn: Work to run if no call with this key is in flight
+
+        Returns:
+            (result, shared) - shared is True when the result came from another caller's run
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+def request_key(command: str, form: Dict) -> str:
+    """Key for (command, session, normalized form params) - whitespace and field order do not matter"""
+    params = {k: v.strip() if isinstance(v, str) else v for k, v in form.items() if k not in ("command", "stream")}
+    canonical = json.dumps({"command": command, "params": params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -12,6 +12,14 @@ def update_memory(messages, resp):
     messages.append({"role": "assistant", "content": last_output})
     return messages
 
+def stream_to_memory(messages, deltas):
+    """Forward streamed model deltas and append the assembled response to messages once done"""
+    parts = []
+    for delta in deltas:
+        parts.append(delta)
+        yield delta
+    messages.append({"role": "assistant", "content": "".join(parts)})
+
 def extract_text_pdf(path):
     """Extract text from a PDF"""
     doc = fitz.open(path)
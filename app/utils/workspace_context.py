@@ -2,12 +2,26 @@
 Workspace Context Utility
 Fetches workspace data (FileAssets, Flashcards, etc.) and formats for LLM input
 Uses direct SQL queries to Supabase
+Rendered contexts are cached per worker and revalidated with a cheap
+fingerprint query (row counts and latest updatedAt per table)
 """
 import os
 import json
-from typing import Dict, List, Optional
+import threading
+import time
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from supabase import create_client
+from app.utils.metrics import stage, current_command
+from app.utils.context_window import CHARS_PER_TOKEN
+from app.utils.context_packer import (
+    FLASHCARD_BUDGET_SHARE, allocate, context_budget, file_sections, pack_sections, record_packing,
+    truncate_sentences
+)
+from app.utils import retrieval_index
 
 load_dotenv()
 
@@ -15,11 +29,38 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+# Sub-queries of one context build (files, flashcards, fingerprints) run side
+# by side on this pool through the one shared client. WORKSPACE_QUERY_TIMEOUT
+# (seconds, opt-in) lets optional queries be skipped when slow; the file
+# content a generation depends on is always waited for
+WORKSPACE_QUERY_WORKERS = int(os.getenv("WORKSPACE_QUERY_WORKERS", 16))
+WORKSPACE_QUERY_TIMEOUT = float(os.getenv("WORKSPACE_QUERY_TIMEOUT")) if os.getenv("WORKSPACE_QUERY_TIMEOUT") else None
+
+if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY and WORKSPACE_QUERY_TIMEOUT is not None:
+    try:
+        from supabase import ClientOptions
+        # HTTP-level timeout as a backstop so a stuck request does not hold a pool thread forever
+        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY,
+                                 options=ClientOptions(postgrest_client_timeout=2 * WORKSPACE_QUERY_TIMEOUT))
+    except ImportError:  # older supabase-py without ClientOptions
+        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+elif SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
     supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 else:
     supabase = None
 
+_query_pool = ThreadPoolExecutor(max_workers=WORKSPACE_QUERY_WORKERS, thread_name_prefix="workspace-query")
+_query_stats = {"batches": 0, "queries": 0, "timeouts": 0, "errors": 0}
+_query_stats_lock = threading.Lock()
+
+# Rendered workspace contexts kept per worker, in characters (0 disables the cache)
+WORKSPACE_CONTEXT_CACHE_MAX_BYTES = int(os.getenv("WORKSPACE_CONTEXT_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+_context_cache: "OrderedDict[Tuple, Tuple[Tuple, str]]" = OrderedDict()  # key -> (fingerprint, context)
+_context_cache_bytes = 0
+_context_cache_lock = threading.Lock()
+_context_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "uncacheable": 0}
+
 
 def fetch_file_assets_by_ids(file_asset_ids: List[str]) -> List[Dict]:
     """
@@ -143,12 +184,118 @@ def fetch_flashcards(workspace_id: str) -> List[Dict]:
         return []
 
 
-def format_file_assets_context(file_assets: List[Dict]) -> str:
+def fetch_file_asset_versions(workspace_id: str) -> Optional[List[Dict]]:
+    """
+    id, fileName and updatedAt of every FileAsset in a workspace (no content).
+    
+    Returns:
+        List of dictionaries, or None if the query failed
+    """
+    if not supabase:
+        return None
+    
+    try:
+        response = supabase.table("FileAsset")\
+            .select("id, fileName, updatedAt")\
+            .eq("workspaceId", workspace_id)\
+            .execute()
+        return response.data or []
+    except Exception as e:
+        print(f"Warning: Failed to list FileAssets from Supabase: {e}")
+        return None
+
+
+def _load_transcriptions(file_asset_ids: List[str]) -> Dict[str, Dict]:
+    """Parsed transcriptions of the given FileAssets (files without one are left out)"""
+    transcriptions = {}
+    for asset in fetch_file_assets_by_ids(file_asset_ids):
+        transcription = _parse_transcription(asset)
+        if transcription:
+            transcriptions[asset["id"]] = transcription
+    return transcriptions
+
+
+def retrieve_workspace_chunks(workspace_id: str, query: str, top_k: int = None) -> List[Dict]:
+    """
+    Most relevant file chunks of a workspace for a query.
+    
+    The workspace's retrieval index is synced first: only FileAssets that are
+    new or whose updatedAt moved are fetched and re-chunked, deleted files
+    are dropped. If the file list cannot be read, the index is searched as is.
+    """
+    with stage("db.retrieval_sync"):
+        versions = fetch_file_asset_versions(workspace_id)
+        if versions is not None:
+            retrieval_index.sync_index(workspace_id, versions, _load_transcriptions)
+    with stage("retrieval.search"):
+        return retrieval_index.search(workspace_id, query, top_k)
+
+
+def format_retrieved_context(chunks: List[Dict], max_chars: int = None) -> str:
+    """
+    Format retrieved chunks (best first) into LLM context string.
+    
+    Args:
+        chunks: Results of retrieve_workspace_chunks
+        max_chars: Character budget; chunks are added until it is used up
+    
+    Returns:
+        Formatted context string
+    """
+    if not chunks:
+        return ""
+    
+    context_parts = ["## RELEVANT EXCERPTS FROM UPLOADED FILES"]
+    context_parts.append("=" * 60)
+    used = sum(len(part) + 1 for part in context_parts)
+    
+    for chunk in chunks:
+        page = f", page {chunk['page']}" if chunk.get("page") else ""
+        label = "visual content" if chunk.get("kind") == "visual" else "text"
+        heading = f"\n### {chunk.get('file_name', 'Unknown')} ({label}{page})"
+        text = chunk.get("text", "")
+        if max_chars is not None:
+            room = max_chars - used - len(heading) - 2
+            if room < 200:
+                break
+            text = truncate_sentences(text, room)
+        context_parts.append(heading)
+        context_parts.append(text)
+        used += len(heading) + len(text) + 2
+    
+    return "\n".join(context_parts)
+
+
+def _parse_transcription(asset: Dict) -> Optional[Dict]:
+    """aiTranscription (or processedContent as fallback) of a FileAsset as a dict"""
+    transcription_raw = asset.get("aiTranscription") or asset.get("processedContent")
+    if not transcription_raw:
+        return None
+    # Parse JSON if it's a string
+    if isinstance(transcription_raw, str):
+        try:
+            transcription = json.loads(transcription_raw)
+        except json.JSONDecodeError:
+            transcription = {"comprehensiveDescription": transcription_raw}
+    else:
+        transcription = transcription_raw
+    return transcription if isinstance(transcription, dict) else {"comprehensiveDescription": str(transcription)}
+
+
+def format_file_assets_context(file_assets: List[Dict], max_chars: int = None,
+                               max_file_content_length: int = None) -> str:
     """
     Format FileAsset data into LLM context string.
     
+    textContent that repeats the comprehensiveDescription is dropped. With
+    max_chars the file contents share that many characters in proportion to
+    their size, and max_file_content_length caps any single file; long
+    content is cut on a sentence boundary (see app/utils/context_packer.py).
+    
     Args:
         file_assets: List of FileAsset dictionaries
+        max_chars: Character budget for the whole section (None = unlimited)
+        max_file_content_length: Max characters per file content (None = unlimited)
     
     Returns:
         Formatted context string
@@ -156,61 +303,56 @@ def format_file_assets_context(file_assets: List[Dict]) -> str:
     if not file_assets:
         return ""
     
+    files, chars_before, chars_deduplicated = [], 0, 0
+    for asset in file_assets:
+        transcription = _parse_transcription(asset)
+        sections = file_sections(transcription) if transcription else []
+        if transcription:
+            raw = sum(len(transcription.get(k) or "") for k in ("comprehensiveDescription", "textContent")) + \
+                sum(len(d.get("description") or "") for d in transcription.get("imageDescriptions") or [])
+            chars_before += raw
+            chars_deduplicated += raw - sum(len(text) for _, text in sections)
+        files.append((asset.get("fileName", "Unknown"), asset.get("fileType", "unknown"), sections))
+    
     context_parts = ["## UPLOADED FILES AND THEIR CONTENT"]
     context_parts.append("=" * 60)
     
-    for asset in file_assets:
-        file_name = asset.get("fileName", "Unknown")
-        file_type = asset.get("fileType", "unknown")
-        
+    # Per-file headers and separators come out of the budget before content is shared
+    sizes = [sum(len(label) + 3 + len(text) for label, text in sections) for _, _, sections in files]
+    overhead = 140 + sum(len(name) + len(file_type) + 100 for name, file_type, _ in files)
+    if max_chars is None and max_file_content_length is None:
+        shares = sizes
+    else:
+        total = max(0, max_chars - overhead) if max_chars is not None else sum(sizes)
+        shares = allocate(sizes, total, max_file_content_length)
+    
+    truncated = 0
+    for (file_name, file_type, sections), size, share in zip(files, sizes, shares):
         context_parts.append(f"\n### File: {file_name}")
         context_parts.append(f"Type: {file_type}")
         
-        # Get aiTranscription (or processedContent as fallback)
-        transcription_raw = asset.get("aiTranscription") or asset.get("processedContent")
-        
-        if transcription_raw:
-            # Parse JSON if it's a string
-            if isinstance(transcription_raw, str):
-                try:
-                    transcription = json.loads(transcription_raw)
-                except json.JSONDecodeError:
-                    transcription = {"comprehensiveDescription": transcription_raw}
-            else:
-                transcription = transcription_raw
-            
-            # Extract all parts
-            text_content = transcription.get("textContent")
-            comprehensive_description = transcription.get("comprehensiveDescription")
-            image_descriptions = transcription.get("imageDescriptions", [])
-            
-            # Add comprehensive description (main content)
-            if comprehensive_description:
-                context_parts.append(f"\nContent:\n{comprehensive_description}")
-            
-            # Add text content if available
-            if text_content:
-                context_parts.append(f"\nText Content:\n{text_content}")
-            
-            # Add image descriptions if available
-            if image_descriptions:
-                context_parts.append("\nVisual Content:")
-                for img_desc in image_descriptions:
-                    page_num = img_desc.get("page", "?")
-                    description = img_desc.get("description", "")
-                    context_parts.append(f"\nPage {page_num}: {description}")
+        if share < size:
+            sections = pack_sections(sections, share)
+            truncated += 1
+        for label, text in sections:
+            context_parts.append(f"\n{label}:\n{text}")
         
         context_parts.append("\n" + "-" * 60)
     
-    return "\n".join(context_parts)
+    context = "\n".join(context_parts)
+    if max_chars is not None or max_file_content_length is not None:
+        record_packing(current_command.get(), chars_before, sum(min(a, b) for a, b in zip(sizes, shares)),
+                       chars_deduplicated, truncated)
+    return context
 
 
-def format_flashcards_context(flashcards: List[Dict]) -> str:
+def format_flashcards_context(flashcards: List[Dict], max_chars: int = None) -> str:
     """
     Format Flashcard data into LLM context string.
     
     Args:
         flashcards: List of Flashcard dictionaries with 'term' and 'definition'
+        max_chars: Character budget; whole cards are listed until it is used up
     
     Returns:
         Formatted context string
@@ -223,24 +365,165 @@ def format_flashcards_context(flashcards: List[Dict]) -> str:
     context_parts.append("These flashcards have already been created for this workspace:")
     context_parts.append("")
     
+    used = sum(len(part) + 1 for part in context_parts)
     for i, card in enumerate(flashcards, 1):
         term = card.get("term", "")
         definition = card.get("definition", "")
-        context_parts.append(f"{i}. **{term}**")
-        context_parts.append(f"   → {definition}")
-        context_parts.append("")
+        entry = [f"{i}. **{term}**", f"   → {definition}", ""]
+        used += sum(len(part) + 1 for part in entry)
+        if max_chars is not None and used > max_chars:
+            context_parts.append(f"... and {len(flashcards) - i + 1} more flashcards")
+            break
+        context_parts.extend(entry)
     
     return "\n".join(context_parts)
 
 
+def run_concurrently(queries: Dict[str, Callable], timeout: float = None,
+                     required: Tuple[str, ...] = ()) -> Dict[str, object]:
+    """
+    Run independent sub-queries at the same time and collect their results.
+    
+    The batch costs about one round trip. Each query is timed as stage
+    "db.<name>". With a timeout (default WORKSPACE_QUERY_TIMEOUT, None waits
+    for everything) all queries share one deadline; an optional query that
+    raises or misses it yields None and the others are unaffected. Required
+    queries are waited for past the deadline and their errors are raised.
+    
+    Args:
+        queries: name -> zero-argument callable
+        timeout: Seconds to wait for the optional queries of the batch
+        required: Names of queries the caller cannot do without
+    
+    Returns:
+        name -> result (None for a failed / timed out optional query)
+    """
+    timeout = WORKSPACE_QUERY_TIMEOUT if timeout is None else timeout
+    # Pool threads do not inherit contextvars (metrics labels) on their own
+    def timed(name, fn):
+        with stage(f"db.{name}"):
+            return fn()
+
+    futures = {name: _query_pool.submit(contextvars.copy_context().run, timed, name, fn)
+               for name, fn in queries.items()}
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    results, timeouts, errors = {}, 0, 0
+    try:
+        for name, future in futures.items():
+            try:
+                if deadline is None:
+                    results[name] = future.result()
+                    continue
+                try:
+                    results[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except FutureTimeout:
+                    timeouts += 1
+                    if name not in required:
+                        raise
+                    print(f"Warning: Workspace query '{name}' is taking longer than {timeout:g}s, still waiting")
+                    results[name] = future.result()
+            except FutureTimeout:
+                print(f"Warning: Workspace query '{name}' timed out after {timeout:g}s")
+                results[name] = None
+            except Exception as e:
+                errors += 1
+                if name in required:
+                    raise
+                print(f"Warning: Workspace query '{name}' failed: {e}")
+                results[name] = None
+    finally:
+        with _query_stats_lock:
+            _query_stats["batches"] += 1
+            _query_stats["queries"] += len(queries)
+            _query_stats["timeouts"] += timeouts
+            _query_stats["errors"] += errors
+    return results
+
+
+def _table_fingerprint(table: str, workspace_id: str) -> Tuple[int, Optional[str]]:
+    """(row count, latest updatedAt) of a workspace's rows in one indexed query"""
+    response = supabase.table(table)\
+        .select("updatedAt", count="exact")\
+        .eq("workspaceId", workspace_id)\
+        .order("updatedAt", desc=True)\
+        .limit(1)\
+        .execute()
+    return response.count or 0, response.data[0]["updatedAt"] if response.data else None
+
+
+def workspace_fingerprint(workspace_id: str, include_file_assets: bool = True,
+                          include_flashcards: bool = True) -> Optional[Tuple]:
+    """
+    Version stamp of the workspace rows a context is rendered from.
+
+    Any insert or edit moves the latest updatedAt and any delete changes the
+    count, so an unchanged fingerprint means the rendered context is current.
+    Returns None when it cannot be determined (no Supabase, query failed).
+    """
+    if not supabase or not workspace_id:
+        return None
+    queries = {}
+    if include_file_assets:
+        queries["file_assets_fingerprint"] = lambda: _table_fingerprint("FileAsset", workspace_id)
+    if include_flashcards:
+        queries["flashcards_fingerprint"] = lambda: _table_fingerprint("Flashcard", workspace_id)
+    with stage("db.workspace_fingerprint"):
+        results = run_concurrently(queries)
+    if any(result is None for result in results.values()):
+        return None
+    return results.get("file_assets_fingerprint"), results.get("flashcards_fingerprint")
+
+
+def _cache_context(key: Tuple, fingerprint: Tuple, context: str):
+    global _context_cache_bytes
+    if len(context) > WORKSPACE_CONTEXT_CACHE_MAX_BYTES:
+        return
+    with _context_cache_lock:
+        previous = _context_cache.pop(key, None)
+        if previous is not None:
+            _context_cache_bytes -= len(previous[1])
+        _context_cache[key] = (fingerprint, context)
+        _context_cache_bytes += len(context)
+        while _context_cache_bytes > WORKSPACE_CONTEXT_CACHE_MAX_BYTES:
+            _, (_, evicted) = _context_cache.popitem(last=False)
+            _context_cache_bytes -= len(evicted)
+            _context_cache_stats["evictions"] += 1
+
+
+def invalidate_workspace_context(workspace_id: str):
+    """Drop every cached rendering of a workspace (e.g. right after changing its files)"""
+    global _context_cache_bytes
+    with _context_cache_lock:
+        for key in [k for k in _context_cache if k[0] == workspace_id]:
+            _context_cache_bytes -= len(_context_cache.pop(key)[1])
+
+
+def workspace_context_cache_stats() -> Dict:
+    """Workspace context cache hit rate and memory use, and concurrent sub-query counters"""
+    with _query_stats_lock:
+        queries = dict(_query_stats)
+    with _context_cache_lock:
+        lookups = _context_cache_stats["hits"] + _context_cache_stats["misses"] + _context_cache_stats["stale"]
+        return dict(
+            _context_cache_stats,
+            entries=len(_context_cache),
+            bytes=_context_cache_bytes,
+            hit_rate=round(_context_cache_stats["hits"] / lookups, 3) if lookups else None,
+            queries=queries,
+        )
+
+
 def get_workspace_context(
     workspace_id: str = None,
     file_asset_ids: List[str] = None,
     flashcard_ids: List[str] = None,
     include_file_assets: bool = True,
     include_flashcards: bool = True,
-    max_file_content_length: int = 2000,  # Truncate long content
-    include_worksheets: bool = False
+    max_file_content_length: int = None,
+    include_worksheets: bool = False,
+    token_budget: int = None,
+    query: str = None,
+    top_k: int = None
 ) -> str:
     """
     Fetch and format workspace context for LLM input.
@@ -254,56 +537,125 @@ def get_workspace_context(
         flashcard_ids: Optional list of specific Flashcard IDs to fetch
         include_file_assets: Whether to include FileAsset content
         include_flashcards: Whether to include Flashcard data
-        max_file_content_length: Max characters per file content (truncate if longer)
+        max_file_content_length: Max characters per file content (truncate if longer;
+                                 default: only the token budget applies)
         include_worksheets: Whether to include Worksheet data (future)
+        token_budget: Tokens the whole context may use (default: the current
+                      command's budget, see WORKSPACE_CONTEXT_BUDGETS)
+        query: Top-k mode - instead of every file, include only the file
+               chunks most relevant to this text (app/utils/retrieval_index.py)
+        top_k: Number of chunks in top-k mode (default RETRIEVAL_TOP_K)
     
     Returns:
         Formatted context string ready to be prefixed to LLM messages
     """
-    context_parts = []
+    token_budget = token_budget or context_budget(current_command.get())
     
-    # Fetch and format FileAssets
-    if include_file_assets:
-        if file_asset_ids:
-            # Fetch specific files by ID (more efficient)
-            file_assets = fetch_file_assets_by_ids(file_asset_ids)
-        elif workspace_id:
-            # Fetch all files in workspace
-            file_assets = fetch_file_assets(workspace_id)
-        else:
-            file_assets = []
-        
-        if file_assets:
-            context_parts.append(format_file_assets_context(file_assets))
-    
-    # Fetch and format Flashcards
-    if include_flashcards:
-        if flashcard_ids:
-            # Fetch specific flashcards by ID
-            flashcards = fetch_flashcards_by_ids(flashcard_ids)
-        elif workspace_id:
-            # Fetch all flashcards in workspace
-            flashcards = fetch_flashcards(workspace_id)
-        else:
-            flashcards = []
-        
-        if flashcards:
-            context_parts.append(format_flashcards_context(flashcards))
-    
-    # Future: Worksheets, Study Guides, etc.
+    # Top-k contexts depend on the query, so they bypass the rendered-context cache
+    if query and workspace_id and not file_asset_ids:
+        return _render_workspace_context(workspace_id, None, flashcard_ids, include_file_assets, include_flashcards,
+                                         max_file_content_length, include_worksheets, token_budget,
+                                         query, top_k)[0]
+
+    # Only whole-workspace contexts are cached; explicit ID lists are one-off selections
+    if not workspace_id or file_asset_ids or flashcard_ids or WORKSPACE_CONTEXT_CACHE_MAX_BYTES <= 0:
+        return _render_workspace_context(workspace_id, file_asset_ids, flashcard_ids, include_file_assets,
+                                         include_flashcards, max_file_content_length, include_worksheets,
+                                         token_budget)[0]
+
+    fingerprint = workspace_fingerprint(workspace_id, include_file_assets, include_flashcards)
+    key = (workspace_id, include_file_assets, include_flashcards, max_file_content_length, include_worksheets, token_budget)
+    with _context_cache_lock:
+        cached = _context_cache.get(key)
+        if cached is not None and fingerprint is not None and cached[0] == fingerprint:
+            _context_cache.move_to_end(key)
+            _context_cache_stats["hits"] += 1
+            return cached[1]
+        _context_cache_stats["stale" if cached is not None else "misses"] += 1
+
+    context, counts = _render_workspace_context(workspace_id, None, None, include_file_assets, include_flashcards,
+                                                max_file_content_length, include_worksheets, token_budget)
+
+    # Cache only if the rows rendered are the rows fingerprinted (a failed fetch
+    # returns nothing; a concurrent edit is picked up by the next fingerprint)
+    if fingerprint is not None and all(
+        fp is None or fp[0] == count for fp, count in zip(fingerprint, counts)
+    ):
+        _cache_context(key, fingerprint, context)
+    else:
+        with _context_cache_lock:
+            _context_cache_stats["uncacheable"] += 1
+    return context
+
+
+def _render_workspace_context(
+    workspace_id: Optional[str],
+    file_asset_ids: Optional[List[str]],
+    flashcard_ids: Optional[List[str]],
+    include_file_assets: bool,
+    include_flashcards: bool,
+    max_file_content_length: Optional[int],
+    include_worksheets: bool,
+    token_budget: int,
+    query: str = None,
+    top_k: int = None
+) -> Tuple[str, Tuple[int, int]]:
+    """Fetch and pack the context; also returns how many FileAsset / Flashcard rows it was built from"""
+    header = "# WORKSPACE CONTEXT\n\nThis context contains all uploaded files, flashcards, and other workspace data.\n\n"
+    footer = "\n\n---\n\nUse the above context when generating content. Reference specific files, flashcards, or concepts as needed.\n"
+    max_chars = token_budget * CHARS_PER_TOKEN - len(header) - len(footer)
+    files_context, flashcards_context = "", ""
+    
+    # Every sub-query is independent; they are issued together
+    queries = {}
+    if include_file_assets and query:
+        queries["retrieval"] = lambda: retrieve_workspace_chunks(workspace_id, query, top_k)
+    elif include_file_assets and file_asset_ids:
+        # Fetch specific files by ID (more efficient)
+        queries["file_assets"] = lambda: fetch_file_assets_by_ids(file_asset_ids)
+    elif include_file_assets and workspace_id:
+        # Fetch all files in workspace
+        queries["file_assets"] = lambda: fetch_file_assets(workspace_id)
+    
+    if include_flashcards and flashcard_ids:
+        # Fetch specific flashcards by ID
+        queries["flashcards"] = lambda: fetch_flashcards_by_ids(flashcard_ids)
+    elif include_flashcards and workspace_id:
+        # Fetch all flashcards in workspace
+        queries["flashcards"] = lambda: fetch_flashcards(workspace_id)
+    
+    # Future: Worksheets, Study Guides, etc. (add their fetch to `queries`)
     if include_worksheets:
         # TODO: Implement worksheet fetching
         pass
     
+    with stage("db.workspace_context"):
+        results = run_concurrently(queries, required=("file_assets",)) if queries else {}
+    retrieved = results.get("retrieval") or []
+    file_assets = results.get("file_assets") or []
+    if "retrieval" in queries and results["retrieval"] is None and workspace_id:
+        # Top-k search failed: fall back to the whole workspace rather than no files at all
+        with stage("db.file_assets"):
+            file_assets = fetch_file_assets(workspace_id)
+    flashcards = results.get("flashcards") or []
+    
+    # Existing cards are short; they get their share first and the files the rest
+    if flashcards:
+        flashcards_context = format_flashcards_context(flashcards, int(max_chars * FLASHCARD_BUDGET_SHARE))
+    
+    if retrieved:
+        files_context = format_retrieved_context(retrieved, max_chars - len(flashcards_context))
+    elif file_assets:
+        files_context = format_file_assets_context(file_assets, max_chars - len(flashcards_context),
+                                                   max_file_content_length)
+    
     # Combine all context parts
+    context_parts = [part for part in (files_context, flashcards_context) if part]
     if context_parts:
         full_context = "\n\n".join(context_parts)
-        # Add header and footer
-        header = "# WORKSPACE CONTEXT\n\nThis context contains all uploaded files, flashcards, and other workspace data.\n\n"
-        footer = "\n\n---\n\nUse the above context when generating content. Reference specific files, flashcards, or concepts as needed.\n"
-        return header + full_context + footer
+        return header + full_context + footer, (len(file_assets), len(flashcards))
     
-    return ""
+    return "", (len(file_assets), len(flashcards))
 
 
 def get_workspace_context_as_message(
@@ -313,7 +665,10 @@ def get_workspace_context_as_message(
     flashcard_ids: List[str] = None,
     include_file_assets: bool = True,
     include_flashcards: bool = True,
-    max_file_content_length: int = 2000
+    max_file_content_length: int = None,
+    token_budget: int = None,
+    query: str = None,
+    top_k: int = None
 ) -> Dict:
     """
     Get workspace context formatted as an LLM message object.
@@ -323,6 +678,10 @@ def get_workspace_context_as_message(
         user_id: User ID
         include_file_assets: Whether to include FileAsset content
         include_flashcards: Whether to include Flashcard data
+        max_file_content_length: Max characters per file content
+        token_budget: Token budget of the context (default: per command)
+        query: Top-k mode, see get_workspace_context
+        top_k: Number of chunks in top-k mode
     
     Returns:
         Dictionary with 'role' and 'content' keys, ready to append to messages array
@@ -333,7 +692,10 @@ def get_workspace_context_as_message(
         flashcard_ids=flashcard_ids,
         include_file_assets=include_file_assets,
         include_flashcards=include_flashcards,
-        max_file_content_length=max_file_content_length
+        max_file_content_length=max_file_content_length,
+        token_budget=token_budget,
+        query=query,
+        top_k=top_k
     )
     
 
@@ -347,3 +709,20 @@ def get_workspace_context_as_message(
         "content": context
     }
 
+
+
+def get_workspace_context_overlay(workspace_id: str = None, user_id: str = None, **kwargs) -> List[Dict]:
+    """
+    Workspace context as an inference-time overlay for LLM_inference(context=...).
+    
+    The context is sent with the model request only and is never added to the
+    session history, so it is not persisted with save_messages. Takes the same
+    keyword arguments as get_workspace_context_as_message.
+    
+    Returns:
+        [context message], or [] without a workspace / context
+    """
+    if not workspace_id or not user_id:
+        return []
+    context_message = get_workspace_context_as_message(workspace_id=workspace_id, user_id=user_id, **kwargs)
+    return [context_message] if context_message else []
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark: concurrent LLM requests on the thread model vs the shared async loop
+
+Runs N requests against a local fake OpenAI server (fixed latency) through
+LLM_inference on a thread pool (one OS thread per in-flight call, as gunicorn
+threads do today) and through async_LLM_inference on the shared event loop.
+
+Usage:
+    python benchmarks/async_vs_threads.py --requests 400 --concurrency 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import start_fake_server
+
+MESSAGES = [{"role": "user", "content": "Summarise the uploaded lecture notes."}]
+
+
+def client_threads():
+    """Threads on the client side (the fake server spawns one per connection)"""
+    return sum(1 for t in threading.enumerate() if "process_request_thread" not in t.name)
+
+
+def run_threads(n_requests, concurrency):
+    from app.models.LLM_inference import LLM_inference
+
+    peak_threads = 0
+
+    def call(_):
+        nonlocal peak_threads
+        peak_threads = max(peak_threads, client_threads())
+        return LLM_inference(messages=MESSAGES)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(n_requests)))
+    return time.perf_counter() - start, peak_threads
+
+
+def run_async(n_requests, concurrency):
+    from app.models.LLM_inference import async_LLM_inference
+    from app.utils.async_runtime import run_coroutine
+
+    peak_threads = 0
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            nonlocal peak_threads
+            async with semaphore:
+                peak_threads = max(peak_threads, client_threads())
+                return await async_LLM_inference(messages=MESSAGES)
+
+        await asyncio.gather(*(call() for _ in range(n_requests)))
+
+    start = time.perf_counter()
+    run_coroutine(main())
+    return time.perf_counter() - start, peak_threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake provider latency in seconds")
+    args = parser.parse_args()
+
+    server = start_fake_server(latency=args.latency)
+    # Must be set before app.models.client_registry is imported
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    os.environ["LLM_POOL_MAX_CONNECTIONS"] = str(args.concurrency)
+    os.environ["LLM_POOL_MAX_KEEPALIVE"] = str(args.concurrency)
+
+    print(f"{args.requests} requests, {args.concurrency} in flight, {args.latency}s provider latency\n")
+    ideal = args.requests / args.concurrency * args.latency
+    print(f"{'mode':<10}{'wall (s)':>10}{'req/s':>10}{'threads':>10}")
+    for name, runner in (("threads", run_threads), ("async", run_async)):
+        elapsed, threads = runner(args.requests, args.concurrency)
+        print(f"{name:<10}{elapsed:>10.2f}{args.requests / elapsed:>10.1f}{threads:>10}")
+    print(f"\nideal wall time: {ideal:.2f}s")
+
+    from app.models.client_registry import pool_stats
+    for profile, stats in pool_stats().items():
+        print(f"{profile}: {stats['requests']} requests, {stats['connections_opened']} connections opened")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
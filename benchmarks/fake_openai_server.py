@@ -0,0 +1,89 @@
+"""
+Minimal OpenAI-compatible chat completions server for local benchmarks
+Answers POST /v1/chat/completions after a fixed latency with a canned reply.
+Scripted faults (status codes, Retry-After, per-request latency) can be queued
+to exercise the retry / hedging / circuit breaker transport
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client pools can reuse connections
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.server.lock:
+            self.server.request_count += 1
+            fault = self.server.faults.pop(0) if self.server.faults else {}
+        time.sleep(fault.get("latency", self.server.latency))
+
+        status = fault.get("status", 200)
+        if status != 200:
+            error = json.dumps({"error": {"message": f"injected {status}", "type": "fake_error", "code": None}}).encode("utf-8")
+            self.send_response(status)
+            for name, value in fault.get("headers", {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(error)))
+            self.end_headers()
+            self.wfile.write(error)
+            return
+
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        reply = self.server.reply
+        payload = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(reply.split()),
+                "total_tokens": prompt_tokens + len(reply.split())
+            }
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_fake_server(latency: float = 0.5, reply: str = "ok", port: int = 0, faults=None) -> ThreadingHTTPServer:
+    """
+    Start the fake server in a daemon thread.
+
+    Args:
+        latency: Seconds to wait before answering each request
+        reply: Assistant message content to return
+        port: Port to bind (0 picks a free one)
+        faults: Optional list of per-request overrides consumed in order, e.g.
+                [{"status": 429, "headers": {"Retry-After": "1"}}, {"latency": 5}]
+                (server.faults can be refilled between scenarios)
+
+    Returns:
+        The running server; its base URL is http://127.0.0.1:<server.server_port>/v1
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.reply = reply
+    server.faults = list(faults or [])
+    server.request_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
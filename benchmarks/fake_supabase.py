@@ -0,0 +1,132 @@
+"""
+In-memory stand-in for the Supabase/PostgREST table API used by MessageStore
+Supports the query-builder calls the store makes (select/insert/delete,
+eq/gte/order/limit, execute) and the append_llm_messages RPC from
+create_messages_table.sql with a fixed latency per request, and counts
+round trips and rows written so store strategies can be compared offline
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table_name = table
+        self.action = None
+        self.payload = None
+        self.filters = []
+        self.order_by = None
+        self.descending = False
+        self.row_limit = None
+        self.columns = None
+        self.count = None
+
+    def select(self, columns="*", count=None):
+        self.action, self.count = "select", count
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] >= value)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by, self.descending = column, desc
+        return self
+
+    def limit(self, n):
+        self.row_limit = n
+        return self
+
+    def _matches(self, row):
+        return all(f(row) for f in self.filters)
+
+    def execute(self):
+        db = self.db
+        time.sleep(db.latency)
+        with db.lock:
+            db.requests += 1
+            rows = db.tables.setdefault(self.table_name, [])
+            if self.action == "insert":
+                inserted = []
+                for row in self.payload:
+                    db.next_id += 1
+                    inserted.append(dict(row, id=db.next_id))
+                rows.extend(inserted)
+                db.rows_inserted += len(self.payload)
+                return SimpleNamespace(data=[dict(r) for r in inserted], count=None)
+            if self.action == "delete":
+                deleted = [r for r in rows if self._matches(r)]
+                db.tables[self.table_name] = [r for r in rows if not self._matches(r)]
+                db.rows_deleted += len(deleted)
+                return SimpleNamespace(data=deleted, count=None)
+
+            selected = [r for r in rows if self._matches(r)]
+            if self.order_by:
+                selected.sort(key=lambda r: r.get(self.order_by), reverse=self.descending)
+            total = len(selected)
+            if self.row_limit is not None:
+                selected = selected[:self.row_limit]
+            if self.columns:
+                selected = [{c: r.get(c) for c in self.columns} for r in selected]
+            return SimpleNamespace(data=[dict(r) for r in selected], count=total if self.count else None)
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        if name != "append_llm_messages":
+            raise NotImplementedError(f"FakeSupabase has no RPC '{name}'")
+        self.db = db
+        self.params = params
+
+    def execute(self):
+        db = self.db
+        time.sleep(db.latency)
+        with db.lock:
+            db.requests += 1
+            rows = db.tables.setdefault("llm_messages", [])
+            session_id = self.params["p_session_id"]
+            next_sequence = max((r["sequence"] for r in rows if r["session_id"] == session_id), default=-1) + 1
+            for i, msg in enumerate(self.params["p_messages"]):
+                db.next_id += 1
+                rows.append(dict(msg, id=db.next_id, user_id=self.params["p_user_id"], session_id=session_id,
+                                 sequence=next_sequence + i))
+            db.rows_inserted += len(self.params["p_messages"])
+            return SimpleNamespace(data=[{"first_sequence": next_sequence, "last_id": db.next_id}], count=None)
+
+
+class FakeSupabase:
+    """Drop-in for the module-level `supabase` client in app/db/message_store.py"""
+
+    def __init__(self, latency: float = 0.03):
+        self.latency = latency
+        self.tables = {}
+        self.next_id = 0
+        self.requests = 0
+        self.rows_inserted = 0
+        self.rows_deleted = 0
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.rows_inserted = self.rows_deleted = 0
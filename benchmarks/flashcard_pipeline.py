@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: legacy three-call flashcard chain vs the single structured-output call
+
+Replays a recorded session history through generate_flashcards_q ->
+generate_flashcards_a -> generate_flashcards_json (legacy) and through
+generate_flashcards (fast), reporting provider round trips, prompt tokens and
+wall time per mode. Runs against the local fake server by default; pass --live
+to hit the configured OpenAI endpoint (real token counts and latency).
+
+Usage:
+    python benchmarks/flashcard_pipeline.py --runs 5 --latency 1.0
+    python benchmarks/flashcard_pipeline.py --live --runs 1
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import start_fake_server
+
+DEFAULT_SESSION = "Data/cmesjxa2i0000ry9oyjmoasjk/cmesjxwhz0002ry9ozjg0gpvn/messages.json"
+
+FAKE_REPLY = json.dumps({"flashcards": [
+    {"term": f"Question {i}", "definition": f"Answer {i}"} for i in range(1, 6)
+]})
+
+
+def run_legacy(messages, num_flashcards, difficulty):
+    from app.services.StudyServices.flashcard_service import (
+        generate_flashcards_q, generate_flashcards_a, generate_flashcards_json
+    )
+    messages = generate_flashcards_q(messages, num_flashcards, difficulty)
+    messages = generate_flashcards_a(messages)
+    return generate_flashcards_json(messages)
+
+
+def run_fast(messages, num_flashcards, difficulty):
+    from app.services.StudyServices.flashcard_service import generate_flashcards
+    return generate_flashcards(messages, num_flashcards, difficulty)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--session", default=DEFAULT_SESSION, help="recorded messages.json to replay")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--num-flashcards", type=int, default=5)
+    parser.add_argument("--difficulty", default="hard")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake provider latency in seconds")
+    parser.add_argument("--live", action="store_true", help="call the configured OpenAI endpoint instead of the fake server")
+    args = parser.parse_args()
+
+    server = None
+    if not args.live:
+        server = start_fake_server(latency=args.latency, reply=FAKE_REPLY)
+        # Must be set before app.models.client_registry is imported
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+    from app.utils import metrics
+    from app.utils.context_window import estimate_tokens, window_history
+
+    with open(args.session, "r", encoding="utf-8") as f:
+        history = json.load(f)
+    # Same windowing the /upload handler applies before generating
+    history = window_history(history, "generate_flashcard_questions")
+    print(f"session: {args.session} ({len(history)} messages, ~{estimate_tokens(history)} tokens after windowing)")
+    print(f"{args.runs} runs per mode, {'live API' if args.live else f'fake server, {args.latency}s latency'}\n")
+
+    print(f"{'mode':<8}{'calls/run':>11}{'prompt tok/run':>16}{'wall/run (s)':>14}")
+    for name, runner in (("legacy", run_legacy), ("fast", run_fast)):
+        command = f"bench.flashcards.{name}"
+        tokens = metrics.begin_request(command)
+        start = time.perf_counter()
+        try:
+            for _ in range(args.runs):
+                runner(copy.deepcopy(history), args.num_flashcards, args.difficulty)
+        finally:
+            metrics.end_request(tokens)
+        elapsed = time.perf_counter() - start
+
+        models = metrics.snapshot().get(command, {}).get("models", {})
+        calls = sum(m["calls"] for m in models.values())
+        prompt_tokens = sum(m["prompt_tokens"] for m in models.values())
+        print(f"{name:<8}{calls / args.runs:>11.1f}{prompt_tokens / args.runs:>16.0f}{elapsed / args.runs:>14.2f}")
+
+    if server is not None:
+        print("\n(fake server counts prompt tokens as whitespace-separated words)")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
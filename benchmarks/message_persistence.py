@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark: full-rewrite vs incremental save_messages
+
+Replays recorded session histories (Data/<user>/<session>/messages.json) as a
+series of commands: every command appends a user/assistant turn and persists
+the whole history, as the /upload handlers do. Persists through the previous
+strategy (delete the session, insert one row per request) and through
+MessageStore.save_messages, against an in-memory PostgREST stand-in with a
+fixed per-request latency. Reports round trips, rows written and wall time
+per command. --sqlite additionally runs save_messages on the embedded SQLite
+backend (real storage engine, no network).
+
+Usage:
+    python benchmarks/message_persistence.py --commands 10 --latency 0.03
+    python benchmarks/message_persistence.py --sqlite /tmp/llm_messages.db
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_supabase import FakeSupabase
+
+
+def legacy_save(db, user_id, session_id, messages):
+    """The previous save_messages: delete everything, then one insert per message"""
+    db.table("llm_messages").delete().eq("session_id", session_id).execute()
+    for i, msg in enumerate(messages):
+        content = msg.get("content", "")
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content)
+        db.table("llm_messages").insert({
+            "user_id": user_id,
+            "session_id": session_id,
+            "role": msg.get("role", "user"),
+            "content": content,
+            "sequence": i
+        }).execute()
+    return True
+
+
+def replay(save, db, sessions, n_commands):
+    """Persist each session once, then n_commands appended turns; returns per-command averages"""
+    for user_id, session_id, history in sessions:
+        save(user_id, session_id, list(history))
+    db.reset_counters()
+
+    start = time.perf_counter()
+    for user_id, session_id, history in sessions:
+        messages = list(history)
+        for i in range(n_commands):
+            messages.append({"role": "user", "content": f"Follow-up question {i}"})
+            messages.append({"role": "assistant", "content": f"Answer {i}"})
+            save(user_id, session_id, messages)
+    elapsed = time.perf_counter() - start
+
+    n = len(sessions) * n_commands
+    return db.requests / n, (db.rows_inserted + db.rows_deleted) / n, elapsed / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="Data", help="directory with <user>/<session>/messages.json histories")
+    parser.add_argument("--commands", type=int, default=10, help="commands replayed per session")
+    parser.add_argument("--latency", type=float, default=0.03, help="simulated PostgREST round trip in seconds")
+    parser.add_argument("--sqlite", metavar="PATH", help="also benchmark the SQLite backend (database file, recreated)")
+    args = parser.parse_args()
+
+    sessions = []
+    for path in sorted(glob.glob(os.path.join(args.data, "*", "*", "messages.json"))):
+        session_dir = os.path.dirname(path)
+        with open(path, "r", encoding="utf-8") as f:
+            sessions.append((os.path.basename(os.path.dirname(session_dir)), os.path.basename(session_dir), json.load(f)))
+    if not sessions:
+        sys.exit(f"No messages.json histories found under {args.data}/")
+
+    from app.db import MessageStore, SQLiteBackend, SupabaseBackend, set_backend
+
+    avg_len = sum(len(h) for _, _, h in sessions) / len(sessions)
+    print(f"{len(sessions)} sessions (avg {avg_len:.0f} messages), {args.commands} commands each, "
+          f"{args.latency * 1000:.0f}ms per round trip\n")
+    print(f"{'strategy':<14}{'round trips':>13}{'rows written':>14}{'wall (s)':>10}   (per command)")
+
+    legacy_db = FakeSupabase(latency=args.latency)
+    row = replay(lambda *a: legacy_save(legacy_db, *a), legacy_db, sessions, args.commands)
+    print(f"{'full rewrite':<14}{row[0]:>13.1f}{row[1]:>14.1f}{row[2]:>10.3f}")
+
+    incremental_db = FakeSupabase(latency=args.latency)
+    set_backend(SupabaseBackend(client=incremental_db))
+    row = replay(MessageStore.save_messages, incremental_db, sessions, args.commands)
+    print(f"{'incremental':<14}{row[0]:>13.1f}{row[1]:>14.1f}{row[2]:>10.3f}")
+
+    if args.sqlite:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+        set_backend(SQLiteBackend(args.sqlite))
+        for user_id, session_id, history in sessions:
+            MessageStore.save_messages(user_id, session_id, list(history))
+        start = time.perf_counter()
+        for user_id, session_id, history in sessions:
+            messages = list(history)
+            for i in range(args.commands):
+                messages.append({"role": "user", "content": f"Follow-up question {i}"})
+                messages.append({"role": "assistant", "content": f"Answer {i}"})
+                MessageStore.save_messages(user_id, session_id, messages)
+        elapsed = (time.perf_counter() - start) / (len(sessions) * args.commands)
+        print(f"{'sqlite':<14}{'-':>13}{'-':>14}{elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
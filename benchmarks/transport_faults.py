@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Exercise the resilient transport (app/models/transport.py) against the local
+fake OpenAI server with scripted faults: Retry-After handling, retry
+exhaustion, circuit breaking, deadlines and hedged requests.
+
+Usage:
+    python benchmarks/transport_faults.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import start_fake_server
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+def main():
+    server = start_fake_server(latency=0.05)
+    # Must be set before the app modules read their configuration
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    os.environ["LLM_BACKOFF_BASE"] = "0.05"
+    os.environ["LLM_HEDGE_DELAY"] = "0.3"
+    os.environ["LLM_BREAKER_FAILURES"] = "3"
+    os.environ["LLM_BREAKER_RESET"] = "1"
+
+    import openai
+    from app.models import transport
+    from app.models.LLM_inference import LLM_inference
+
+    results = []
+
+    def scenario(name, faults, check):
+        transport._breakers.clear()
+        server.faults = list(faults)
+        server.request_count = 0
+        start = time.perf_counter()
+        try:
+            outcome = LLM_inference(messages=MESSAGES, **check.get("kwargs", {}))
+        except Exception as e:
+            outcome = e
+        elapsed = time.perf_counter() - start
+        ok = check["expect"](outcome, elapsed, server.request_count)
+        results.append(ok)
+        print(f"{'PASS' if ok else 'FAIL'}  {name:<45} {elapsed:6.2f}s  {server.request_count} requests  -> {type(outcome).__name__}")
+
+    scenario(
+        "429 with Retry-After then 500, then success",
+        [{"status": 429, "headers": {"Retry-After": "1"}}, {"status": 500}],
+        {"expect": lambda out, t, n: not isinstance(out, Exception) and n == 3 and t >= 1.0},
+    )
+    scenario(
+        "non-retryable 400 fails immediately",
+        [{"status": 400}],
+        {"expect": lambda out, t, n: isinstance(out, openai.BadRequestError) and n == 1},
+    )
+    scenario(
+        "persistent 503 gives up after bounded retries",
+        [{"status": 503}] * 10,
+        {"expect": lambda out, t, n: isinstance(out, (openai.InternalServerError, transport.CircuitOpenError))
+                                     and n <= transport.MAX_RETRIES + 1},
+    )
+    # Circuit breaker: trip it, then check calls are rejected locally, then recover
+    transport._breakers.clear()
+    server.faults = [{"status": 503}] * 10
+    for _ in range(2):
+        try:
+            LLM_inference(messages=MESSAGES)
+        except Exception:
+            pass
+    server.request_count = 0
+    start = time.perf_counter()
+    try:
+        LLM_inference(messages=MESSAGES)
+        outcome = None
+    except Exception as e:
+        outcome = e
+    ok = isinstance(outcome, transport.CircuitOpenError) and server.request_count == 0
+    results.append(ok)
+    print(f"{'PASS' if ok else 'FAIL'}  {'open circuit rejects without calling':<45} {time.perf_counter() - start:6.2f}s")
+
+    server.faults = []
+    time.sleep(1.1)
+    try:
+        LLM_inference(messages=MESSAGES)
+        ok = transport.get_breaker("gpt-5-nano").state == "closed"
+    except Exception:
+        ok = False
+    results.append(ok)
+    print(f"{'PASS' if ok else 'FAIL'}  {'half-open probe closes the circuit':<45}")
+
+    scenario(
+        "deadline bounds a hanging provider",
+        [{"latency": 3}, {"latency": 3}],
+        {"kwargs": {"deadline": 1}, "expect": lambda out, t, n: isinstance(out, Exception) and t < 2},
+    )
+    scenario(
+        "hedged duplicate beats a slow first request",
+        [{"latency": 2}],
+        {"kwargs": {"hedge": True}, "expect": lambda out, t, n: not isinstance(out, Exception) and n == 2 and t < 1},
+    )
+
+    server.shutdown()
+    print(f"\n{sum(results)}/{len(results)} scenarios passed")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
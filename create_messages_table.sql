@@ -8,10 +8,17 @@ CREATE TABLE IF NOT EXISTS llm_messages (
     role TEXT NOT NULL,              -- 'system', 'user', 'assistant'
     content TEXT NOT NULL,           -- Message content (can be JSON string for complex content)
     sequence INTEGER NOT NULL,       -- Order of messages (0, 1, 2, ...)
+    content_hash TEXT,               -- sha256 of role + content, lets save_messages write only changed rows
+    content_encoding TEXT,           -- NULL = plain text, 'zlib+b64' / 'zstd+b64' = compressed content
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Existing deployments: add the hash column (rows without a hash are rewritten on their next save)
+ALTER TABLE llm_messages ADD COLUMN IF NOT EXISTS content_hash TEXT;
+-- Existing deployments: add the encoding column (existing rows stay plain text)
+ALTER TABLE llm_messages ADD COLUMN IF NOT EXISTS content_encoding TEXT;
+
 -- Create indexes for faster queries
 CREATE INDEX IF NOT EXISTS idx_llm_messages_session ON llm_messages(session_id);
 CREATE INDEX IF NOT EXISTS idx_llm_messages_user ON llm_messages(user_id);
@@ -36,7 +43,88 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
--- Create trigger to auto-update updated_at
+-- Create trigger to auto-update updated_at (dropped first so the script can be re-run)
+DROP TRIGGER IF EXISTS update_llm_messages_updated_at ON llm_messages;
 CREATE TRIGGER update_llm_messages_updated_at BEFORE UPDATE ON llm_messages
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Existing deployments: racing appends from before append_llm_messages could
+-- give two rows the same (session, sequence). Renumber the affected sessions
+-- 0, 1, 2, ... in (sequence, id) order so no message is lost and the unique
+-- index below can be built. A no-op once the index exists.
+UPDATE llm_messages m
+SET sequence = renumbered.new_sequence
+FROM (
+    SELECT id, (ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY sequence, id) - 1)::INTEGER AS new_sequence
+    FROM llm_messages
+    WHERE session_id IN (
+        SELECT session_id FROM llm_messages GROUP BY session_id, sequence HAVING COUNT(*) > 1
+    )
+) renumbered
+WHERE m.id = renumbered.id AND m.sequence <> renumbered.new_sequence;
+
+-- One row per (session, sequence); append_llm_messages relies on it as a backstop.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_llm_messages_session_sequence_unique ON llm_messages(session_id, sequence);
+
+-- Append messages to a session atomically (called via supabase.rpc).
+-- Allocates the next sequence numbers and inserts every row in one round trip;
+-- the transaction-scoped advisory lock serialises concurrent appends per session.
+-- p_messages: [{"role": "...", "content": "...", "content_encoding": null, "content_hash": "..."}, ...]
+-- Returns the first allocated sequence number and the id of the last inserted
+-- row (the API keeps its per-worker history cache current with them).
+DROP FUNCTION IF EXISTS append_llm_messages(TEXT, TEXT, JSONB);
+CREATE OR REPLACE FUNCTION append_llm_messages(p_user_id TEXT, p_session_id TEXT, p_messages JSONB)
+RETURNS TABLE (first_sequence INTEGER, last_id BIGINT) AS $$
+DECLARE
+    next_sequence INTEGER;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('llm_messages:' || p_session_id));
+
+    SELECT COALESCE(MAX(m.sequence) + 1, 0) INTO next_sequence
+    FROM llm_messages m
+    WHERE m.session_id = p_session_id;
+
+    RETURN QUERY
+    WITH inserted AS (
+        INSERT INTO llm_messages (user_id, session_id, role, content, content_encoding, content_hash, sequence)
+        SELECT p_user_id, p_session_id, m.msg->>'role', m.msg->>'content', m.msg->>'content_encoding',
+               m.msg->>'content_hash', next_sequence + (m.ord - 1)::INTEGER
+        FROM jsonb_array_elements(p_messages) WITH ORDINALITY AS m(msg, ord)
+        RETURNING id
+    )
+    SELECT next_sequence, MAX(inserted.id) FROM inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cross-worker write leases (used when the API runs with MESSAGE_STORE_DB_LOCK=on).
+-- A lease row marks a session as being written by one worker; it expires by
+-- itself if that worker dies. Advisory locks cannot be used here because every
+-- PostgREST call is its own transaction.
+CREATE TABLE IF NOT EXISTS llm_session_locks (
+    session_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Take the lease if it is free, expired or already held by p_owner; returns whether it was taken
+CREATE OR REPLACE FUNCTION acquire_llm_session_lock(p_session_id TEXT, p_owner TEXT, p_ttl_seconds INTEGER)
+RETURNS BOOLEAN AS $$
+BEGIN
+    INSERT INTO llm_session_locks (session_id, owner, expires_at)
+    VALUES (p_session_id, p_owner, NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (session_id) DO UPDATE
+        SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+        WHERE llm_session_locks.expires_at < NOW() OR llm_session_locks.owner = EXCLUDED.owner;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION release_llm_session_lock(p_session_id TEXT, p_owner TEXT)
+RETURNS VOID AS $$
+    DELETE FROM llm_session_locks WHERE session_id = p_session_id AND owner = p_owner;
+$$ LANGUAGE sql;
+
+-- Private bucket for the image blob store (app/utils/blob_store.py, BLOB_STORE=supabase).
+-- Kept apart from the public 'media' bucket because it holds images from user
+-- histories. Change the name here too if BLOB_BUCKET is overridden.
+INSERT INTO storage.buckets (id, name, public) VALUES ('history-blobs', 'history-blobs', false) ON CONFLICT (id) DO NOTHING;
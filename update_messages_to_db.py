@@ -2,8 +2,26 @@
 """
 Script to update main.py to use Supabase database instead of messages.json files
 Run this once to update all message handling
+
+    python update_messages_to_db.py                  # rewrite main.py
+    python update_messages_to_db.py --migrate-data   # copy Data/<user>/<session>/messages.json into llm_messages
+    python update_messages_to_db.py --migrate-data --workers 8 --batch-size 200
+    python update_messages_to_db.py --migrate-data --force    # also overwrite sessions already in llm_messages
+    python update_messages_to_db.py --strip-context --dry-run   # count persisted workspace context copies
+    python update_messages_to_db.py --strip-context             # remove them from llm_messages
 """
+import argparse
+import glob
+import json
+import os
 import re
+import threading
+import time
+
+try:
+    import ijson
+except ImportError:  # optional - a stdlib incremental parser is used when it is not installed
+    ijson = None
 
 def update_main_py():
     with open('app/main.py', 'r') as f:
@@ -30,6 +48,275 @@ def update_main_py():
     print("   - Replaced all messages.json reads with get_messages()")
     print("   - Replaced all messages.json writes with save_messages()")
 
+def iter_messages(path, chunk_size=1 << 20):
+    """
+    Yield the elements of a JSON array file one at a time
+    Only the message being parsed is held in memory; an element larger than
+    the read buffer (e.g. a message with inline images) grows the next read
+    instead of being re-scanned chunk by chunk. Uses ijson when installed.
+    """
+    if ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, started, read_size, eof = "", 0, False, chunk_size, False
+        while True:
+            chunk = f.read(read_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if not started:
+                    if buf[pos] != "[":
+                        raise ValueError(f"{path}: expected a JSON array of messages")
+                    started, pos = True, pos + 1
+                    continue
+                if buf[pos] == "]":
+                    return
+                try:
+                    item, pos = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    read_size = max(read_size, len(buf) - pos)  # incomplete element: read at least as much again
+                    break
+                read_size = chunk_size
+                yield item
+            if eof:
+                raise ValueError(f"{path}: unexpected end of file")
+
+
+def _load_checkpoint(path):
+    """Sessions already migrated: {messages.json path: (size, mtime_ns)}"""
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from an interrupted run
+                done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+    return done
+
+
+def _migrate_session(path, user_id, session_id, batch_size, max_batch_bytes, force=False):
+    """
+    Load a session's messages.json into llm_messages, streamed in batches
+    Returns (messages, batches, bytes), or None when the session already has
+    rows and force is off: the API writes history to the database, so those
+    rows are newer than the file. Runs under the session's database lease so
+    it is serialised with API workers running with MESSAGE_STORE_DB_LOCK=on.
+    """
+    from app.db import MessageStore, session_write_lock
+    from app.db.message_store import build_message_rows
+
+    count, batches, written = 0, 0, 0
+    with session_write_lock(session_id, lease=True):
+        if MessageStore.session_exists(session_id) and not force:
+            return None
+        if not MessageStore.delete_session_messages(session_id):
+            raise RuntimeError(f"could not clear existing rows of {session_id}")
+
+        pending, pending_bytes = [], 0
+
+        def flush():
+            nonlocal batches, written, pending, pending_bytes
+            rows = build_message_rows(user_id, session_id, pending, start_sequence=count - len(pending))
+            timings = MessageStore.bulk_insert(rows, batch_size=batch_size, max_batch_bytes=max_batch_bytes)
+            batches += len(timings)
+            written += sum(t["bytes"] for t in timings)
+            pending, pending_bytes = [], 0
+
+        for message in iter_messages(path):
+            pending.append(message)
+            pending_bytes += len(json.dumps(message, default=str))
+            count += 1
+            if len(pending) >= batch_size or pending_bytes >= max_batch_bytes:
+                flush()
+        if pending:
+            flush()
+    return count, batches, written
+
+
+def migrate_message_files(data_dir="Data", batch_size=None, workers=4, checkpoint=None, restart=False,
+                          force=False):
+    """
+    Copy every legacy messages.json history into llm_messages
+    Files are stream-parsed and written with multi-row inserts, several
+    sessions at a time. Each finished session is appended to a checkpoint file
+    (path, size, mtime), so an interrupted run resumes where it stopped; a
+    session that failed midway is simply rewritten on the next run. Sessions
+    that already have llm_messages rows are skipped (the database history is
+    the live one) unless force is set, which replaces them with the file.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from app.db.message_store import INSERT_BATCH_SIZE, INSERT_BATCH_MAX_BYTES
+
+    batch_size = batch_size or INSERT_BATCH_SIZE
+    checkpoint = checkpoint or os.path.join(data_dir, ".llm_messages_migration.jsonl")
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = _load_checkpoint(checkpoint)
+
+    pending = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "*", "messages.json"))):
+        stat = os.stat(path)
+        if done.get(path) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        session_dir = os.path.dirname(path)
+        pending.append((path, stat, os.path.basename(os.path.dirname(session_dir)), os.path.basename(session_dir)))
+
+    skipped = len(done)
+    print(f"Migrating {len(pending)} sessions from {data_dir}/ with {workers} workers"
+          + (f" ({skipped} already migrated, see {checkpoint})" if skipped else ""))
+
+    checkpoint_lock = threading.Lock()
+    totals = {"sessions": 0, "skipped": 0, "failed": 0, "messages": 0, "batches": 0, "bytes_read": 0,
+              "bytes_written": 0}
+    start = time.perf_counter()
+
+    def run(path, stat, user_id, session_id):
+        session_start = time.perf_counter()
+        result = _migrate_session(path, user_id, session_id, batch_size, INSERT_BATCH_MAX_BYTES, force)
+        if result is None:
+            return None
+        count, batches, written = result
+        with checkpoint_lock:
+            with open(checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                    "messages": count}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return count, batches, written, time.perf_counter() - session_start
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(run, *job): job for job in pending}
+        for future in as_completed(futures):
+            path, stat, user_id, session_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                totals["failed"] += 1
+                print(f"❌ {user_id}/{session_id}: {e}")
+                continue
+            if result is None:
+                totals["skipped"] += 1
+                print(f"⏭️  {user_id}/{session_id}: already in llm_messages (use --force to overwrite)")
+                continue
+            count, batches, written, seconds = result
+            totals["sessions"] += 1
+            totals["messages"] += count
+            totals["batches"] += batches
+            totals["bytes_read"] += stat.st_size
+            totals["bytes_written"] += written
+            elapsed = time.perf_counter() - start
+            print(f"✅ {user_id}/{session_id}: {count} messages in {batches} batches ({seconds:.2f}s) "
+                  f"[{totals['sessions']}/{len(pending)}, {totals['messages'] / elapsed:.0f} msg/s]")
+
+    elapsed = time.perf_counter() - start
+    mb_read = totals["bytes_read"] / (1024 * 1024)
+    print(f"\nMigrated {totals['sessions']} sessions, {totals['messages']} messages in {totals['batches']} batches "
+          f"in {elapsed:.1f}s: {totals['messages'] / elapsed if elapsed else 0:.0f} messages/s, "
+          f"{mb_read / elapsed if elapsed else 0:.2f} MB/s read, "
+          f"{totals['bytes_written'] / (1024 * 1024):.1f} MB written")
+    if totals["skipped"]:
+        print(f"{totals['skipped']} sessions already had llm_messages rows and were left as is")
+    if totals["failed"]:
+        print(f"{totals['failed']} sessions failed; rerun to retry them")
+    return totals
+
+
+def _strip_session(user_id, session_id, dry_run):
+    """Remove the workspace context messages stored in one session; returns (messages removed, tokens removed)"""
+    from app.db import get_messages, save_messages, session_write_lock
+    from app.utils.context_window import WORKSPACE_CONTEXT_HEADER, CHARS_PER_TOKEN
+
+    with session_write_lock(session_id):
+        messages = get_messages(session_id)
+        kept, chars = [], 0
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str) and content.startswith(WORKSPACE_CONTEXT_HEADER):
+                chars += len(content)
+            else:
+                kept.append(message)
+        removed = len(messages) - len(kept)
+        if removed and not dry_run and not save_messages(user_id, session_id, kept):
+            raise RuntimeError(f"could not save the cleaned history of {session_id}")
+    return removed, chars // CHARS_PER_TOKEN
+
+
+def strip_workspace_context(sessions=None, workers=4, dry_run=False):
+    """
+    Remove workspace context copies persisted in llm_messages by earlier generators
+    Workspace context is now sent with the model request only (LLM_inference
+    context=...), but older histories still carry one full copy per generation.
+    Every session in the message store (or the given [(user, session)] pairs)
+    is rewritten without them under its write lock; the rest of the history
+    is left as is.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from app.db import get_backend
+
+    if sessions is None:
+        sessions = get_backend().list_sessions()
+    print(f"{'Scanning' if dry_run else 'Cleaning'} {len(sessions)} sessions with {workers} workers")
+
+    totals = {"sessions": 0, "cleaned": 0, "failed": 0, "messages_removed": 0, "tokens_removed": 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(_strip_session, user_id, session_id, dry_run): (user_id, session_id)
+                   for user_id, session_id in sessions}
+        for future in as_completed(futures):
+            user_id, session_id = futures[future]
+            try:
+                removed, tokens = future.result()
+            except Exception as e:
+                totals["failed"] += 1
+                print(f"❌ {user_id}/{session_id}: {e}")
+                continue
+            totals["sessions"] += 1
+            if removed:
+                totals["cleaned"] += 1
+                totals["messages_removed"] += removed
+                totals["tokens_removed"] += tokens
+                print(f"✅ {user_id}/{session_id}: {removed} context copies (~{tokens} tokens)")
+
+    print(f"\n{'Would remove' if dry_run else 'Removed'} {totals['messages_removed']} context copies "
+          f"(~{totals['tokens_removed']} tokens) from {totals['cleaned']} of {totals['sessions']} sessions")
+    if totals["failed"]:
+        print(f"{totals['failed']} sessions failed; rerun to retry them")
+    return totals
+
+
 if __name__ == "__main__":
-    update_main_py()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--migrate-data", action="store_true", help="migrate Data/*/*/messages.json into llm_messages")
+    parser.add_argument("--data-dir", default="Data")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows per insert request")
+    parser.add_argument("--workers", type=int, default=4, help="sessions migrated in parallel")
+    parser.add_argument("--checkpoint", default=None, help="progress file (default <data-dir>/.llm_messages_migration.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and migrate every session again")
+    parser.add_argument("--force", action="store_true",
+                        help="with --migrate-data: replace sessions that already have llm_messages rows")
+    parser.add_argument("--strip-context", action="store_true", help="remove persisted workspace context copies from llm_messages")
+    parser.add_argument("--session", action="append", default=None, metavar="USER/SESSION",
+                        help="only clean these sessions (default: every session in llm_messages)")
+    parser.add_argument("--dry-run", action="store_true", help="with --strip-context: only report what would be removed")
+    args = parser.parse_args()
+
+    if args.strip_context:
+        sessions = [tuple(s.split("/", 1)) for s in args.session] if args.session else None
+        strip_workspace_context(sessions, args.workers, args.dry_run)
+    elif args.migrate_data:
+        migrate_message_files(args.data_dir, args.batch_size, args.workers, args.checkpoint, args.restart,
+                              args.force)
+    else:
+        update_main_py()
 